@@ -0,0 +1,76 @@
+"""initial schema
+
+Revision ID: 3f2a9c1d7e10
+Revises: 
+Create Date: 2026-10-17 12:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '3f2a9c1d7e10'
+down_revision: Union[str, None] = None
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        'users',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('username', sa.String(), nullable=True),
+        sa.Column('phone', sa.String(), nullable=True),
+        sa.Column('password', sa.String(), nullable=True),
+        sa.Column('name', sa.String(), nullable=True),
+        sa.Column('city', sa.String(), nullable=True),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_users_city', 'users', ['city'], unique=False)
+    op.create_index('ix_users_id', 'users', ['id'], unique=False)
+    op.create_index('ix_users_username', 'users', ['username'], unique=True)
+    op.create_table(
+        'announcements',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('type', sa.String(), nullable=True),
+        sa.Column('price', sa.Integer(), nullable=True),
+        sa.Column('address', sa.String(), nullable=True),
+        sa.Column('area', sa.Float(), nullable=True),
+        sa.Column('rooms_count', sa.Integer(), nullable=True),
+        sa.Column('description', sa.String(), nullable=True),
+        sa.Column('user_id', sa.Integer(), nullable=True),
+        sa.Column('comment_count', sa.Integer(), nullable=True),
+        sa.ForeignKeyConstraint(['user_id'], ['users.id']),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_announcements_id', 'announcements', ['id'], unique=False)
+    op.create_index('ix_announcements_price', 'announcements', ['price'], unique=False)
+    op.create_index('ix_announcements_type', 'announcements', ['type'], unique=False)
+    op.create_table(
+        'comments',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('content', sa.String(), nullable=False),
+        sa.Column('created_at', sa.DateTime(timezone=True), server_default=sa.text('(CURRENT_TIMESTAMP)'), nullable=True),
+        sa.Column('author_id', sa.Integer(), nullable=True),
+        sa.Column('ads_id', sa.Integer(), nullable=True),
+        sa.ForeignKeyConstraint(['ads_id'], ['announcements.id']),
+        sa.ForeignKeyConstraint(['author_id'], ['users.id']),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_comments_id', 'comments', ['id'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_comments_id', table_name='comments')
+    op.drop_table('comments')
+    op.drop_index('ix_announcements_type', table_name='announcements')
+    op.drop_index('ix_announcements_price', table_name='announcements')
+    op.drop_index('ix_announcements_id', table_name='announcements')
+    op.drop_table('announcements')
+    op.drop_index('ix_users_username', table_name='users')
+    op.drop_index('ix_users_id', table_name='users')
+    op.drop_index('ix_users_city', table_name='users')
+    op.drop_table('users')
@@ -0,0 +1,50 @@
+"""search composite indexes
+
+Revision ID: 8b4e61f0c2a7
+Revises: 3f2a9c1d7e10
+Create Date: 2026-10-17 12:30:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = '8b4e61f0c2a7'
+down_revision: Union[str, None] = '3f2a9c1d7e10'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # Single-column indexes keep rowid (= id) order inside each key, so
+    # "rooms_count = ? ORDER BY id LIMIT n" and keyset pages seek without a
+    # sort. The composites cover the equality + price range combinations
+    # used by the counts. (type, ...) composites make the lone type index
+    # redundant.
+    op.drop_index('ix_announcements_type', table_name='announcements')
+    op.create_index('ix_announcements_rooms_count', 'announcements', ['rooms_count'], unique=False)
+    op.create_index('ix_announcements_user_id', 'announcements', ['user_id'], unique=False)
+    op.create_index('ix_announcements_type_rooms_count', 'announcements',
+                    ['type', 'rooms_count'], unique=False)
+    op.create_index('ix_announcements_type_price', 'announcements',
+                    ['type', 'price'], unique=False)
+    op.create_index('ix_announcements_rooms_count_price', 'announcements',
+                    ['rooms_count', 'price'], unique=False)
+    op.create_index('ix_announcements_type_rooms_count_price', 'announcements',
+                    ['type', 'rooms_count', 'price'], unique=False)
+    op.create_index('ix_comments_ads_id', 'comments', ['ads_id'], unique=False)
+    op.create_index('ix_comments_author_id', 'comments', ['author_id'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_comments_author_id', table_name='comments')
+    op.drop_index('ix_comments_ads_id', table_name='comments')
+    op.drop_index('ix_announcements_type_rooms_count_price', table_name='announcements')
+    op.drop_index('ix_announcements_rooms_count_price', table_name='announcements')
+    op.drop_index('ix_announcements_type_price', table_name='announcements')
+    op.drop_index('ix_announcements_type_rooms_count', table_name='announcements')
+    op.drop_index('ix_announcements_user_id', table_name='announcements')
+    op.drop_index('ix_announcements_rooms_count', table_name='announcements')
+    op.create_index('ix_announcements_type', 'announcements', ['type'], unique=False)
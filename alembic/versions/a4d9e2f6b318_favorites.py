@@ -0,0 +1,38 @@
+"""favorites
+
+Revision ID: a4d9e2f6b318
+Revises: f3c82d6a1b07
+Create Date: 2026-10-17 15:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'a4d9e2f6b318'
+down_revision: Union[str, None] = 'f3c82d6a1b07'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # The (user_id, announcement_id) primary key doubles as the unique index
+    # and as the seek path for one user's favorites list.
+    op.create_table(
+        'favorites',
+        sa.Column('user_id', sa.Integer(), nullable=False),
+        sa.Column('announcement_id', sa.Integer(), nullable=False),
+        sa.Column('created_at', sa.DateTime(timezone=True), server_default=sa.text('(CURRENT_TIMESTAMP)'), nullable=True),
+        sa.ForeignKeyConstraint(['announcement_id'], ['announcements.id'], ondelete='CASCADE'),
+        sa.ForeignKeyConstraint(['user_id'], ['users.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('user_id', 'announcement_id')
+    )
+    op.create_index('ix_favorites_announcement_id', 'favorites', ['announcement_id'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_favorites_announcement_id', table_name='favorites')
+    op.drop_table('favorites')
@@ -0,0 +1,37 @@
+"""announcement counters
+
+Revision ID: b7e3f05c9d21
+Revises: a4d9e2f6b318
+Create Date: 2026-10-17 16:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'b7e3f05c9d21'
+down_revision: Union[str, None] = 'a4d9e2f6b318'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('announcements', sa.Column('favorites_count', sa.Integer(), server_default='0', nullable=False))
+    op.add_column('announcements', sa.Column('view_count', sa.Integer(), server_default='0', nullable=False))
+    # Start from counts that match the source tables; comment_count was kept
+    # by read-modify-write in the handlers and may have drifted.
+    op.execute(
+        "UPDATE announcements SET "
+        "comment_count = (SELECT count(*) FROM comments WHERE comments.ads_id = announcements.id), "
+        "favorites_count = (SELECT count(*) FROM favorites WHERE favorites.announcement_id = announcements.id)"
+    )
+
+
+def downgrade() -> None:
+    # Plain DROP COLUMN (SQLite 3.35+): a batch table rebuild would drop the
+    # FTS triggers on announcements.
+    op.drop_column('announcements', 'view_count')
+    op.drop_column('announcements', 'favorites_count')
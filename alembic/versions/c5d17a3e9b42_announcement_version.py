@@ -0,0 +1,31 @@
+"""announcement version and updated_at
+
+Revision ID: c5d17a3e9b42
+Revises: 8b4e61f0c2a7
+Create Date: 2026-10-17 13:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c5d17a3e9b42'
+down_revision: Union[str, None] = '8b4e61f0c2a7'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('announcements', sa.Column('version', sa.Integer(), server_default='1', nullable=False))
+    # SQLite cannot ADD COLUMN with a non-constant default, so backfill.
+    op.add_column('announcements', sa.Column('updated_at', sa.DateTime(timezone=True), nullable=True))
+    op.execute("UPDATE announcements SET updated_at = CURRENT_TIMESTAMP")
+
+
+def downgrade() -> None:
+    with op.batch_alter_table('announcements') as batch_op:
+        batch_op.drop_column('updated_at')
+        batch_op.drop_column('version')
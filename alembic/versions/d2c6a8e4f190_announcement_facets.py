@@ -0,0 +1,44 @@
+"""announcement facets
+
+Revision ID: d2c6a8e4f190
+Revises: b7e3f05c9d21
+Create Date: 2026-10-17 17:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'd2c6a8e4f190'
+down_revision: Union[str, None] = 'b7e3f05c9d21'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# Same bounds as repositories.PRICE_BUCKETS at the time of this revision.
+PRICE_BUCKETS = [0, 50000, 100000, 150000, 200000, 300000, 500000, 1000000]
+
+
+def upgrade() -> None:
+    op.create_table(
+        'announcement_facets',
+        sa.Column('type', sa.String(), nullable=False),
+        sa.Column('rooms_count', sa.Integer(), nullable=False),
+        sa.Column('price_bucket', sa.Integer(), nullable=False),
+        sa.Column('count', sa.Integer(), nullable=False),
+        sa.PrimaryKeyConstraint('type', 'rooms_count', 'price_bucket')
+    )
+    bucket = "CASE %s ELSE 0 END" % " ".join("WHEN price >= %d THEN %d" % (bound, bound)
+                                             for bound in reversed(PRICE_BUCKETS[1:]))
+    op.execute(
+        "INSERT INTO announcement_facets (type, rooms_count, price_bucket, count) "
+        "SELECT type, rooms_count, %s, count(*) FROM announcements "
+        "WHERE type IS NOT NULL AND rooms_count IS NOT NULL AND price IS NOT NULL "
+        "GROUP BY type, rooms_count, %s" % (bucket, bucket)
+    )
+
+
+def downgrade() -> None:
+    op.drop_table('announcement_facets')
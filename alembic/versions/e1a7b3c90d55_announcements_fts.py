@@ -0,0 +1,51 @@
+"""announcements full-text index
+
+Revision ID: e1a7b3c90d55
+Revises: c5d17a3e9b42
+Create Date: 2026-10-17 13:30:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e1a7b3c90d55'
+down_revision: Union[str, None] = 'c5d17a3e9b42'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+FTS_DDL = [
+    "CREATE VIRTUAL TABLE IF NOT EXISTS announcements_fts USING fts5("
+    "address, description, content='announcements', content_rowid='id', "
+    "tokenize='unicode61 remove_diacritics 2')",
+    "CREATE TRIGGER IF NOT EXISTS announcements_fts_ai AFTER INSERT ON announcements BEGIN "
+    "INSERT INTO announcements_fts(rowid, address, description) "
+    "VALUES (new.id, new.address, new.description); END",
+    "CREATE TRIGGER IF NOT EXISTS announcements_fts_ad AFTER DELETE ON announcements BEGIN "
+    "INSERT INTO announcements_fts(announcements_fts, rowid, address, description) "
+    "VALUES ('delete', old.id, old.address, old.description); END",
+    "CREATE TRIGGER IF NOT EXISTS announcements_fts_au AFTER UPDATE OF address, description ON announcements BEGIN "
+    "INSERT INTO announcements_fts(announcements_fts, rowid, address, description) "
+    "VALUES ('delete', old.id, old.address, old.description); "
+    "INSERT INTO announcements_fts(rowid, address, description) "
+    "VALUES (new.id, new.address, new.description); END",
+]
+
+
+def upgrade() -> None:
+    if op.get_bind().dialect.name != 'sqlite':
+        return
+    for statement in FTS_DDL:
+        op.execute(statement)
+    op.execute("INSERT INTO announcements_fts(announcements_fts) VALUES ('rebuild')")
+
+
+def downgrade() -> None:
+    if op.get_bind().dialect.name != 'sqlite':
+        return
+    op.execute("DROP TRIGGER IF EXISTS announcements_fts_au")
+    op.execute("DROP TRIGGER IF EXISTS announcements_fts_ad")
+    op.execute("DROP TRIGGER IF EXISTS announcements_fts_ai")
+    op.execute("DROP TABLE IF EXISTS announcements_fts")
@@ -0,0 +1,56 @@
+"""announcement coordinates
+
+Revision ID: e8f4b1a7c362
+Revises: d2c6a8e4f190
+Create Date: 2026-10-17 18:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e8f4b1a7c362'
+down_revision: Union[str, None] = 'd2c6a8e4f190'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+RTREE_DDL = [
+    "CREATE VIRTUAL TABLE IF NOT EXISTS announcements_rtree USING rtree(id, min_lat, max_lat, min_lon, max_lon)",
+    "CREATE TRIGGER IF NOT EXISTS announcements_rtree_ai AFTER INSERT ON announcements "
+    "WHEN new.latitude IS NOT NULL AND new.longitude IS NOT NULL BEGIN "
+    "INSERT INTO announcements_rtree VALUES (new.id, new.latitude, new.latitude, new.longitude, new.longitude); END",
+    "CREATE TRIGGER IF NOT EXISTS announcements_rtree_ad AFTER DELETE ON announcements BEGIN "
+    "DELETE FROM announcements_rtree WHERE id = old.id; END",
+    "CREATE TRIGGER IF NOT EXISTS announcements_rtree_au AFTER UPDATE OF latitude, longitude ON announcements BEGIN "
+    "DELETE FROM announcements_rtree WHERE id = old.id; "
+    "INSERT INTO announcements_rtree SELECT new.id, new.latitude, new.latitude, new.longitude, new.longitude "
+    "WHERE new.latitude IS NOT NULL AND new.longitude IS NOT NULL; END",
+]
+
+
+def upgrade() -> None:
+    op.add_column('announcements', sa.Column('latitude', sa.Float(), nullable=True))
+    op.add_column('announcements', sa.Column('longitude', sa.Float(), nullable=True))
+    op.create_index('ix_announcements_latitude_longitude', 'announcements', ['latitude', 'longitude'], unique=False)
+    if op.get_bind().dialect.name != 'sqlite':
+        return
+    # Existing rows have no coordinates yet; `manage.py geocode` fills them
+    # and the update trigger indexes them.
+    for statement in RTREE_DDL:
+        op.execute(statement)
+
+
+def downgrade() -> None:
+    if op.get_bind().dialect.name == 'sqlite':
+        op.execute("DROP TRIGGER IF EXISTS announcements_rtree_au")
+        op.execute("DROP TRIGGER IF EXISTS announcements_rtree_ad")
+        op.execute("DROP TRIGGER IF EXISTS announcements_rtree_ai")
+        op.execute("DROP TABLE IF EXISTS announcements_rtree")
+    op.drop_index('ix_announcements_latitude_longitude', table_name='announcements')
+    # Plain DROP COLUMN (SQLite 3.35+): a batch table rebuild would drop the
+    # FTS triggers on announcements.
+    op.drop_column('announcements', 'longitude')
+    op.drop_column('announcements', 'latitude')
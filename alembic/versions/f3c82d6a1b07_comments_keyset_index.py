@@ -0,0 +1,30 @@
+"""comments keyset index
+
+Revision ID: f3c82d6a1b07
+Revises: e1a7b3c90d55
+Create Date: 2026-10-17 14:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'f3c82d6a1b07'
+down_revision: Union[str, None] = 'e1a7b3c90d55'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # Comment pages seek on (ads_id, created_at, id); the ads_id prefix also
+    # serves every plain "comments of this announcement" lookup.
+    op.create_index('ix_comments_ads_id_created_at_id', 'comments',
+                    ['ads_id', 'created_at', 'id'], unique=False)
+    op.drop_index('ix_comments_ads_id', table_name='comments')
+
+
+def downgrade() -> None:
+    op.create_index('ix_comments_ads_id', 'comments', ['ads_id'], unique=False)
+    op.drop_index('ix_comments_ads_id_created_at_id', table_name='comments')
@@ -0,0 +1,41 @@
+"""task outbox
+
+Revision ID: f5a0c3d8b627
+Revises: e8f4b1a7c362
+Create Date: 2026-10-17 19:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'f5a0c3d8b627'
+down_revision: Union[str, None] = 'e8f4b1a7c362'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        'task_outbox',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('name', sa.String(), nullable=False),
+        sa.Column('payload', sa.String(), nullable=False),
+        sa.Column('attempts', sa.Integer(), server_default='0', nullable=False),
+        sa.Column('available_at', sa.Float(), nullable=True),
+        sa.Column('claimed_until', sa.Float(), nullable=True),
+        sa.Column('last_error', sa.String(), nullable=True),
+        sa.Column('created_at', sa.DateTime(timezone=True), server_default=sa.text('(CURRENT_TIMESTAMP)'), nullable=True),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_task_outbox_id', 'task_outbox', ['id'], unique=False)
+    op.create_index('ix_task_outbox_available_at', 'task_outbox', ['available_at'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_task_outbox_available_at', table_name='task_outbox')
+    op.drop_index('ix_task_outbox_id', table_name='task_outbox')
+    op.drop_table('task_outbox')
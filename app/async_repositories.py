@@ -0,0 +1,83 @@
+from datetime import datetime
+from typing import AsyncIterator, List, Optional, Tuple
+
+from sqlalchemy import Row, Select
+from sqlalchemy.ext.asyncio import AsyncSession
+from starlette.concurrency import run_in_threadpool
+
+from database import run_sync
+from repositories import UsersRepository, AnnouncementsRepository, CommentsRepository, FavoritesRepository
+
+
+class AsyncRepository:
+    """Awaitable facade over one of the sync repositories.
+
+    Every method takes the session as its first argument, exactly like the
+    wrapped repository. With an AsyncSession the call runs through
+    ``AsyncSession.run_sync`` so the query goes through the async driver
+    without blocking the event loop; with a plain Session (DB_ASYNC=false)
+    it runs in the threadpool, which keeps the old blocking path available
+    for comparison.
+    """
+
+    repository_class = None
+
+    def __init__(self, *args, **kwargs):
+        self.repository = self.repository_class(*args, **kwargs)
+
+    def __getattr__(self, name: str):
+        # Only the repository's public methods are proxied: its attributes
+        # (cache, tasks, ...) and anything probing for dunders must not come
+        # back as coroutine functions.
+        method = None if name.startswith("_") else getattr(self.repository, name, None)
+        if not callable(method):
+            raise AttributeError("%s has no method %r" % (type(self).__name__, name))
+
+        async def call(db, *args, **kwargs):
+            return await run_sync(db, method, *args, **kwargs)
+
+        call.__name__ = name
+        return call
+
+    async def stream(self, db, statement: Select, chunk_size: int = 500) -> AsyncIterator[List[Row]]:
+        """Yield the rows of ``statement`` in chunks from a server-side cursor.
+
+        Only one chunk is held in memory at a time, whatever the result size.
+        """
+        statement = statement.execution_options(yield_per=chunk_size)
+        if isinstance(db, AsyncSession):
+            result = await db.stream(statement)
+            async for partition in result.partitions():
+                yield partition
+            return
+
+        result = await run_in_threadpool(db.execute, statement)
+        partitions = result.partitions()
+        while True:
+            partition = await run_in_threadpool(next, partitions, None)
+            if partition is None:
+                return
+            yield partition
+
+
+class AsyncUsersRepository(AsyncRepository):
+    repository_class = UsersRepository
+
+
+class AsyncAnnouncementsRepository(AsyncRepository):
+    repository_class = AnnouncementsRepository
+
+    def stream_announcements(self, db, user_id: Optional[int] = None) -> AsyncIterator[List[Row]]:
+        return self.stream(db, self.repository.export_statement(user_id))
+
+
+class AsyncCommentsRepository(AsyncRepository):
+    repository_class = CommentsRepository
+
+    def stream_comments(self, db, ads_id: int,
+                        after: Optional[Tuple[datetime, int]] = None) -> AsyncIterator[List[Row]]:
+        return self.stream(db, self.repository.comments_statement(ads_id, after))
+
+
+class AsyncFavoritesRepository(AsyncRepository):
+    repository_class = FavoritesRepository
@@ -0,0 +1,84 @@
+import time
+from typing import Optional
+
+from fastapi import Depends, HTTPException, Request
+from fastapi.security import OAuth2PasswordBearer
+from pydantic import BaseModel
+
+from cache import LRUCache, MISSING
+from config import Settings
+
+oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/auth/users/login")
+
+DECODE_OPTIONS = {"require_exp": True, "require_iat": True, "require_sub": True}
+
+
+class TokenClaims(BaseModel):
+    id: int
+    username: str
+    iat: int
+    exp: int
+
+
+def unauthorized() -> HTTPException:
+    return HTTPException(status_code=401, detail="Unauthorized", headers={"WWW-Authenticate": "Bearer"})
+
+
+class TokenIssuer:
+    """Signs and verifies one app's JWTs with its secret, algorithm and lifetime.
+
+    Verified claims are kept per token: signature checks are the bulk of
+    the auth cost and a token is re-sent on every request, so a hit skips
+    the HMAC and the JSON parsing entirely. Expiry is still checked on
+    every hit.
+    """
+
+    def __init__(self, secret: str, algorithm: str = "HS256", ttl: int = 3600,
+                 cache_maxsize: int = 10000, cache_ttl: float = 300):
+        self.secret = secret
+        self.algorithm = algorithm
+        self.ttl = ttl
+        self.claims_cache = LRUCache(cache_maxsize, cache_ttl)
+
+    def create(self, id: int, username: str, now: Optional[float] = None) -> str:
+        from jose import jwt
+
+        issued_at = int(time.time() if now is None else now)
+        body = {"sub": str(id), "username": username, "iat": issued_at, "exp": issued_at + self.ttl}
+        return jwt.encode(body, self.secret, self.algorithm)
+
+    def decode(self, token: str) -> TokenClaims:
+        """Verify the signature and the exp/iat claims of ``token``."""
+        # python-jose pulls in the cryptography backends; most requests are
+        # served from claims_cache, so load it on the first miss instead of at import.
+        from jose import JWTError, jwt
+
+        try:
+            data = jwt.decode(token, self.secret, algorithms=[self.algorithm], options=DECODE_OPTIONS)
+            return TokenClaims(id=int(data["sub"]), username=data["username"], iat=data["iat"], exp=data["exp"])
+        except (JWTError, KeyError, ValueError):
+            raise unauthorized()
+
+    def verify(self, token: str) -> TokenClaims:
+        claims = self.claims_cache.get(token)
+        if claims is MISSING:
+            claims = self.decode(token)
+            self.claims_cache.set(token, claims)
+        if claims.exp <= time.time():
+            self.claims_cache.delete(token)
+            raise unauthorized()
+        return claims
+
+
+def build_token_issuer(settings: Settings) -> TokenIssuer:
+    return TokenIssuer(settings.jwt_secret, settings.jwt_algorithm, settings.jwt_ttl,
+                       settings.jwt_cache_maxsize, settings.jwt_cache_ttl)
+
+
+async def current_user(request: Request, token: str = Depends(oauth2_scheme)) -> TokenClaims:
+    """Claims of the bearer token; handlers read the user id from here.
+
+    The issuer is looked up in ``app.state.tokens`` when the request comes
+    in, so each app verifies with its own settings.
+    """
+    return request.app.state.tokens.verify(token)
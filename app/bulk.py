@@ -0,0 +1,170 @@
+"""Streaming bulk import and export of announcements as NDJSON or CSV."""
+import csv
+import io
+import json
+import math
+from typing import AsyncIterator, Awaitable, Callable, List, Optional, Tuple
+
+from pydantic import ValidationError
+
+from models import AnnouncementRequest, AnnouncementResponse
+
+EXPORT_FIELDS = list(AnnouncementResponse.model_fields)
+
+# CSV has no null: the export writes a missing latitude or longitude as an
+# empty cell, and an empty cell in one of these columns reads back as None.
+OPTIONAL_FIELDS = {name for name, field in AnnouncementRequest.model_fields.items() if not field.is_required()}
+
+Record = Tuple[int, Optional[dict], Optional[str]]
+
+
+async def iter_lines(chunks: AsyncIterator[bytes]) -> AsyncIterator[str]:
+    # Splitting the raw bytes on b"\n" is safe for UTF-8: no multi-byte
+    # sequence contains that byte.
+    buffer = b""
+    lines_seen = 0
+    async for chunk in chunks:
+        buffer += chunk
+        *lines, buffer = buffer.split(b"\n")
+        for line in lines:
+            text = line.decode("utf-8").rstrip("\r")
+            yield text if lines_seen else text.lstrip("\ufeff")
+            lines_seen += 1
+    if buffer:
+        text = buffer.decode("utf-8").rstrip("\r")
+        yield text if lines_seen else text.lstrip("\ufeff")
+
+
+async def ndjson_records(lines: AsyncIterator[str]) -> AsyncIterator[Record]:
+    row = 0
+    async for line in lines:
+        if not line.strip():
+            continue
+        row += 1
+        try:
+            record = json.loads(line)
+        except ValueError as e:
+            yield row, None, "invalid JSON: %s" % e
+            continue
+        if not isinstance(record, dict):
+            yield row, None, "expected a JSON object"
+            continue
+        yield row, record, None
+
+
+async def csv_records(lines: AsyncIterator[str]) -> AsyncIterator[Record]:
+    """Rows of a CSV body with a header line.
+
+    A quoted field may span lines, so physical lines are joined until the
+    quotes balance before the record is parsed. The parity is kept as each
+    line comes in and the lines are joined once, so a long multi-line field
+    costs linear time.
+    """
+    header = None
+    row = 0
+    pending = []
+    in_quotes = False
+    async for line in lines:
+        pending.append(line)
+        in_quotes ^= line.count('"') % 2 == 1
+        if in_quotes:
+            continue
+        text = "\n".join(pending)
+        pending = []
+        if not text.strip():
+            continue
+        try:
+            values = next(csv.reader([text]))
+        except csv.Error as e:
+            if header is None:
+                raise
+            row += 1
+            yield row, None, "invalid CSV: %s" % e
+            continue
+        if header is None:
+            header = [name.strip() for name in values]
+            continue
+        row += 1
+        if len(values) != len(header):
+            yield row, None, "expected %d columns, got %d" % (len(header), len(values))
+            continue
+        yield row, {name: None if name in OPTIONAL_FIELDS and not value.strip() else value
+                    for name, value in zip(header, values)}, None
+    if pending:
+        yield row + 1, None, "unterminated quoted field"
+
+
+def error_messages(error: ValidationError) -> List[str]:
+    return ["%s: %s" % (".".join(str(part) for part in item["loc"]) or "row", item["msg"])
+            for item in error.errors()]
+
+
+async def import_announcements(records: AsyncIterator[Record], user_id: int,
+                               insert_many: Callable[[List[dict]], Awaitable[int]],
+                               chunk_size: int, max_rows: int,
+                               admit: Optional[Callable[[int], Awaitable[float]]] = None) -> dict:
+    """Validate records and insert the valid ones ``chunk_size`` at a time.
+
+    Each chunk is one executemany and one transaction, so a failed request
+    keeps the chunks committed before it; the report lists every rejected
+    row by its 1-based position in the body.
+
+    ``admit(rows)`` is asked before each chunk and returns the seconds to
+    wait before that many rows may be written, 0 when they may. The import
+    stops at the first refused chunk: the report then carries
+    ``retry_after`` and, as its last error, the row to resume from.
+    """
+    inserted = 0
+    errors = []
+    batch = []
+    first_row = 0
+    async for row, record, error in records:
+        if row > max_rows:
+            errors.append({"row": row, "errors": ["row limit of %d exceeded" % max_rows]})
+            break
+        if error is None:
+            try:
+                announcement = AnnouncementRequest.model_validate(record)
+            except ValidationError as e:
+                errors.append({"row": row, "errors": error_messages(e)})
+                continue
+            if not batch:
+                first_row = row
+            batch.append(dict(announcement.model_dump(), user_id=user_id))
+        else:
+            errors.append({"row": row, "errors": [error]})
+        if len(batch) >= chunk_size:
+            wait = await admit(len(batch)) if admit is not None else 0
+            if wait > 0:
+                return refused(inserted, errors, first_row, wait)
+            inserted += await insert_many(batch)
+            batch = []
+    if batch:
+        wait = await admit(len(batch)) if admit is not None else 0
+        if wait > 0:
+            return refused(inserted, errors, first_row, wait)
+        inserted += await insert_many(batch)
+    return {"inserted": inserted, "failed": len(errors), "errors": errors}
+
+
+def refused(inserted: int, errors: List[dict], row: int, wait: float) -> dict:
+    errors.append({"row": row, "errors": ["row rate limit reached; rows from here on were not imported"]})
+    return {"inserted": inserted, "failed": len(errors), "errors": errors, "retry_after": math.ceil(wait)}
+
+
+async def ndjson_export(chunks: AsyncIterator[list]) -> AsyncIterator[str]:
+    async for rows in chunks:
+        yield "".join(json.dumps(row._asdict(), ensure_ascii=False) + "\n" for row in rows)
+
+
+async def csv_export(chunks: AsyncIterator[list]) -> AsyncIterator[str]:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(EXPORT_FIELDS)
+    async for rows in chunks:
+        writer.writerows(rows)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()
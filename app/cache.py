@@ -0,0 +1,148 @@
+import asyncio
+import json
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Optional
+
+from sqlalchemy.util import await_only
+from starlette.concurrency import run_in_threadpool
+
+from config import Settings
+
+MISSING = object()
+
+
+class Cache:
+    """Key/value cache interface used in front of the repositories.
+
+    Values must be JSON-compatible (dicts, lists, str, numbers) so every
+    backend can store them.
+    """
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: str) -> Any:
+        return MISSING
+
+    def set(self, key: str, value: Any) -> None:
+        pass
+
+    def delete(self, *keys: str) -> None:
+        pass
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "backend": type(self).__name__,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else None,
+        }
+
+
+class NullCache(Cache):
+    def get(self, key: str) -> Any:
+        self.misses += 1
+        return MISSING
+
+
+class LRUCache(Cache):
+    """In-process, size-bounded LRU with a per-entry TTL."""
+
+    def __init__(self, maxsize: int = 10000, ttl: float = 60):
+        super().__init__()
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.data = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key: str) -> Any:
+        with self.lock:
+            entry = self.data.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                if entry is not None:
+                    del self.data[key]
+                    self.evictions += 1
+                self.misses += 1
+                return MISSING
+            self.data.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key: str, value: Any) -> None:
+        with self.lock:
+            self.data[key] = (time.monotonic() + self.ttl, value)
+            self.data.move_to_end(key)
+            while len(self.data) > self.maxsize:
+                self.data.popitem(last=False)
+                self.evictions += 1
+
+    def delete(self, *keys: str) -> None:
+        with self.lock:
+            for key in keys:
+                self.data.pop(key, None)
+
+    def stats(self) -> dict:
+        stats = super().stats()
+        stats.update(size=len(self.data), maxsize=self.maxsize, ttl=self.ttl)
+        return stats
+
+
+class RedisCache(Cache):
+    """Backend for any client with the redis-py get/set/delete API.
+
+    Expiry and eviction are left to the server (``maxmemory-policy``), so
+    the eviction counter stays at zero here; read it from ``INFO stats``.
+
+    The repositories call the cache from sync code. With DB_ASYNC that code
+    runs inside ``AsyncSession.run_sync`` on the event loop's thread, where
+    a redis-py round trip would stall every request in flight: there each
+    call goes to the threadpool and the session's greenlet waits for it,
+    as it waits for the async database driver. Called from a worker thread
+    (DB_ASYNC=false), it runs in place.
+    """
+
+    def __init__(self, client, ttl: float = 60, prefix: str = "shanyrak:"):
+        super().__init__()
+        self.client = client
+        self.ttl = ttl
+        self.prefix = prefix
+
+    def call(self, method, *args, **kwargs) -> Any:
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            return method(*args, **kwargs)
+        return await_only(run_in_threadpool(method, *args, **kwargs))
+
+    def get(self, key: str) -> Any:
+        raw = self.call(self.client.get, self.prefix + key)
+        if raw is None:
+            self.misses += 1
+            return MISSING
+        self.hits += 1
+        return json.loads(raw)
+
+    def set(self, key: str, value: Any) -> None:
+        self.call(self.client.set, self.prefix + key, json.dumps(value), ex=max(int(self.ttl), 1))
+
+    def delete(self, *keys: str) -> None:
+        if keys:
+            self.call(self.client.delete, *(self.prefix + key for key in keys))
+
+
+def build_cache(settings: Settings, client: Optional[Any] = None) -> Cache:
+    if settings.cache_backend == "memory":
+        return LRUCache(settings.cache_maxsize, settings.cache_ttl)
+    if settings.cache_backend == "redis":
+        if client is None:
+            import redis
+
+            client = redis.Redis.from_url(settings.redis_url)
+        return RedisCache(client, settings.cache_ttl)
+    return NullCache()
@@ -0,0 +1,122 @@
+import os
+from pathlib import Path
+from typing import Literal
+
+from pydantic import BaseModel
+
+
+def env_bool(name: str, default: bool) -> bool:
+    value = os.getenv(name)
+    if value is None:
+        return default
+    return value.strip().lower() in ("1", "true", "yes", "on")
+
+
+class Settings(BaseModel):
+    database_url: str = "sqlite:///./sql_app.db"
+    db_async: bool = True
+
+    db_pool_size: int = 5
+    db_max_overflow: int = 10
+    db_pool_timeout: float = 30
+    db_pool_recycle: int = 1800
+    db_pool_pre_ping: bool = True
+
+    # Comma-separated read-only copies of database_url for GET endpoints.
+    db_replica_urls: str = ""
+    db_replica_balance: Literal["round_robin", "least_connections"] = "round_robin"
+    db_replica_max_lag: float = 5
+    db_replica_eject_seconds: float = 10
+    db_replica_check_interval: float = 2
+    # After a write, the client reads from the primary for this long.
+    db_read_primary_window: float = 5
+
+    sqlite_journal_mode: str = "WAL"
+    sqlite_synchronous: str = "NORMAL"
+    sqlite_busy_timeout: int = 5000
+    sqlite_cache_size: int = -64000
+    sqlite_mmap_size: int = 268435456
+
+    cache_backend: Literal["memory", "redis", "none"] = "memory"
+    cache_maxsize: int = 10000
+    cache_ttl: float = 60
+    redis_url: str = "redis://localhost:6379/0"
+
+    # No default: a secret in the source is everyone's. from_env refuses
+    # to build settings without JWT_SECRET.
+    jwt_secret: str
+    jwt_algorithm: str = "HS256"
+    jwt_ttl: int = 3600
+    jwt_cache_maxsize: int = 10000
+    jwt_cache_ttl: float = 300
+
+    password_pool: Literal["thread", "process", "inline"] = "thread"
+    password_workers: int = 2
+    password_max_pending: int = 64
+    password_scrypt_n: int = 16384
+    password_scrypt_r: int = 8
+    password_scrypt_p: int = 1
+
+    bulk_chunk_size: int = 500
+    bulk_max_rows: int = 10000
+
+    counter_flush_interval: float = 5
+
+    geocoder: Literal["gazetteer", "none"] = "gazetteer"
+    gazetteer_path: str = str(Path(__file__).resolve().parent / "gazetteer.csv")
+    nearby_max_radius_km: float = 50
+
+    metrics_enabled: bool = True
+    slow_query_ms: float = 200
+    server_timing: bool = False
+
+    rate_limit_backend: Literal["memory", "redis", "none"] = "memory"
+    rate_limit_maxsize: int = 100000
+    rate_limit_signup: str = "5/60"
+    rate_limit_announcements: str = "30/60"
+    rate_limit_comments: str = "20/60"
+    # Rows, not requests: a bulk import is charged per chunk it inserts.
+    rate_limit_bulk_rows: str = "10000/3600"
+    write_concurrency: int = 32
+    write_queue: int = 64
+    write_queue_timeout: float = 2
+
+    tasks_backend: Literal["memory", "outbox", "inline"] = "memory"
+    tasks_maxsize: int = 10000
+    tasks_batch_size: int = 100
+    tasks_batch_window: float = 0.05
+    tasks_max_attempts: int = 5
+    tasks_retry_delay: float = 0.5
+    tasks_poll_interval: float = 5
+    tasks_lease: float = 30
+    tasks_drain_timeout: float = 10
+
+    events_backend: Literal["memory", "redis"] = "memory"
+    events_queue_size: int = 100
+    events_heartbeat: float = 15
+    # Streams end after this long; clients reconnect with Last-Event-ID,
+    # which also spreads them over workers again.
+    events_stream_timeout: float = 300
+
+    similar_index: Literal["numpy", "none"] = "numpy"
+    # Hashed description words added to the features; 0 leaves text out.
+    similar_text_features: int = 0
+    similar_rebuild_interval: float = 300
+
+    @classmethod
+    def from_env(cls) -> "Settings":
+        if not os.getenv("JWT_SECRET"):
+            raise RuntimeError("JWT_SECRET is not set; tokens cannot be signed without a secret")
+        values = {}
+        for name, field in cls.model_fields.items():
+            value = os.getenv(name.upper())
+            if value is None:
+                continue
+            if field.annotation is bool:
+                values[name] = env_bool(name.upper(), field.default)
+            else:
+                values[name] = value
+        return cls(**values)
+
+
+settings = Settings.from_env()
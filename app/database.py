@@ -1,12 +1,150 @@
-from sqlalchemy import create_engine
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Union
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.orm import Session, sessionmaker
+from starlette.concurrency import run_in_threadpool
+
+from config import Settings
+
+DbSession = Union[AsyncSession, Session]
+
+ASYNC_DRIVERS = {
+    "sqlite": "sqlite+aiosqlite",
+    "postgresql": "postgresql+asyncpg",
+    "postgres": "postgresql+asyncpg",
+}
+
+
+def async_database_url(url: str) -> str:
+    scheme, sep, rest = url.partition("://")
+    return ASYNC_DRIVERS.get(scheme, scheme) + sep + rest
+
+
+def is_sqlite(url: str) -> bool:
+    return url.startswith("sqlite")
+
+
+def is_sqlite_memory(url: str) -> bool:
+    return is_sqlite(url) and (url.endswith("://") or ":memory:" in url or "mode=memory" in url)
+
+
+def connect_args(url: str) -> dict:
+    if is_sqlite(url):
+        return {"check_same_thread": False}
+    return {}
+
+
+def engine_options(url: str, settings: Settings) -> dict:
+    # In-memory SQLite uses a singleton/static pool that takes no sizing.
+    if is_sqlite_memory(url):
+        return {}
+    return {
+        "pool_size": settings.db_pool_size,
+        "max_overflow": settings.db_max_overflow,
+        "pool_timeout": settings.db_pool_timeout,
+        "pool_recycle": settings.db_pool_recycle,
+        "pool_pre_ping": settings.db_pool_pre_ping,
+    }
+
+
+def sqlite_pragmas(settings: Settings) -> dict:
+    return {
+        "journal_mode": settings.sqlite_journal_mode,
+        "synchronous": settings.sqlite_synchronous,
+        "busy_timeout": settings.sqlite_busy_timeout,
+        "cache_size": settings.sqlite_cache_size,
+        "mmap_size": settings.sqlite_mmap_size,
+    }
+
+
+def apply_sqlite_pragmas(sync_engine, settings: Settings) -> None:
+    pragmas = sqlite_pragmas(settings)
+
+    @event.listens_for(sync_engine, "connect")
+    def set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for name, value in pragmas.items():
+            cursor.execute("PRAGMA %s = %s" % (name, value))
+        cursor.close()
+
+
+def build_engine(url: str, settings: Settings):
+    engine = create_engine(url, connect_args=connect_args(url), **engine_options(url, settings))
+    if is_sqlite(url):
+        apply_sqlite_pragmas(engine, settings)
+    return engine
+
+
+def build_async_engine(url: str, settings: Settings):
+    engine = create_async_engine(async_database_url(url), **engine_options(url, settings))
+    if is_sqlite(url):
+        apply_sqlite_pragmas(engine.sync_engine, settings)
+    return engine
+
+
+def pool_status(engine) -> dict:
+    pool = getattr(engine, "sync_engine", engine).pool
+    status = {"class": type(pool).__name__, "status": pool.status()}
+    for name in ("size", "checkedin", "checkedout", "overflow"):
+        if hasattr(pool, name):
+            status[name] = getattr(pool, name)()
+    return status
+
+
+async def run_sync(db, method, *args, **kwargs):
+    """Call a sync ``method(session, *args)`` without blocking the event loop."""
+    if isinstance(db, AsyncSession):
+        return await db.run_sync(lambda session: method(session, *args, **kwargs))
+    return await run_in_threadpool(method, db, *args, **kwargs)
+
+
+class Database:
+    """Engines and session factories for one database URL.
+
+    Building one opens no connection; the pools fill on first use. The app
+    builds its Database in the lifespan, so with a preforking server every
+    worker gets its own pools instead of inheriting sockets or SQLite
+    handles from the parent. The async engine (and its driver import) only
+    exists with ``db_async``.
+    """
+
+    def __init__(self, settings: Settings):
+        self.settings = settings
+        self.engine = build_engine(settings.database_url, settings)
+        self.SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=self.engine)
+        self.async_engine = None
+        self.AsyncSessionLocal = None
+        if settings.db_async:
+            self.async_engine = build_async_engine(settings.database_url, settings)
+            self.AsyncSessionLocal = async_sessionmaker(self.async_engine, class_=AsyncSession,
+                                                        autoflush=False, expire_on_commit=False)
+
+    @property
+    def engines(self) -> list:
+        return [engine for engine in (self.engine, self.async_engine) if engine is not None]
+
+    def active_engine(self):
+        return self.async_engine if self.async_engine is not None else self.engine
+
+    @asynccontextmanager
+    async def session(self) -> AsyncIterator[DbSession]:
+        if self.AsyncSessionLocal is not None:
+            async with self.AsyncSessionLocal() as db:
+                yield db
+        else:
+            db = self.SessionLocal()
+            try:
+                yield db
+            finally:
+                db.close()
 
-SQLALKHEMY_DATABASE_URL = "sqlite:///./sql_app.db"
+    async def dispose(self) -> None:
+        self.engine.dispose()
+        if self.async_engine is not None:
+            await self.async_engine.dispose()
 
-engine = create_engine(
-    SQLALKHEMY_DATABASE_URL, connect_args={"check_same_thread": False}
-)
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
 Base = declarative_base()
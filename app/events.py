@@ -0,0 +1,230 @@
+import asyncio
+import json
+import logging
+from typing import Any, AsyncIterator, Callable, Dict, Optional, Set
+
+from config import Settings
+from responses import dumps
+
+logger = logging.getLogger(__name__)
+
+# Put on a subscriber's queue to end its stream: the subscriber was too
+# slow or the broker is stopping. Clients reconnect with Last-Event-ID.
+CLOSED = object()
+
+# Reconnect delay the stream asks EventSource clients for, in milliseconds.
+RETRY_MS = 3000
+
+
+def comments_topic(ads_id: int) -> str:
+    return "comments:%d" % ads_id
+
+
+class Event:
+    """One Server-Sent Event, encoded once however many subscribers get it.
+
+    ``id`` is set only on events a stream can be resumed after; the others
+    leave the client's Last-Event-ID as it was.
+    """
+
+    __slots__ = ("name", "data", "id", "encoded")
+
+    def __init__(self, name: str, data: Any, id: Optional[int] = None):
+        self.name = name
+        self.data = data
+        self.id = id
+        head = b"" if id is None else b"id: %d\n" % id
+        self.encoded = head + b"event: " + name.encode() + b"\ndata: " + dumps(data) + b"\n\n"
+
+
+class Subscription:
+    __slots__ = ("topic", "queue")
+
+    def __init__(self, topic: str, maxsize: int):
+        self.topic = topic
+        self.queue = asyncio.Queue(maxsize)
+
+    def offer(self, event: Event) -> bool:
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            return False
+        return True
+
+    def close(self) -> None:
+        # Pending events are dropped with the stream: the client gets them
+        # again when it resumes.
+        while not self.queue.empty():
+            self.queue.get_nowait()
+        self.queue.put_nowait(CLOSED)
+
+
+class EventBroker:
+    """In-process pub/sub: events reach the subscribers of this process only.
+
+    Every subscriber has a queue of ``queue_size`` events. A subscriber
+    whose queue is full when an event arrives is dropped rather than
+    slowing down the publisher or the others: its stream ends and the
+    client resumes from Last-Event-ID. Must be used from the event loop.
+    """
+
+    def __init__(self, queue_size: int = 100):
+        self.queue_size = queue_size
+        self.topics: Dict[str, Set[Subscription]] = {}
+        self.published = 0
+        self.delivered = 0
+        self.dropped = 0
+
+    def subscribe(self, topic: str) -> Subscription:
+        subscription = Subscription(topic, self.queue_size)
+        self.topics.setdefault(topic, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription) -> None:
+        subscribers = self.topics.get(subscription.topic)
+        if subscribers is not None:
+            subscribers.discard(subscription)
+            if not subscribers:
+                del self.topics[subscription.topic]
+
+    async def publish(self, topic: str, event: Event) -> None:
+        self.published += 1
+        self.deliver(topic, event)
+
+    def deliver(self, topic: str, event: Event) -> None:
+        for subscription in list(self.topics.get(topic, ())):
+            if subscription.offer(event):
+                self.delivered += 1
+            else:
+                self.unsubscribe(subscription)
+                subscription.close()
+                self.dropped += 1
+
+    async def stream(self, topic: str, replay: Callable[[], AsyncIterator[Event]],
+                     heartbeat: float, timeout: float) -> AsyncIterator[bytes]:
+        """SSE body for ``topic``: the events ``replay`` yields, then live ones.
+
+        The subscription is taken before replaying, so nothing published
+        meanwhile is missed; live events the replay already sent are
+        skipped. A comment line goes out every ``heartbeat`` seconds of
+        silence, and the stream ends after ``timeout`` seconds.
+        """
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        subscription = self.subscribe(topic)
+        try:
+            yield b"retry: %d\n\n" % RETRY_MS
+            last_id = None
+            async for event in replay():
+                last_id = event.id
+                yield event.encoded
+            while True:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    return
+                try:
+                    event = await asyncio.wait_for(subscription.queue.get(), min(heartbeat, remaining))
+                except asyncio.TimeoutError:
+                    if deadline > loop.time():
+                        yield b": keep-alive\n\n"
+                    continue
+                if event is CLOSED:
+                    return
+                if event.id is not None and last_id is not None and event.id <= last_id:
+                    continue
+                yield event.encoded
+        finally:
+            self.unsubscribe(subscription)
+
+    def start(self) -> None:
+        pass
+
+    async def stop(self) -> None:
+        for subscribers in list(self.topics.values()):
+            for subscription in list(subscribers):
+                self.unsubscribe(subscription)
+                subscription.close()
+
+    def stats(self) -> dict:
+        return {
+            "backend": type(self).__name__,
+            "topics": len(self.topics),
+            "subscribers": sum(len(subscribers) for subscribers in self.topics.values()),
+            "published": self.published,
+            "delivered": self.delivered,
+            "dropped": self.dropped,
+        }
+
+
+class RedisEventBroker(EventBroker):
+    """Shares events between workers through Redis pub/sub.
+
+    Publishing goes through the server only, and every worker, including
+    the publishing one, delivers what its listener receives to its own
+    subscribers. Takes a redis.asyncio client. Redis does not keep
+    messages, so a listener that reconnects loses what was published
+    meanwhile; clients still catch up on comments from Last-Event-ID.
+    """
+
+    def __init__(self, client, queue_size: int = 100, prefix: str = "shanyrak:events:"):
+        super().__init__(queue_size)
+        self.client = client
+        self.prefix = prefix
+        self.listener: Optional[asyncio.Task] = None
+        self.publish_errors = 0
+
+    async def publish(self, topic: str, event: Event) -> None:
+        self.published += 1
+        message = json.dumps({"name": event.name, "data": event.data, "id": event.id})
+        try:
+            await self.client.publish(self.prefix + topic, message)
+        except Exception as exc:
+            # The write is committed already: reach this worker's
+            # subscribers at least, the others resume from the database.
+            self.publish_errors += 1
+            logger.warning("event publish failed, delivered locally only: %r", exc)
+            self.deliver(topic, event)
+
+    async def listen(self) -> None:
+        while True:
+            try:
+                async with self.client.pubsub() as pubsub:
+                    await pubsub.psubscribe(self.prefix + "*")
+                    async for message in pubsub.listen():
+                        if message["type"] != "pmessage":
+                            continue
+                        channel = message["channel"]
+                        if isinstance(channel, bytes):
+                            channel = channel.decode()
+                        payload = json.loads(message["data"])
+                        self.deliver(channel[len(self.prefix):],
+                                     Event(payload["name"], payload["data"], payload["id"]))
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("event listener failed; resubscribing")
+                await asyncio.sleep(1)
+
+    def start(self) -> None:
+        self.listener = asyncio.create_task(self.listen())
+
+    async def stop(self) -> None:
+        if self.listener is not None:
+            self.listener.cancel()
+            await asyncio.gather(self.listener, return_exceptions=True)
+        await super().stop()
+
+    def stats(self) -> dict:
+        stats = super().stats()
+        stats["publish_errors"] = self.publish_errors
+        return stats
+
+
+def build_event_broker(settings: Settings, client: Optional[Any] = None) -> EventBroker:
+    if settings.events_backend == "redis":
+        if client is None:
+            import redis.asyncio
+
+            client = redis.asyncio.Redis.from_url(settings.redis_url)
+        return RedisEventBroker(client, settings.events_queue_size)
+    return EventBroker(settings.events_queue_size)
@@ -0,0 +1,81 @@
+import csv
+import math
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from config import Settings
+
+Point = Tuple[float, float]
+
+KM_PER_DEGREE = 111.32
+EARTH_RADIUS_KM = 6371.0088
+
+
+def haversine_km(a: Point, b: Point) -> float:
+    lat1, lon1, lat2, lon2 = map(math.radians, (a[0], a[1], b[0], b[1]))
+    h = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(math.sqrt(h))
+
+
+def bounding_box(center: Point, radius_km: float) -> Tuple[float, float, float, float]:
+    """(min_lat, max_lat, min_lon, max_lon) of a box containing the circle."""
+    lat, lon = center
+    dlat = radius_km / KM_PER_DEGREE
+    dlon = radius_km / (KM_PER_DEGREE * max(math.cos(math.radians(lat)), 1e-6))
+    return max(lat - dlat, -90.0), min(lat + dlat, 90.0), max(lon - dlon, -180.0), min(lon + dlon, 180.0)
+
+
+class Geocoder:
+    """Turns a free-text address into (latitude, longitude).
+
+    Called inline by the repository on every save, so providers must answer
+    locally; a remote service belongs behind ``manage.py geocode``.
+    """
+
+    def geocode(self, address: Optional[str]) -> Optional[Point]:
+        return None
+
+
+class NullGeocoder(Geocoder):
+    pass
+
+
+class GazetteerGeocoder(Geocoder):
+    """Looks addresses up in a static ``city,street,latitude,longitude`` file.
+
+    The most specific match wins: a known street in the address's city, then
+    the city centre. Matching is case-insensitive substring search, which is
+    enough for addresses such as "Алматы, ул. Абая 12".
+    """
+
+    def __init__(self, path: Path):
+        self.cities: Dict[str, Point] = {}
+        self.streets: Dict[str, List[Tuple[str, Point]]] = {}
+        with open(path, encoding="utf-8", newline="") as f:
+            for row in csv.DictReader(f):
+                city, street = row["city"].strip().lower(), row["street"].strip().lower()
+                point = (float(row["latitude"]), float(row["longitude"]))
+                if street:
+                    self.streets.setdefault(city, []).append((street, point))
+                else:
+                    self.cities[city] = point
+        for streets in self.streets.values():
+            streets.sort(key=lambda item: -len(item[0]))
+
+    def geocode(self, address: Optional[str]) -> Optional[Point]:
+        if not address:
+            return None
+        text = address.lower()
+        for city, point in self.cities.items():
+            if city in text:
+                for street, street_point in self.streets.get(city, []):
+                    if street in text:
+                        return street_point
+                return point
+        return None
+
+
+def build_geocoder(settings: Settings) -> Geocoder:
+    if settings.geocoder == "gazetteer":
+        return GazetteerGeocoder(Path(settings.gazetteer_path))
+    return NullGeocoder()
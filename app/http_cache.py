@@ -0,0 +1,56 @@
+from datetime import datetime, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+from typing import Optional
+
+from fastapi import Request, Response
+
+
+def make_etag(kind: str, id: int, version: int, *parts) -> str:
+    # Extra parts tell apart representations of the same version, such as
+    # different pages of a list.
+    suffix = "".join("-%s" % part for part in parts)
+    return 'W/"%s%d-v%d%s"' % (kind, id, version, suffix)
+
+
+def opaque_tag(etag: str) -> str:
+    # Weak comparison: W/"x" and "x" match.
+    return etag[2:] if etag.startswith("W/") else etag
+
+
+def http_date(value: Optional[datetime]) -> Optional[str]:
+    if value is None:
+        return None
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return format_datetime(value.astimezone(timezone.utc), usegmt=True)
+
+
+def validator_headers(etag: str, last_modified: Optional[datetime]) -> dict:
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    modified = http_date(last_modified)
+    if modified is not None:
+        headers["Last-Modified"] = modified
+    return headers
+
+
+def is_not_modified(request: Request, etag: str, last_modified: Optional[datetime]) -> bool:
+    # If-None-Match wins over If-Modified-Since (RFC 9110, 13.2.2).
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        tags = [tag.strip() for tag in if_none_match.split(",")]
+        return any(tag == "*" or opaque_tag(tag) == opaque_tag(etag) for tag in tags)
+
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since is None or last_modified is None:
+        return False
+    try:
+        since = parsedate_to_datetime(if_modified_since)
+    except (TypeError, ValueError):
+        return False
+    if last_modified.tzinfo is None:
+        last_modified = last_modified.replace(tzinfo=timezone.utc)
+    return last_modified.replace(microsecond=0) <= since
+
+
+def not_modified(headers: dict) -> Response:
+    return Response(status_code=304, headers=headers)
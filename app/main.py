@@ -1,81 +1,337 @@
-from typing import Dict, List, Optional
-from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
-from fastapi import FastAPI, HTTPException, Depends, Request, Query
-from sqlalchemy.orm import Session
-from jose import jwt
-from starlette.responses import JSONResponse
-from repositories import UsersRepository, AnnouncementsRepository, CommentsRepository
+"""HTTP API.
+
+``create_app(settings)`` builds the application; importing this module
+builds one from the environment as ``app``. Importing opens no database
+connection and starts no thread or task: the engines, the task worker, the
+counter flush and the password pool are created in the lifespan, once per
+worker process. The schema is managed by Alembic, not at startup; migrate
+also upgrades a database made before that, like the bundled sql_app.db:
+
+    python manage.py migrate
+    uvicorn main:app                               # or: uvicorn --factory main:create_app
+    gunicorn main:app -k uvicorn.workers.UvicornWorker -w 4 --preload
+
+JWT_SECRET must be set: there is no default secret, and the settings
+refuse to load without one.
+
+``--preload`` imports the app once in the master and forks the workers from
+it, so they share the imported code and start in milliseconds. That is safe
+because nothing the workers must not share exists before the fork. Each
+worker then keeps its own pools and in-process state (memory cache, rate
+limit buckets, view counters, comment event subscribers, metrics): use
+CACHE_BACKEND=redis, RATE_LIMIT_BACKEND=redis and EVENTS_BACKEND=redis to
+share caches, limits and comment events across workers, and expect
+/metrics to describe the worker that answered.
+
+Similar listings are ranked with numpy, an optional extra (``poetry install
+-E similar``); without it the index stays empty and /shanyraks/{id}/similar
+answers with no listings.
+"""
+import asyncio
+import base64
+import binascii
+import csv
+import json
+import logging
+import time
+from contextlib import asynccontextmanager
+from datetime import datetime
+from typing import AsyncContextManager, AsyncIterator, Dict, List, Literal, Optional
+from fastapi.security import OAuth2PasswordRequestForm
+from fastapi import APIRouter, FastAPI, HTTPException, Depends, Header, Request, Response, Query
+from starlette.concurrency import run_in_threadpool
+from starlette.responses import PlainTextResponse, StreamingResponse
+from repositories import comment_response
+from async_repositories import AsyncUsersRepository, AsyncAnnouncementsRepository, AsyncCommentsRepository, \
+                               AsyncFavoritesRepository
 from models import User, UserRequest, UserResponse, UserUpdate, \
-                   Announcement, AnnouncementRequest, AnnouncementResponse, AnnouncementUpdate, \
-                   Comment, CommentRequest, CommentResponse, CommentUpdate
-from database import Base, engine, SessionLocal
+                   Announcement, AnnouncementRequest, AnnouncementResponse, AnnouncementSearch, AnnouncementPage, \
+                   AnnouncementSearchResult, AnnouncementNearbyResult, AnnouncementSimilarResult, AnnouncementFacets, \
+                   AnnouncementUpdate, Comment, CommentRequest, CommentResponse, CommentUpdate, FavoritesBatch, \
+                   FavoritesPage
+from auth import TokenClaims, build_token_issuer, current_user
+from bulk import iter_lines, csv_records, ndjson_records, import_announcements, csv_export, ndjson_export
+from cache import build_cache
+from events import Event, build_event_broker, comments_topic
+from counters import CounterBuffer
+from geocoding import build_geocoder
+from metrics import CONTENT_TYPE, MetricsMiddleware, TimedRoute, instrument_engine, registry
+from config import settings, Settings
+from passwords import build_hasher
+from ratelimit import WRITE_METHODS, AdmissionMiddleware, build_rate_limiter, build_rate_limits, rate_limited, \
+                      retry_after, take_tokens
+from replicas import ReplicaSet, build_replicas
+from responses import FastJSONResponse, dumps
+from similar import build_similar_index, similar_row
+from tasks import build_tasks
+from http_cache import make_etag, validator_headers, is_not_modified, not_modified
+from database import Database, DbSession, pool_status
+
+logger = logging.getLogger(__name__)
+
+
+class Services:
+    """What the handlers share, built per app by ``create_app``.
+
+    Building it only creates plain objects. ``start`` runs in the lifespan
+    and creates the Database and the background tasks; ``stop`` flushes
+    and drains them and closes the pools.
+    """
+
+    def __init__(self, settings: Settings):
+        self.settings = settings
+        self.database: Optional[Database] = None
+        self.replicas: Optional[ReplicaSet] = None
+        self.cache = build_cache(settings)
+        self.password_hasher = build_hasher(settings)
+        self.tokens = build_token_issuer(settings)
+        self.geocoder = build_geocoder(settings)
+        self.similar = build_similar_index(settings)
+        self.counters = CounterBuffer()
+        self.events = build_event_broker(settings)
+        self.limiter = build_rate_limiter(settings)
+        self.rate_limits = build_rate_limits(settings, self.limiter)
+        self.tasks = build_tasks(settings, self.open_db)
+        self.users_repository = AsyncUsersRepository(self.cache)
+        self.announcements_repository = AsyncAnnouncementsRepository(self.cache, self.geocoder, self.tasks,
+                                                                     self.similar)
+        self.comments_repository = AsyncCommentsRepository(self.cache)
+        self.favorites_repository = AsyncFavoritesRepository(self.counters)
+        self.counter_flush: Optional[asyncio.Task] = None
+        self.similar_rebuild: Optional[asyncio.Task] = None
+
+    def open_db(self) -> AsyncContextManager[DbSession]:
+        if self.database is None:
+            raise RuntimeError("the app has not started; serve it through its lifespan")
+        return self.database.session()
+
+    def open_read_db(self, primary: bool = False) -> AsyncContextManager[DbSession]:
+        """A session on a replica, or on the primary when ``primary`` or when none is in rotation."""
+        if primary:
+            return self.open_db()
+        return self.replicas.session()
+
+    async def start(self) -> None:
+        self.database = Database(self.settings)
+        self.replicas = build_replicas(self.settings, self.database)
+        if self.settings.metrics_enabled:
+            for database in [self.database] + [replica.database for replica in self.replicas.replicas]:
+                for engine in database.engines:
+                    instrument_engine(engine, self.settings.slow_query_ms)
+        self.replicas.start()
+        self.tasks.start()
+        self.events.start()
+        self.similar.start()
+        self.counter_flush = asyncio.create_task(self.flush_counters_periodically())
+        self.similar_rebuild = asyncio.create_task(self.rebuild_similar_periodically())
+
+    async def stop(self) -> None:
+        await self.events.stop()
+        self.similar_rebuild.cancel()
+        self.counter_flush.cancel()
+        try:
+            await self.flush_counters()
+        finally:
+            await self.tasks.drain(self.settings.tasks_drain_timeout)
+            self.password_hasher.shutdown()
+            await self.replicas.stop()
+            await self.database.dispose()
+
+    async def flush_counters(self) -> None:
+        deltas = self.counters.take()
+        if not deltas:
+            return
+        try:
+            async with self.open_db() as db:
+                rows = await self.announcements_repository.apply_counter_deltas(db, deltas)
+        except Exception:
+            self.counters.restore(deltas)
+            raise
+        self.counters.flushes += 1
+        self.counters.flushed_rows += rows
+
+    async def rebuild_similar(self) -> None:
+        # A rebuild reads every listing: it runs in a thread on a sync
+        # session so it does not hold up the event loop.
+        def rebuild() -> None:
+            with self.database.SessionLocal() as db:
+                self.similar.rebuild(db)
+
+        await run_in_threadpool(rebuild)
+
+    async def rebuild_similar_periodically(self) -> None:
+        while True:
+            try:
+                await self.rebuild_similar()
+            except Exception:
+                logger.exception("similar listings rebuild failed; keeping the previous index")
+            await asyncio.sleep(self.settings.similar_rebuild_interval)
+
+    async def flush_counters_periodically(self) -> None:
+        while True:
+            await asyncio.sleep(self.settings.counter_flush_interval)
+            try:
+                await self.flush_counters()
+            except Exception:
+                logger.exception("counter flush failed; deltas kept for the next flush")
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI) -> AsyncIterator[None]:
+    services = app.state.services
+    await services.start()
+    try:
+        yield
+    finally:
+        await services.stop()
+
+
+def get_services(request: Request) -> Services:
+    return request.app.state.services
+
+
+# Set on responses to writes while replicas are configured; until the time
+# it holds, the client's reads go to the primary and see its own writes.
+READ_PRIMARY_COOKIE = "read_primary_until"
 
 
-Base.metadata.create_all(bind=engine)
-app = FastAPI()
+def set_read_primary(request: Request, response: Response) -> None:
+    """Set the read-primary cookie on the response to a write, when replicas are in use.
 
-comments_repository = CommentsRepository()
-announcements_repository = AnnouncementsRepository()
-users_repository = UsersRepository()
-oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/auth/users/login")
+    ``get_db`` sets it on the injected Response, whose headers FastAPI
+    drops when a handler returns a response of its own; such handlers call
+    this on the response they build.
+    """
+    services = request.app.state.services
+    window = services.settings.db_read_primary_window
+    if request.method in WRITE_METHODS and services.replicas.replicas and window > 0:
+        response.set_cookie(READ_PRIMARY_COOKIE, "%.3f" % (time.time() + window),
+                            max_age=max(1, round(window)), httponly=True, samesite="lax")
 
 
-def get_db() -> Session:
-    db = SessionLocal()
+async def get_db(request: Request, response: Response,
+                 services: Services = Depends(get_services)) -> DbSession:
+    set_read_primary(request, response)
+    async with services.open_db() as db:
+        yield db
+
+
+def read_primary(request: Request) -> bool:
     try:
+        return float(request.cookies.get(READ_PRIMARY_COOKIE, 0)) > time.time()
+    except ValueError:
+        return False
+
+
+async def get_read_db(request: Request, services: Services = Depends(get_services)) -> DbSession:
+    """Session for read-only endpoints: a replica, unless the client wrote recently."""
+    async with services.open_read_db(read_primary(request)) as db:
         yield db
-    finally:
-        db.close()
 
 
-def create_jwt(id: int) -> str:
-    body = {"id": id}
-    token = jwt.encode(body, "WolterWhite", "HS256")
-    return token
+# TimedRoute only records anything under MetricsMiddleware, which
+# create_app adds when metrics are enabled.
+router = APIRouter(route_class=TimedRoute)
 
 
-def decode_jwt(token: str) -> int:
-    data = jwt.decode(token, "WolterWhite", "HS256")
-    return data["id"]
+def encode_cursor(**values) -> str:
+    raw = json.dumps(values).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
 
 
-@app.post("/auth/users/", status_code=200)
-def post_signup(user: UserRequest, db: Session = Depends(get_db)):
+def decode_cursor(cursor: str, **fields: type) -> dict:
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        data = json.loads(base64.urlsafe_b64decode(padded))
+        return {name: convert(data[name]) for name, convert in fields.items()}
+    except (binascii.Error, ValueError, TypeError, KeyError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+@router.get("/health/db", status_code=200)
+async def get_db_health(services: Services = Depends(get_services)):
+    return {
+        "async": services.settings.db_async,
+        "pool": pool_status(services.database.active_engine()),
+        "replicas": services.replicas.stats(),
+    }
+
+
+@router.get("/health/cache", status_code=200)
+async def get_cache_health(services: Services = Depends(get_services)):
+    return services.cache.stats()
+
+
+@router.get("/health/counters", status_code=200)
+async def get_counters_health(services: Services = Depends(get_services)):
+    return services.counters.stats()
+
+
+@router.get("/health/tasks", status_code=200)
+async def get_tasks_health(services: Services = Depends(get_services)):
+    return services.tasks.stats()
+
+
+@router.get("/health/similar", status_code=200)
+async def get_similar_health(services: Services = Depends(get_services)):
+    return services.similar.stats()
+
+
+@router.get("/health/events", status_code=200)
+async def get_events_health(services: Services = Depends(get_services)):
+    return services.events.stats()
+
+
+@router.get("/metrics", include_in_schema=False)
+async def get_metrics():
+    return PlainTextResponse(registry.render(), media_type=CONTENT_TYPE)
+
+
+@router.post("/auth/users/", status_code=200,
+             dependencies=[Depends(rate_limited("signup"))])
+async def post_signup(user: UserRequest, db: DbSession = Depends(get_db),
+                      services: Services = Depends(get_services)):
     try:
         new_user = User(username=user.username,
                         phone=user.phone,
-                        password=user.password,
+                        password=await services.password_hasher.hash(user.password),
                         name=user.name,
                         city=user.city)
-        users_repository.save(db, new_user)
+        await services.users_repository.save(db, new_user)
     except HTTPException as e:
         return {"error": e.detail, "status_code": e.status_code}
 
     return {"message": "User registered successfully"}
 
 
-@app.post("/auth/users/login", status_code=200, response_model=Dict[str, str])
-def post_login(
+@router.post("/auth/users/login", status_code=200, response_model=Dict[str, str])
+async def post_login(
         form_data: OAuth2PasswordRequestForm = Depends(),
-        db: Session = Depends(get_db)
+        db: DbSession = Depends(get_db),
+        services: Services = Depends(get_services)
 ):
-    user_db = users_repository.get_user_by_username(db, form_data.username)
-    if user_db is None or user_db.password != form_data.password:
+    user_db = await services.users_repository.get_user_by_username(db, form_data.username)
+    stored = user_db.password if user_db is not None else None
+    if not await services.password_hasher.verify(form_data.password, stored):
         raise HTTPException(status_code=401, detail="Invalid credentials")
-    access_token = create_jwt(user_db.id)
+    if services.password_hasher.needs_rehash(stored):
+        new_hash = await services.password_hasher.hash(form_data.password)
+        await services.users_repository.update_password(db, user_db.id, new_hash)
+    access_token = services.tokens.create(user_db.id, user_db.username)
     return {"access_token": access_token, "token_type": "bearer"}
 
 
-@app.patch("/auth/users/me", status_code=200, response_model=bool)
-def patch_profile(
+@router.patch("/auth/users/me", status_code=200, response_model=bool)
+async def patch_profile(
         upd_data: UserUpdate,
-        token: str = Depends(oauth2_scheme),
-        db: Session = Depends(get_db)
+        claims: TokenClaims = Depends(current_user),
+        db: DbSession = Depends(get_db),
+        services: Services = Depends(get_services)
 ):
     try:
-        user_id = decode_jwt(token)
+        user_id = claims.id
         if user_id:
-            upd_user = users_repository.update(db, user_id, upd_data)
+            upd_user = await services.users_repository.update(db, user_id, upd_data)
         else:
             raise HTTPException(status_code=401, detail="Unauthorized")
 
@@ -84,38 +340,28 @@ def patch_profile(
         return {"error": e.detail, "status_code": e.status_code}
 
 
-@app.get("/auth/users/me", status_code=200, response_model=UserResponse)
-def get_profile(
-        token: str = Depends(oauth2_scheme),
-        db: Session = Depends(get_db)
+@router.get("/auth/users/me", status_code=200, response_model=UserResponse)
+async def get_profile(
+        claims: TokenClaims = Depends(current_user),
+        db: DbSession = Depends(get_read_db),
+        services: Services = Depends(get_services)
 ):
+    user = await services.users_repository.get_user_response(db, claims.id)
+    if user is None:
+        raise HTTPException(status_code=404, detail="User not found")
+    return user
+
+
+@router.post("/shanyraks/", status_code=200,
+             dependencies=[Depends(rate_limited("announcements"))])
+async def post_add_ads(announcement: AnnouncementRequest,
+                       db: DbSession = Depends(get_db),
+                       services: Services = Depends(get_services),
+                       claims: TokenClaims = Depends(current_user)
+                       ):
     try:
-        user_id = decode_jwt(token)
+        user_id = claims.id
         if user_id:
-            user_db = users_repository.get_user_by_id(db, user_id)
-            user = UserResponse(id=user_db.id,
-                                username=user_db.username,
-                                phone=user_db.phone,
-                                name=user_db.name,
-                                city=user_db.city)
-        else:
-            raise HTTPException(status_code=401, detail="Unauthorized")
-
-        return user
-
-    except HTTPException as e:
-        return {"error": e.detail, "status_code": e.status_code}
-
-
-@app.post("/shanyraks/", status_code=200)
-def post_add_ads(announcement: AnnouncementRequest,
-                 db: Session = Depends(get_db),
-                 token: str = Depends(oauth2_scheme)
-                 ):
-    try:
-        user_id = decode_jwt(token)
-        if user_id:
-            user_db = users_repository.get_user_by_id(db, user_id)
             new_ads = Announcement(
                     type=announcement.type,
                     price=announcement.price,
@@ -123,9 +369,11 @@ def post_add_ads(announcement: AnnouncementRequest,
                     area=announcement.area,
                     rooms_count=announcement.rooms_count,
                     description=announcement.description,
+                    latitude=announcement.latitude,
+                    longitude=announcement.longitude,
+                    user_id=user_id,
             )
-            user_db.announcement.append(new_ads)
-            announcements_repository.save(db, new_ads)
+            await services.announcements_repository.save(db, new_ads)
         else:
             raise HTTPException(status_code=401, detail="Unauthorized")
     except HTTPException as e:
@@ -134,21 +382,195 @@ def post_add_ads(announcement: AnnouncementRequest,
     return {"message": "Announcement registered successfully"}
 
 
-@app.get("/shanyraks/{id}", status_code=200, response_model=AnnouncementResponse)
-def get_announcement(id: int,
-                db: Session = Depends(get_db)):
-    announcement = announcements_repository.get_announcement_by_id(db, id)
+@router.post("/shanyraks/bulk", status_code=200)
+async def post_bulk_ads(request: Request,
+                        db: DbSession = Depends(get_db),
+                        services: Services = Depends(get_services),
+                        claims: TokenClaims = Depends(current_user)
+                        ):
+    content_type = request.headers.get("content-type", "").split(";")[0].strip()
+    if content_type == "text/csv":
+        parse = csv_records
+    elif content_type in ("application/x-ndjson", "application/jsonl"):
+        parse = ndjson_records
+    else:
+        raise HTTPException(status_code=415, detail="Send text/csv or application/x-ndjson")
+
+    async def insert_many(rows: List[dict]) -> int:
+        return await services.announcements_repository.insert_many(db, rows)
+
+    async def admit(rows: int) -> float:
+        return await take_tokens(request, "bulk", rows)
+
+    # Rows are charged to the caller's "bulk" bucket a chunk at a time, so
+    # a chunk must fit in a full bucket.
+    chunk_size = min(services.settings.bulk_chunk_size, services.rate_limits["bulk"][1].count)
+    try:
+        report = await import_announcements(parse(iter_lines(request.stream())), claims.id, insert_many,
+                                            chunk_size, services.settings.bulk_max_rows, admit)
+    except UnicodeDecodeError:
+        # Chunks before the bad byte are committed: the client must still read them from the primary.
+        response = FastJSONResponse({"detail": "Body is not valid UTF-8"}, status_code=400)
+        set_read_primary(request, response)
+        return response
+    except csv.Error as e:
+        raise HTTPException(status_code=400, detail="CSV header is not valid: %s" % e)
+    if "retry_after" in report:
+        response = FastJSONResponse(report, status_code=429,
+                                    headers={"Retry-After": retry_after(report["retry_after"])})
+        set_read_primary(request, response)
+        return response
+    return report
+
+
+@router.get("/shanyraks/export", status_code=200)
+async def export_announcements(format: Literal["ndjson", "csv"] = "ndjson",
+                               user_id: Optional[int] = None,
+                               db: DbSession = Depends(get_read_db),
+                               services: Services = Depends(get_services)
+                               ):
+    chunks = services.announcements_repository.stream_announcements(db, user_id)
+    if format == "csv":
+        return StreamingResponse(csv_export(chunks), media_type="text/csv",
+                                 headers={"Content-Disposition": 'attachment; filename="shanyraks.csv"'})
+    return StreamingResponse(ndjson_export(chunks), media_type="application/x-ndjson")
+
+
+@router.get("/shanyraks/facets", status_code=200, response_model=AnnouncementFacets)
+async def get_announcement_facets(type: Optional[str] = None,
+                                  rooms_count: Optional[int] = None,
+                                  price_from: Optional[int] = None,
+                                  price_until: Optional[int] = None,
+                                  db: DbSession = Depends(get_read_db),
+                                  services: Services = Depends(get_services)
+                                  ):
+    criteria = AnnouncementSearch(type=type, rooms_count=rooms_count,
+                                  price_from=price_from, price_until=price_until)
+    return await services.announcements_repository.get_facets(db, criteria)
+
+
+NEARBY_RADIUS_KM = 2
+
+
+@router.get("/shanyraks/nearby", status_code=200, response_model=List[AnnouncementNearbyResult])
+async def get_nearby_announcements(
+            lat: float = Query(ge=-90, le=90),
+            lon: float = Query(ge=-180, le=180),
+            radius_km: Optional[float] = Query(default=None, gt=0),
+            min_lat: Optional[float] = None,
+            max_lat: Optional[float] = None,
+            min_lon: Optional[float] = None,
+            max_lon: Optional[float] = None,
+            limit: int = Query(default=20, ge=1, le=100),
+            type: Optional[str] = None,
+            rooms_count: Optional[int] = None,
+            price_from: Optional[int] = None,
+            price_until: Optional[int] = None,
+            db: DbSession = Depends(get_read_db),
+            services: Services = Depends(get_services)
+):
+    box = (min_lat, max_lat, min_lon, max_lon)
+    if all(value is None for value in box):
+        box = None
+        radius_km = radius_km or NEARBY_RADIUS_KM
+    elif any(value is None for value in box):
+        raise HTTPException(status_code=400, detail="min_lat, max_lat, min_lon and max_lon go together")
+    if radius_km is not None and radius_km > services.settings.nearby_max_radius_km:
+        raise HTTPException(status_code=400,
+                            detail="radius_km is limited to %g" % services.settings.nearby_max_radius_km)
+
+    criteria = AnnouncementSearch(type=type, rooms_count=rooms_count,
+                                  price_from=price_from, price_until=price_until)
+    rows = await services.announcements_repository.nearby(db, (lat, lon), criteria, limit, radius_km, box)
+    return [dict(AnnouncementResponse.model_validate(announcement, from_attributes=True).model_dump(),
+                 distance_km=round(distance, 3))
+            for announcement, distance in rows]
+
+
+@router.get("/shanyraks/search", status_code=200)
+async def text_search_announcements(
+            q: str = Query(min_length=1, max_length=200),
+            limit: int = Query(default=10, ge=1, le=100),
+            offset: int = Query(default=0, ge=0),
+            type: Optional[str] = None,
+            rooms_count: Optional[int] = None,
+            price_from: Optional[int] = None,
+            price_until: Optional[int] = None,
+            db: DbSession = Depends(get_read_db),
+            services: Services = Depends(get_services)
+):
+    criteria = AnnouncementSearch(type=type, rooms_count=rooms_count,
+                                  price_from=price_from, price_until=price_until)
+    rows = await services.announcements_repository.text_search(db, q, criteria, limit, offset)
+    announcements = []
+    for announcement, score in rows:
+        result = AnnouncementResponse.model_validate(announcement, from_attributes=True)
+        announcements.append(AnnouncementSearchResult(**result.model_dump(), score=score))
+
+    return {
+        "announcements": announcements
+    }
+
+
+@router.get("/shanyraks/{id}", status_code=200, response_model=AnnouncementResponse)
+async def get_announcement(id: int,
+                           request: Request,
+                           response: Response,
+                           db: DbSession = Depends(get_read_db),
+                           services: Services = Depends(get_services)):
+    version = await services.announcements_repository.get_announcement_version(db, id)
+    if version is None:
+        raise HTTPException(status_code=404, detail="Announcement not found")
+
+    services.counters.incr("view_count", id)
+    headers = validator_headers(make_etag("a", id, version[0]), version[1])
+    if is_not_modified(request, headers["ETag"], version[1]):
+        return not_modified(headers)
+
+    announcement = await services.announcements_repository.get_announcement_response(db, id, version[0])
     if announcement is None:
         raise HTTPException(status_code=404, detail="Announcement not found")
 
+    response.headers.update(headers)
     return announcement
 
 
-@app.patch("/shanyraks/{id}")
-def patch_announcement(id: int, upd_data: AnnouncementUpdate,
-                       db: Session = Depends(get_db),
-                       token: str = Depends(oauth2_scheme)):
-        user_id = decode_jwt(token)
+@router.get("/shanyraks/{id}/similar", status_code=200, response_model=List[AnnouncementSimilarResult])
+async def get_similar_announcements(id: int,
+                                    limit: int = Query(default=10, ge=1, le=50),
+                                    db: DbSession = Depends(get_read_db),
+                                    services: Services = Depends(get_services)):
+    """Listings nearest to this one in price, area, rooms, type and location.
+
+    ``distance`` is over normalised features: 0 is identical, and about 1
+    is one standard deviation away on one feature.
+    """
+    # A few spare candidates cover listings deleted since the last rebuild.
+    wanted = limit + 5
+    neighbours = await run_in_threadpool(services.similar.similar_to, id, wanted)
+    if neighbours is None:
+        # Not indexed yet (a bulk import, another worker's write): search
+        # with the listing's own row.
+        rows = await services.announcements_repository.get_announcement_rows(db, [id])
+        if id not in rows:
+            raise HTTPException(status_code=404, detail="Announcement not found")
+        neighbours = await run_in_threadpool(services.similar.nearest, similar_row(rows[id]), wanted)
+        rows = await services.announcements_repository.get_announcement_rows(db, [n for n, _ in neighbours])
+    else:
+        rows = await services.announcements_repository.get_announcement_rows(db, [id] + [n for n, _ in neighbours])
+        if id not in rows:
+            raise HTTPException(status_code=404, detail="Announcement not found")
+
+    similar = [dict(rows[n]._asdict(), distance=round(distance, 4)) for n, distance in neighbours if n in rows]
+    return FastJSONResponse(similar[:limit])
+
+
+@router.patch("/shanyraks/{id}")
+async def patch_announcement(id: int, upd_data: AnnouncementUpdate,
+                             db: DbSession = Depends(get_db),
+                             services: Services = Depends(get_services),
+                             claims: TokenClaims = Depends(current_user)):
+        user_id = claims.id
         if user_id:
             new_data = Announcement(type=upd_data.type,
                                     price=upd_data.price,
@@ -156,17 +578,18 @@ def patch_announcement(id: int, upd_data: AnnouncementUpdate,
                                     area=upd_data.area,
                                     rooms_count=upd_data.rooms_count,
                                     description=upd_data.description)
-            announcements_repository.update(db, id, new_data, user_id)
+            await services.announcements_repository.update(db, id, new_data, user_id)
         else:
             raise HTTPException(status_code=401, detail="Unauthorized")
         return {"message": "Announcement updated successfully"}
 
 
-@app.delete("/shanyraks/{id}")
-def delete_announcements(id: int, db: Session = Depends(get_db), token: str = Depends(oauth2_scheme)):
-        user_id = decode_jwt(token)
+@router.delete("/shanyraks/{id}")
+async def delete_announcements(id: int, db: DbSession = Depends(get_db), claims: TokenClaims = Depends(current_user),
+                               services: Services = Depends(get_services)):
+        user_id = claims.id
         if user_id:
-            announcements_repository.delete(db, id, user_id)
+            await services.announcements_repository.delete(db, id, user_id)
         else:
             raise HTTPException(status_code=401, detail="Unauthorized")
         return {"message": "Announcement deleted successfully",
@@ -174,22 +597,20 @@ def delete_announcements(id: int, db: Session = Depends(get_db), token: str = De
                 }
 
 
-@app.post("/shanyraks/{id}/comments", status_code=200)
-def post_add_comment(id: int,
-                     comment: CommentRequest,
-                     db: Session = Depends(get_db),
-                     token: str = Depends(oauth2_scheme)
-                    ):
+@router.post("/shanyraks/{id}/comments", status_code=200,
+             dependencies=[Depends(rate_limited("comments"))])
+async def post_add_comment(id: int,
+                           comment: CommentRequest,
+                           db: DbSession = Depends(get_db),
+                           services: Services = Depends(get_services),
+                           claims: TokenClaims = Depends(current_user)
+                          ):
     try:
-        user_id = decode_jwt(token)
+        user_id = claims.id
         if user_id:
-            user_db = users_repository.get_user_by_id(db, user_id)
-            ads = announcements_repository.get_announcement_by_id(db, id)
-            new_comment = Comment(content=comment.content)
-            user_db.comment.append(new_comment)
-            ads.comment.append(new_comment)
-            ads.comment_count = ads.comment_count + 1
-            comments_repository.save(db, new_comment)
+            new_comment = Comment(content=comment.content, author_id=user_id, ads_id=id)
+            saved = await services.comments_repository.save(db, new_comment)
+            await services.events.publish(comments_topic(id), Event("comment_created", saved, saved["id"]))
         else:
             raise HTTPException(status_code=401, detail="Unauthorized")
     except HTTPException as e:
@@ -198,133 +619,267 @@ def post_add_comment(id: int,
     return {"message": "Comment registered successfully"}
 
 
-@app.get("/shanyraks/{id}/comments", status_code=200, response_model=List[CommentResponse])
-def get_comments(
+COMMENTS_PAGE_SIZE = 100
+
+
+async def ndjson_comments(chunks: AsyncIterator[list]) -> AsyncIterator[bytes]:
+    async for rows in chunks:
+        yield b"".join(dumps(comment_response(row)) + b"\n" for row in rows)
+
+
+@router.get("/shanyraks/{id}/comments", status_code=200, response_model=List[CommentResponse])
+async def get_comments(
             id: int,
-            db: Session = Depends(get_db),
-            token: str = Depends(oauth2_scheme)
+            request: Request,
+            limit: Optional[int] = Query(default=None, ge=1, le=500),
+            cursor: Optional[str] = None,
+            format: Literal["json", "ndjson"] = "json",
+            db: DbSession = Depends(get_read_db),
+            services: Services = Depends(get_services),
+            claims: TokenClaims = Depends(current_user)
 ):
     try:
-        user_id = decode_jwt(token)
+        user_id = claims.id
         if user_id:
-            ads = announcements_repository.get_announcement_by_id(db, id)
-            comments = comments_repository.get_comments_by_ads(ads)
-            new_comments = []
-            for comment in comments:
-                new_comments.append(CommentResponse(id=comment.id,
-                                                    content=comment.content,
-                                                    created_at=str(comment.created_at),
-                                                    author_id=comment.author_id))
+            after = None
+            if cursor is not None:
+                position = decode_cursor(cursor, created_at=datetime.fromisoformat, id=int)
+                after = (position["created_at"], position["id"])
+
+            if format == "ndjson":
+                chunks = services.comments_repository.stream_comments(db, id, after)
+                return StreamingResponse(ndjson_comments(chunks), media_type="application/x-ndjson")
+
+            limit = limit or COMMENTS_PAGE_SIZE
+            headers = {}
+            version = await services.announcements_repository.get_announcement_version(db, id)
+            if version is not None:
+                headers = validator_headers(make_etag("c", id, version[0], limit, cursor or ""), version[1])
+                if is_not_modified(request, headers["ETag"], version[1]):
+                    return not_modified(headers)
+            new_comments = await services.comments_repository.get_comment_responses(
+                db, id, limit, after, version[0] if version is not None else None)
+            if len(new_comments) == limit:
+                last = new_comments[-1]
+                headers["X-Next-Cursor"] = encode_cursor(created_at=last["created_at"], id=last["id"])
         else:
             raise HTTPException(status_code=404, detail="User not found")
     except KeyError:
         raise HTTPException(status_code=400, detail="Comment already exists")
 
-    return new_comments
+    return FastJSONResponse(new_comments, headers=headers)
+
+
+REPLAY_PAGE_SIZE = 500
+
 
+@router.get("/shanyraks/{id}/comments/stream", status_code=200)
+async def stream_comments(
+            id: int,
+            timeout: Optional[float] = Query(default=None, ge=0),
+            last_event_id: Optional[int] = Header(default=None),
+            services: Services = Depends(get_services),
+            claims: TokenClaims = Depends(current_user)
+):
+    """Server-Sent Events for the announcement's comments.
+
+    ``comment_created`` events carry the comment id as the event id; on
+    reconnect the comments created after Last-Event-ID are sent first,
+    from the database, so nothing posted while the client was away is
+    missed. Edits and deletions are only sent live. The stream ends after
+    ``timeout`` seconds, at most EVENTS_STREAM_TIMEOUT; ``timeout=0`` only
+    sends the catch-up.
+
+    Sessions are opened per query rather than through ``get_db``: a stream
+    must not hold a pooled connection for its lifetime.
+    """
+    async with services.open_db() as db:
+        version = await services.announcements_repository.get_announcement_version(db, id)
+    if version is None:
+        raise HTTPException(status_code=404, detail="Announcement not found")
 
-@app.patch("/shanyraks/{id}/comments/{comment_id}")
-def patch_comment(id: int,
-                  comment_id: int,
-                  upd_data: CommentUpdate,
-                  db: Session = Depends(get_db),
-                  token: str = Depends(oauth2_scheme)):
-        user_id = decode_jwt(token)
+    async def replay() -> AsyncIterator[Event]:
+        after = last_event_id
+        while after is not None:
+            async with services.open_db() as db:
+                rows = await services.comments_repository.get_comments_after_id(db, id, after, REPLAY_PAGE_SIZE)
+            for row in rows:
+                yield Event("comment_created", comment_response(row), row.id)
+            after = rows[-1].id if len(rows) == REPLAY_PAGE_SIZE else None
+
+    limit = services.settings.events_stream_timeout
+    body = services.events.stream(comments_topic(id), replay, services.settings.events_heartbeat,
+                                  limit if timeout is None else min(timeout, limit))
+    return StreamingResponse(body, media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+@router.patch("/shanyraks/{id}/comments/{comment_id}")
+async def patch_comment(id: int,
+                        comment_id: int,
+                        upd_data: CommentUpdate,
+                        db: DbSession = Depends(get_db),
+                        services: Services = Depends(get_services),
+                        claims: TokenClaims = Depends(current_user)):
+        user_id = claims.id
         if user_id:
             new_data = Comment(content=upd_data.content)
 
-            comments_repository.update(db, comment_id, id, user_id, new_data)
+            updated = await services.comments_repository.update(db, comment_id, id, user_id, new_data)
+            await services.events.publish(comments_topic(id), Event("comment_updated", updated))
         else:
             raise HTTPException(status_code=401, detail="Unauthorized")
         return {"message": "Comment updated successfully"}
 
 
-@app.delete("/shanyraks/{id}/comments/{comment_id}")
-def delete_comment(id: int,
-                   comment_id: int,
-                   db: Session = Depends(get_db),
-                   token: str = Depends(oauth2_scheme)):
-        user_id = decode_jwt(token)
+@router.delete("/shanyraks/{id}/comments/{comment_id}")
+async def delete_comment(id: int,
+                         comment_id: int,
+                         db: DbSession = Depends(get_db),
+                         services: Services = Depends(get_services),
+                         claims: TokenClaims = Depends(current_user)):
+        user_id = claims.id
         if user_id:
-            ads = announcements_repository.get_announcement_by_id(db, id)
-            ads.comment_count = ads.comment_count - 1
-            comments_repository.delete(db, comment_id, id, user_id)
+            await services.comments_repository.delete(db, comment_id, id, user_id)
+            await services.events.publish(comments_topic(id), Event("comment_deleted", {"id": comment_id}))
         else:
             raise HTTPException(status_code=401, detail="Unauthorized")
         return {"message": "Comment deleted successfully"}
 
 
-favorite_cart = []
+FAVORITES_PAGE_SIZE = 20
 
 
-@app.post("/auth/users/favorites/shanyraks/{id}")
-def post_favorites(
+@router.post("/auth/users/favorites/shanyraks/{id}")
+async def post_favorites(
         id: int,
+        db: DbSession = Depends(get_db),
+        services: Services = Depends(get_services),
+        claims: TokenClaims = Depends(current_user)
 ):
-    if id not in favorite_cart:
-        favorite_cart.append(id)
-        response = JSONResponse(content={"message": "Item added to cart successfully"}, status_code=200)
-        response.set_cookie(key="favorite_items", value=",".join(map(str, favorite_cart)))
-        return response
-
+    user_id = claims.id
+    added = await services.favorites_repository.add(db, user_id, [id])
+    # Nothing added is either a duplicate, which succeeds again, or no such listing.
+    if not added and await services.announcements_repository.get_announcement_version(db, id) is None:
+        raise HTTPException(status_code=404, detail="Announcement not found")
+    return {"message": "Item added to cart successfully"}
 
-@app.get("/auth/users/favorites/shanyraks")
-def get_to_favorite_ads(request: Request, db: Session = Depends(get_db)):
-    favorite_items = request.cookies.get("favorite_items")
-    cart_favorite = []
 
-    if favorite_items:
-        cart_favorite_list = list(map(int, favorite_items.split(",")))
-        for ads_id in cart_favorite_list:
-            ads = announcements_repository.get_announcement_by_id(db, ads_id)
-            if ads:
-                cart_favorite.append(ads)
-    return {
-        "cart_favorite": cart_favorite,
-    }
+@router.post("/auth/users/favorites/shanyraks")
+async def post_favorites_batch(
+        batch: FavoritesBatch,
+        db: DbSession = Depends(get_db),
+        services: Services = Depends(get_services),
+        claims: TokenClaims = Depends(current_user)
+):
+    user_id = claims.id
+    added = await services.favorites_repository.add(db, user_id, batch.ids)
+    return {"added": len(added)}
+
+
+@router.get("/auth/users/favorites/shanyraks", response_model=FavoritesPage)
+async def get_to_favorite_ads(
+        limit: int = Query(default=FAVORITES_PAGE_SIZE, ge=1, le=100),
+        cursor: Optional[str] = None,
+        db: DbSession = Depends(get_read_db),
+        services: Services = Depends(get_services),
+        claims: TokenClaims = Depends(current_user)
+):
+    user_id = claims.id
+    after_id = decode_cursor(cursor, id=int)["id"] if cursor is not None else None
+    cart_favorite = await services.favorites_repository.get_favorite_announcements(db, user_id, limit, after_id)
+
+    next_cursor = None
+    if len(cart_favorite) == limit:
+        next_cursor = encode_cursor(id=cart_favorite[-1].id)
+
+    return FastJSONResponse({
+        "cart_favorite": [row._asdict() for row in cart_favorite],
+        "next_cursor": next_cursor
+    })
+
+
+@router.delete("/auth/users/favorites/shanyraks")
+async def delete_favorites_batch(
+        batch: FavoritesBatch,
+        db: DbSession = Depends(get_db),
+        services: Services = Depends(get_services),
+        claims: TokenClaims = Depends(current_user)
+):
+    user_id = claims.id
+    removed = await services.favorites_repository.remove(db, user_id, batch.ids)
+    return {"removed": len(removed)}
 
 
-@app.delete("/auth/users/favorites/shanyraks/{id}")
-def delete_favorites(
-        request: Request,
+@router.delete("/auth/users/favorites/shanyraks/{id}")
+async def delete_favorites(
         id: int,
+        db: DbSession = Depends(get_db),
+        services: Services = Depends(get_services),
+        claims: TokenClaims = Depends(current_user)
 ):
-    try:
-        favorite_items = request.cookies.get("favorite_items")
-        if favorite_items:
-            cart_favorite_list = list(map(int, favorite_items.split(",")))
-            cart_favorite_list.remove(id)
-            response = JSONResponse(content={"message": "Item removed from cart successfully"}, status_code=200)
-            response.set_cookie(key="favorite_items", value=",".join(map(str, cart_favorite_list)))
-            return response
-    except ValueError:
+    user_id = claims.id
+    removed = await services.favorites_repository.remove(db, user_id, [id])
+    if not removed:
         raise HTTPException(status_code=404, detail="Item not found in favorites")
+    return {"message": "Item removed from cart successfully"}
+
+
+ESTIMATE_COUNT_CAP = 10000
 
-@app.get("/shanyraks")
-def search_announcements(
-            limit: int = Query(default=10, le=100),
-            offset: int = Query(default=0),
+
+@router.get("/shanyraks", response_model=AnnouncementPage)
+async def search_announcements(
+            limit: int = Query(default=10, ge=1, le=100),
+            offset: int = Query(default=0, ge=0),
             type: Optional[str] = None,
             rooms_count: Optional[int] = None,
             price_from: Optional[int] = None,
             price_until: Optional[int] = None,
-            db: Session = Depends(get_db)
+            cursor: Optional[str] = None,
+            count: Literal["exact", "estimate", "none"] = "exact",
+            db: DbSession = Depends(get_read_db),
+            services: Services = Depends(get_services)
 ):
-    filtered_announcements = []
-    announcements = announcements_repository.get_announcements(db)
-    for announcement in announcements:
-        if (type is None or announcement.type == type) and \
-                (rooms_count is None or announcement.rooms_count == rooms_count) and \
-                (price_from is None or announcement.price >= price_from) and \
-                (price_until is None or announcement.price <= price_until):
-            filtered_announcements.append(announcement)
-
-    total = len(filtered_announcements)
-    paginated_announcements = filtered_announcements[offset: offset + limit]
+    after_id = decode_cursor(cursor, id=int)["id"] if cursor is not None else None
+    criteria = AnnouncementSearch(type=type, rooms_count=rooms_count,
+                                  price_from=price_from, price_until=price_until)
+    announcements = await services.announcements_repository.search(db, criteria, limit, offset, after_id)
+
+    total = None
+    if count == "exact":
+        total = await services.announcements_repository.count(db, criteria)
+    elif count == "estimate":
+        total = await services.announcements_repository.count(db, criteria, cap=ESTIMATE_COUNT_CAP)
+
+    next_cursor = None
+    if len(announcements) == limit:
+        next_cursor = encode_cursor(id=announcements[-1].id)
 
     result = {
         "total": total,
-        "announcements": paginated_announcements
+        "announcements": [row._asdict() for row in announcements],
+        "next_cursor": next_cursor
     }
 
-    return result
\ No newline at end of file
+    return FastJSONResponse(result)
+
+
+def create_app(settings: Settings = settings) -> FastAPI:
+    services = Services(settings)
+    app = FastAPI(lifespan=lifespan)
+    app.state.services = services
+    app.state.rate_limits = services.rate_limits
+    app.state.tokens = services.tokens
+
+    # Added first so the metrics middleware, added after it, wraps it and
+    # counts shed requests too.
+    app.add_middleware(AdmissionMiddleware, limit=settings.write_concurrency,
+                       queue=settings.write_queue, timeout=settings.write_queue_timeout)
+    if settings.metrics_enabled:
+        app.add_middleware(MetricsMiddleware, server_timing=settings.server_timing)
+    app.include_router(router)
+    return app
+
+
+app = create_app()
@@ -0,0 +1,114 @@
+"""Maintenance commands.
+
+``migrate`` also adopts databases created before the schema was managed by
+Alembic, such as the bundled sql_app.db: they have the tables of the
+initial revision but no alembic_version, so they are stamped at that
+revision first and then upgraded like any other.
+
+    python manage.py migrate
+    python manage.py reindex-text
+    python manage.py reconcile-counters
+    python manage.py rebuild-facets
+    python manage.py geocode
+"""
+import argparse
+from pathlib import Path
+from typing import Optional
+
+from sqlalchemy import create_engine, inspect
+from sqlalchemy.pool import NullPool
+
+from config import settings
+from database import Database
+from geocoding import build_geocoder
+from repositories import AnnouncementsRepository
+
+
+ROOT = Path(__file__).resolve().parent.parent
+
+# The schema Base.metadata.create_all used to build at startup; the first
+# migration recreates it exactly.
+INITIAL_REVISION = "3f2a9c1d7e10"
+
+
+def unversioned(url: str) -> bool:
+    """Whether ``url`` has the app's tables but was never stamped by Alembic."""
+    engine = create_engine(url, poolclass=NullPool)
+    try:
+        tables = set(inspect(engine).get_table_names())
+    finally:
+        engine.dispose()
+    return "users" in tables and "alembic_version" not in tables
+
+
+def migrate(url: Optional[str] = None, revision: str = "head") -> bool:
+    """Bring the schema at ``url`` (the configured database by default) to ``revision``.
+
+    The app no longer creates tables itself; run this before starting it.
+    Returns True when an unversioned database was stamped at
+    INITIAL_REVISION before the upgrade.
+    """
+    from alembic import command
+    from alembic.config import Config
+
+    url = url or settings.database_url
+    config = Config(str(ROOT / "alembic.ini"))
+    config.set_main_option("script_location", str(ROOT / "alembic"))
+    config.attributes["database_url"] = url
+    config.attributes["configure_logger"] = False
+    stamped = unversioned(url)
+    if stamped:
+        command.stamp(config, INITIAL_REVISION)
+    command.upgrade(config, revision)
+    return stamped
+
+
+def upgrade(args) -> None:
+    if migrate():
+        print("existing tables stamped at %s" % INITIAL_REVISION)
+    print("schema at head")
+
+
+def reindex_text(args) -> None:
+    with Database(settings).SessionLocal() as db:
+        AnnouncementsRepository().rebuild_text_index(db)
+    print("announcements_fts rebuilt")
+
+
+def reconcile_counters(args) -> None:
+    with Database(settings).SessionLocal() as db:
+        rows = AnnouncementsRepository().reconcile_counters(db)
+    print("comment_count/favorites_count corrected on %d announcements" % rows)
+
+
+def rebuild_facets(args) -> None:
+    with Database(settings).SessionLocal() as db:
+        rows = AnnouncementsRepository().rebuild_facets(db)
+    print("announcement_facets rebuilt with %d rows" % rows)
+
+
+def geocode(args) -> None:
+    with Database(settings).SessionLocal() as db:
+        located = AnnouncementsRepository(geocoder=build_geocoder(settings)).geocode_missing(db)
+    print("geocoded %d announcements" % located)
+
+
+COMMANDS = {
+    "migrate": upgrade,
+    "reindex-text": reindex_text,
+    "reconcile-counters": reconcile_counters,
+    "rebuild-facets": rebuild_facets,
+    "geocode": geocode,
+}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("command", choices=sorted(COMMANDS))
+    args = parser.parse_args()
+
+    COMMANDS[args.command](args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,295 @@
+import asyncio
+import logging
+import threading
+import time
+from bisect import bisect_left
+from contextvars import ContextVar
+from functools import wraps
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+from fastapi.routing import APIRoute
+from sqlalchemy import event
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+SQL_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 50)
+
+# Starlette appends "; charset=utf-8" to text/ media types.
+CONTENT_TYPE = "text/plain; version=0.0.4"
+
+
+def escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = ['%s="%s"' % (name, escape(str(value))) for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{%s}" % ",".join(pairs) if pairs else ""
+
+
+def format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    """One metric family; each distinct label tuple is its own series."""
+
+    type = "untyped"
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.lock = threading.Lock()
+        self.series: Dict[Tuple[str, ...], object] = {}
+
+    def render(self) -> List[str]:
+        lines = ["# HELP %s %s" % (self.name, self.help), "# TYPE %s %s" % (self.name, self.type)]
+        with self.lock:
+            series = sorted(self.series.items())
+        for values, value in series:
+            lines.extend(self.render_series(values, value))
+        return lines
+
+    def render_series(self, values: Tuple[str, ...], value) -> List[str]:
+        return ["%s%s %s" % (self.name, format_labels(self.labels, values), format_value(value))]
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def inc(self, *values: str, amount: float = 1) -> None:
+        with self.lock:
+            self.series[values] = self.series.get(values, 0) + amount
+
+
+class Gauge(Metric):
+    type = "gauge"
+
+    def add(self, *values: str, amount: float = 1) -> None:
+        with self.lock:
+            self.series[values] = self.series.get(values, 0) + amount
+
+
+class Histogram(Metric):
+    """Fixed-bucket histogram. Buckets are kept per bucket and made
+    cumulative only when rendered, so an observation touches one slot."""
+
+    type = "histogram"
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value: float, *values: str) -> None:
+        index = bisect_left(self.buckets, value)
+        with self.lock:
+            series = self.series.get(values)
+            if series is None:
+                series = self.series[values] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += value
+
+    def render_series(self, values: Tuple[str, ...], value) -> List[str]:
+        counts, total = value
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float("inf"),), counts):
+            cumulative += count
+            labels = format_labels(self.labels, values, 'le="%s"' % format_value(float(bound)))
+            lines.append("%s_bucket%s %d" % (self.name, labels, cumulative))
+        labels = format_labels(self.labels, values)
+        lines.append("%s_sum%s %s" % (self.name, labels, repr(total)))
+        lines.append("%s_count%s %d" % (self.name, labels, cumulative))
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self.metrics: List[Metric] = []
+
+    def register(self, metric: Metric) -> Metric:
+        self.metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+requests_total = registry.register(Counter(
+    "http_requests_total", "Requests by route and status code.", ("method", "route", "status")))
+request_duration = registry.register(Histogram(
+    "http_request_duration_seconds", "Time from request start to the last body chunk.", ("method", "route")))
+requests_in_flight = registry.register(Gauge(
+    "http_requests_in_flight", "Requests currently being handled.", ("method",)))
+request_queries = registry.register(Histogram(
+    "http_request_sql_queries", "SQL statements sent per request.", ("method", "route"), QUERY_COUNT_BUCKETS))
+request_sql_duration = registry.register(Histogram(
+    "http_request_sql_duration_seconds", "SQL time spent per request.", ("method", "route"), SQL_BUCKETS))
+sql_duration = registry.register(Histogram(
+    "sql_query_duration_seconds", "Duration of every SQL statement, in or out of a request.", (), SQL_BUCKETS))
+slow_queries = registry.register(Counter(
+    "sql_slow_queries_total", "Statements slower than the slow-query threshold."))
+
+
+class RequestTimings:
+    """What one request has spent so far; lives in ``current_timings``."""
+
+    __slots__ = ("route", "started", "handler_seconds", "handler_done", "sql_count", "sql_seconds")
+
+    def __init__(self):
+        self.route = "unmatched"
+        self.started = time.perf_counter()
+        self.handler_seconds = 0.0
+        self.handler_done: Optional[float] = None
+        self.sql_count = 0
+        self.sql_seconds = 0.0
+
+    def server_timing(self, now: float) -> str:
+        total = now - self.started
+        # Statements sent by dependencies (get_db, current_user) fall outside
+        # the handler, so "app" never goes below zero.
+        app = max(self.handler_seconds - self.sql_seconds, 0.0)
+        serialize = now - self.handler_done if self.handler_done is not None else 0.0
+        return ('db;dur=%.2f;desc="%d queries", app;dur=%.2f, serialize;dur=%.2f, total;dur=%.2f'
+                % (self.sql_seconds * 1000, self.sql_count, app * 1000, serialize * 1000, total * 1000))
+
+
+# The threadpool (anyio) and the async session's greenlets both run in a copy
+# of the request's context, so SQL events find the request's timings here.
+current_timings: ContextVar[Optional[RequestTimings]] = ContextVar("current_timings", default=None)
+
+
+def timed_endpoint(endpoint: Callable) -> Callable:
+    # include_router builds every route again from the already-timed
+    # endpoint; wrapping it a second time would record each call twice.
+    if getattr(endpoint, "is_timed", False):
+        return endpoint
+
+    def record(started: float) -> None:
+        timings = current_timings.get()
+        if timings is not None:
+            timings.handler_done = time.perf_counter()
+            timings.handler_seconds = timings.handler_done - started
+
+    if asyncio.iscoroutinefunction(endpoint):
+        @wraps(endpoint)
+        async def timed(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return await endpoint(*args, **kwargs)
+            finally:
+                record(started)
+    else:
+        @wraps(endpoint)
+        def timed(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return endpoint(*args, **kwargs)
+            finally:
+                record(started)
+    timed.is_timed = True
+    return timed
+
+
+class TimedRoute(APIRoute):
+    """Labels the request with its path template and times the endpoint
+    itself, leaving dependency resolution and response serialization out.
+
+        app.router.route_class = TimedRoute
+    """
+
+    def __init__(self, path: str, endpoint: Callable, **kwargs):
+        super().__init__(path, timed_endpoint(endpoint), **kwargs)
+
+    async def handle(self, scope, receive, send) -> None:
+        timings = current_timings.get()
+        if timings is not None:
+            timings.route = self.path_format
+        await super().handle(scope, receive, send)
+
+
+def instrument_engine(engine, slow_query_ms: float) -> None:
+    """Time every statement on ``engine`` and charge it to the current request."""
+    # AsyncEngine only exposes cursor events on its sync_engine.
+    sync_engine = getattr(engine, "sync_engine", engine)
+    slow_seconds = slow_query_ms / 1000
+
+    @event.listens_for(sync_engine, "before_cursor_execute")
+    def start_query(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+    @event.listens_for(sync_engine, "after_cursor_execute")
+    def finish_query(conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info["query_started"].pop()
+        sql_duration.observe(elapsed)
+        timings = current_timings.get()
+        if timings is not None:
+            timings.sql_count += 1
+            timings.sql_seconds += elapsed
+        if elapsed >= slow_seconds:
+            slow_queries.inc()
+            logger.warning("slow query (%.1f ms, %s): %s", elapsed * 1000,
+                           timings.route if timings is not None else "no request", " ".join(statement.split()))
+
+    @event.listens_for(sync_engine, "handle_error")
+    def drop_failed_query(exception_context):
+        started = exception_context.connection.info.get("query_started") \
+            if exception_context.connection is not None else None
+        if started:
+            started.pop()
+
+
+class MetricsMiddleware:
+    """ASGI middleware recording latency, status and SQL use per route.
+
+    Metrics are per process; with several workers each one exports its own
+    series and Prometheus sums them. The Server-Timing header is computed
+    when the response starts, so for streamed bodies it covers the time to
+    the first byte.
+    """
+
+    def __init__(self, app, server_timing: bool = False):
+        self.app = app
+        self.server_timing = server_timing
+
+    async def __call__(self, scope, receive, send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        timings = RequestTimings()
+        token = current_timings.set(timings)
+        method = scope["method"]
+        status = 500
+
+        async def send_with_timing(message) -> None:
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                if self.server_timing:
+                    header = timings.server_timing(time.perf_counter()).encode("latin-1")
+                    message["headers"] = list(message.get("headers", [])) + [(b"server-timing", header)]
+            await send(message)
+
+        requests_in_flight.add(method)
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            requests_in_flight.add(method, amount=-1)
+            current_timings.reset(token)
+            route = timings.route
+            requests_total.inc(method, route, str(status))
+            request_duration.observe(time.perf_counter() - timings.started, method, route)
+            request_queries.observe(timings.sql_count, method, route)
+            request_sql_duration.observe(timings.sql_seconds, method, route)
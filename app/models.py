@@ -1,6 +1,9 @@
-from pydantic import BaseModel
+from typing import Dict, List, Optional
+
+from pydantic import BaseModel, Field
 from database import Base
-from sqlalchemy import Column, Integer, String, Float, DateTime, ForeignKey
+from sqlalchemy import Column, Integer, String, Float, DateTime, ForeignKey, Index, DDL, event
+from sqlalchemy.dialects import sqlite
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
 
@@ -45,18 +48,96 @@ class Announcement(Base):
     __tablename__ = "announcements"
 
     id = Column(Integer, primary_key=True, index=True)
-    type = Column(String, index=True)
+    type = Column(String)
     price = Column(Integer, index=True)
     address = Column(String)
     area = Column(Float)
-    rooms_count = Column(Integer)
+    rooms_count = Column(Integer, index=True)
     description = Column(String)
-    user_id = Column(Integer, ForeignKey("users.id"))
+    user_id = Column(Integer, ForeignKey("users.id"), index=True)
     comment_count = Column(Integer, default=0)
+    favorites_count = Column(Integer, nullable=False, default=0, server_default="0")
+    view_count = Column(Integer, nullable=False, default=0, server_default="0")
+    latitude = Column(Float)
+    longitude = Column(Float)
+    version = Column(Integer, nullable=False, default=1, server_default="1")
+    updated_at = Column(DateTime(timezone=True), default=func.now(), onupdate=func.now())
 
     user = relationship("User", back_populates="announcement")
     comment = relationship("Comment", back_populates="announcement")
 
+    __table_args__ = (
+        Index("ix_announcements_type_rooms_count", "type", "rooms_count"),
+        Index("ix_announcements_type_price", "type", "price"),
+        Index("ix_announcements_rooms_count_price", "rooms_count", "price"),
+        Index("ix_announcements_type_rooms_count_price", "type", "rooms_count", "price"),
+        Index("ix_announcements_latitude_longitude", "latitude", "longitude"),
+    )
+
+
+# Full-text index over address and description. It is an external-content
+# FTS5 table (the text lives only in announcements) kept in sync by triggers,
+# so bulk inserts and raw SQL updates are indexed too.
+ANNOUNCEMENTS_FTS_DDL = [
+    "CREATE VIRTUAL TABLE IF NOT EXISTS announcements_fts USING fts5("
+    "address, description, content='announcements', content_rowid='id', "
+    "tokenize='unicode61 remove_diacritics 2')",
+    "CREATE TRIGGER IF NOT EXISTS announcements_fts_ai AFTER INSERT ON announcements BEGIN "
+    "INSERT INTO announcements_fts(rowid, address, description) "
+    "VALUES (new.id, new.address, new.description); END",
+    "CREATE TRIGGER IF NOT EXISTS announcements_fts_ad AFTER DELETE ON announcements BEGIN "
+    "INSERT INTO announcements_fts(announcements_fts, rowid, address, description) "
+    "VALUES ('delete', old.id, old.address, old.description); END",
+    "CREATE TRIGGER IF NOT EXISTS announcements_fts_au AFTER UPDATE OF address, description ON announcements BEGIN "
+    "INSERT INTO announcements_fts(announcements_fts, rowid, address, description) "
+    "VALUES ('delete', old.id, old.address, old.description); "
+    "INSERT INTO announcements_fts(rowid, address, description) "
+    "VALUES (new.id, new.address, new.description); END",
+]
+
+for statement in ANNOUNCEMENTS_FTS_DDL:
+    event.listen(Announcement.__table__, "after_create", DDL(statement).execute_if(dialect="sqlite"))
+event.listen(Announcement.__table__, "before_drop",
+             DDL("DROP TABLE IF EXISTS announcements_fts").execute_if(dialect="sqlite"))
+
+
+# R*Tree over announcement coordinates, one point box per geocoded row, kept
+# in sync by triggers like the FTS table. Other databases fall back to the
+# (latitude, longitude) index.
+ANNOUNCEMENTS_RTREE_DDL = [
+    "CREATE VIRTUAL TABLE IF NOT EXISTS announcements_rtree USING rtree(id, min_lat, max_lat, min_lon, max_lon)",
+    "CREATE TRIGGER IF NOT EXISTS announcements_rtree_ai AFTER INSERT ON announcements "
+    "WHEN new.latitude IS NOT NULL AND new.longitude IS NOT NULL BEGIN "
+    "INSERT INTO announcements_rtree VALUES (new.id, new.latitude, new.latitude, new.longitude, new.longitude); END",
+    "CREATE TRIGGER IF NOT EXISTS announcements_rtree_ad AFTER DELETE ON announcements BEGIN "
+    "DELETE FROM announcements_rtree WHERE id = old.id; END",
+    "CREATE TRIGGER IF NOT EXISTS announcements_rtree_au AFTER UPDATE OF latitude, longitude ON announcements BEGIN "
+    "DELETE FROM announcements_rtree WHERE id = old.id; "
+    "INSERT INTO announcements_rtree SELECT new.id, new.latitude, new.latitude, new.longitude, new.longitude "
+    "WHERE new.latitude IS NOT NULL AND new.longitude IS NOT NULL; END",
+]
+
+for statement in ANNOUNCEMENTS_RTREE_DDL:
+    event.listen(Announcement.__table__, "after_create", DDL(statement).execute_if(dialect="sqlite"))
+event.listen(Announcement.__table__, "before_drop",
+             DDL("DROP TABLE IF EXISTS announcements_rtree").execute_if(dialect="sqlite"))
+
+
+class AnnouncementFacet(Base):
+    """Announcement counts per (type, rooms_count, price bucket).
+
+    A few hundred rows summarise the whole table, so facet counts for any
+    filter combination are sums over this table instead of table scans.
+    Kept in step by AnnouncementsRepository; ``manage.py rebuild-facets``
+    recomputes it from scratch.
+    """
+    __tablename__ = "announcement_facets"
+
+    type = Column(String, primary_key=True)
+    rooms_count = Column(Integer, primary_key=True)
+    price_bucket = Column(Integer, primary_key=True)
+    count = Column(Integer, nullable=False, default=0)
+
 
 class AnnouncementRequest(BaseModel):
     type: str
@@ -65,6 +146,8 @@ class AnnouncementRequest(BaseModel):
     area: float
     rooms_count: int
     description: str
+    latitude: Optional[float] = Field(default=None, ge=-90, le=90)
+    longitude: Optional[float] = Field(default=None, ge=-180, le=180)
 
 
 class AnnouncementResponse(BaseModel):
@@ -77,6 +160,48 @@ class AnnouncementResponse(BaseModel):
     description: str
     user_id: int
     comment_count: int
+    favorites_count: int = 0
+    view_count: int = 0
+    latitude: Optional[float] = None
+    longitude: Optional[float] = None
+
+
+class AnnouncementSearch(BaseModel):
+    type: Optional[str] = None
+    rooms_count: Optional[int] = None
+    price_from: Optional[int] = None
+    price_until: Optional[int] = None
+
+
+class AnnouncementPage(BaseModel):
+    total: Optional[int]
+    announcements: List[AnnouncementResponse]
+    next_cursor: Optional[str]
+
+
+class AnnouncementSearchResult(AnnouncementResponse):
+    score: float
+
+
+class AnnouncementNearbyResult(AnnouncementResponse):
+    distance_km: float
+
+
+class AnnouncementSimilarResult(AnnouncementResponse):
+    distance: float
+
+
+class PriceBucket(BaseModel):
+    price_from: int
+    price_until: Optional[int]
+    count: int
+
+
+class AnnouncementFacets(BaseModel):
+    total: int
+    type: Dict[str, int]
+    rooms_count: Dict[int, int]
+    price: List[PriceBucket]
 
 
 class AnnouncementUpdate(BaseModel):
@@ -86,6 +211,15 @@ class AnnouncementUpdate(BaseModel):
     area: float
     rooms_count: int
     description: str
+    latitude: Optional[float] = Field(default=None, ge=-90, le=90)
+    longitude: Optional[float] = Field(default=None, ge=-180, le=180)
+
+
+# SQLite stores DATETIME as text. Binding values in the same layout as
+# CURRENT_TIMESTAMP keeps range comparisons against server-set values exact.
+SQLITE_TIMESTAMP = sqlite.DATETIME(
+    storage_format="%(year)04d-%(month)02d-%(day)02d %(hour)02d:%(minute)02d:%(second)02d"
+)
 
 
 class Comment(Base):
@@ -93,13 +227,21 @@ class Comment(Base):
 
     id = Column(Integer, primary_key=True, index=True)
     content = Column(String, nullable=False)
-    created_at = Column(DateTime(timezone=True), server_default=func.now())
-    author_id = Column(Integer, ForeignKey("users.id"))
+    created_at = Column(DateTime(timezone=True).with_variant(SQLITE_TIMESTAMP, "sqlite"),
+                        server_default=func.now())
+    author_id = Column(Integer, ForeignKey("users.id"), index=True)
     ads_id = Column(Integer, ForeignKey("announcements.id"))
 
     user = relationship("User", back_populates="comment")
     announcement = relationship("Announcement", back_populates="comment")
 
+    __table_args__ = (
+        Index("ix_comments_ads_id_created_at_id", "ads_id", "created_at", "id"),
+    )
+    # created_at comes back from the INSERT (RETURNING), so a new comment
+    # can be published without reading it again.
+    __mapper_args__ = {"eager_defaults": True}
+
 
 class CommentRequest(BaseModel):
     content: str
@@ -113,4 +255,45 @@ class CommentResponse(BaseModel):
 
 
 class CommentUpdate(BaseModel):
-    content: str
\ No newline at end of file
+    content: str
+
+
+class Favorite(Base):
+    __tablename__ = "favorites"
+
+    # The composite primary key is the unique (user_id, announcement_id)
+    # index: it rejects duplicates and serves a user's list in id order.
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), primary_key=True)
+    announcement_id = Column(Integer, ForeignKey("announcements.id", ondelete="CASCADE"),
+                             primary_key=True, index=True)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+
+class TaskOutbox(Base):
+    """Queued background tasks, written in the same transaction as the row
+    that caused them, so a committed write never loses its side effects.
+
+    ``claimed_until`` is the lease of the process working on a task; once
+    it lapses (the process died) any other process may take the task.
+    Tasks that ran out of attempts keep their row with ``available_at``
+    NULL and the last error, for inspection.
+    """
+    __tablename__ = "task_outbox"
+
+    id = Column(Integer, primary_key=True, index=True)
+    name = Column(String, nullable=False)
+    payload = Column(String, nullable=False)
+    attempts = Column(Integer, nullable=False, server_default="0")
+    available_at = Column(Float, index=True)
+    claimed_until = Column(Float)
+    last_error = Column(String)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+
+class FavoritesBatch(BaseModel):
+    ids: List[int] = Field(min_length=1, max_length=100)
+
+
+class FavoritesPage(BaseModel):
+    cart_favorite: List[AnnouncementResponse]
+    next_cursor: Optional[str]
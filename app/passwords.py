@@ -0,0 +1,110 @@
+import asyncio
+import base64
+import hashlib
+import hmac
+import os
+from concurrent.futures import Executor, ThreadPoolExecutor
+from typing import Optional, Tuple
+
+from config import Settings
+
+SCHEME = "scrypt"
+
+
+def scrypt_params(settings: Settings) -> Tuple[int, int, int]:
+    return settings.password_scrypt_n, settings.password_scrypt_r, settings.password_scrypt_p
+
+
+def hash_password(password: str, n: int, r: int, p: int) -> str:
+    """Return ``scrypt$n$r$p$salt$hash`` for ``password``.
+
+    Runs on the password pool: hashlib.scrypt releases the GIL, so worker
+    threads hash in parallel without holding up the event loop.
+    """
+    salt = os.urandom(16)
+    digest = hashlib.scrypt(password.encode(), salt=salt, n=n, r=r, p=p, maxmem=256 * n * r * p, dklen=32)
+    return "$".join([SCHEME, str(n), str(r), str(p),
+                     base64.b64encode(salt).decode(), base64.b64encode(digest).decode()])
+
+
+def check_password(password: str, stored: str) -> bool:
+    """Compare ``password`` with a stored hash, or with a legacy plaintext value."""
+    parts = stored.split("$")
+    if len(parts) != 6 or parts[0] != SCHEME:
+        return hmac.compare_digest(password.encode(), stored.encode())
+    n, r, p = int(parts[1]), int(parts[2]), int(parts[3])
+    salt, expected = base64.b64decode(parts[4]), base64.b64decode(parts[5])
+    digest = hashlib.scrypt(password.encode(), salt=salt, n=n, r=r, p=p,
+                            maxmem=256 * n * r * p, dklen=len(expected))
+    return hmac.compare_digest(digest, expected)
+
+
+def needs_rehash(stored: str, n: int, r: int, p: int) -> bool:
+    """True for plaintext rows and hashes made with other cost parameters."""
+    return not stored.startswith("%s$%d$%d$%d$" % (SCHEME, n, r, p))
+
+
+class PasswordHasher:
+    """Runs scrypt on its own bounded pool, apart from the request threadpool.
+
+    ``max_pending`` caps the calls queued or running at once; further
+    callers wait on the event loop, so a login burst cannot pile up work
+    (or threads) without limit. Mode "inline" hashes on the calling thread
+    and exists for comparison benchmarks.
+    """
+
+    def __init__(self, mode: str = "thread", workers: int = 2, max_pending: int = 64,
+                 params: Tuple[int, int, int] = (2 ** 14, 8, 1)):
+        self.mode = mode
+        self.workers = workers
+        self.params = params
+        self.executor: Optional[Executor] = None
+        self.max_pending = max_pending
+        self._pending: Optional[asyncio.Semaphore] = None
+        self._dummy: Optional[str] = None
+
+    def start_executor(self) -> Executor:
+        # Started on first use rather than at construction, so a server that
+        # imports the app and then forks workers does not fork pool threads.
+        if self.mode == "process":
+            from concurrent.futures import ProcessPoolExecutor
+
+            self.executor = ProcessPoolExecutor(max_workers=self.workers)
+        else:
+            self.executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="password")
+        return self.executor
+
+    async def run(self, fn, *args):
+        if self.mode == "inline":
+            return fn(*args)
+        executor = self.executor or self.start_executor()
+        if self._pending is None:
+            self._pending = asyncio.Semaphore(self.max_pending)
+        async with self._pending:
+            return await asyncio.get_running_loop().run_in_executor(executor, fn, *args)
+
+    async def hash(self, password: str) -> str:
+        return await self.run(hash_password, password, *self.params)
+
+    async def verify(self, password: str, stored: Optional[str]) -> bool:
+        # Unknown users still pay for one hash so response times do not
+        # reveal which usernames exist.
+        if stored is None:
+            if self._dummy is None:
+                self._dummy = await self.hash("")
+            await self.run(check_password, password, self._dummy)
+            return False
+        return await self.run(check_password, password, stored)
+
+    def needs_rehash(self, stored: str) -> bool:
+        return needs_rehash(stored, *self.params)
+
+    def shutdown(self) -> None:
+        if self.executor is not None:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+            self.executor = None
+
+
+def build_hasher(settings: Settings) -> PasswordHasher:
+    return PasswordHasher(settings.password_pool, settings.password_workers,
+                          settings.password_max_pending, scrypt_params(settings))
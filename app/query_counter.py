@@ -0,0 +1,33 @@
+from typing import List
+
+from sqlalchemy import event
+
+
+class QueryCounter:
+    """Counts the SQL statements sent through one or more engines.
+
+        with QueryCounter(engine, async_engine) as queries:
+            client.get("/shanyraks/1")
+        assert queries.count <= 2, queries.statements
+    """
+
+    def __init__(self, *engines):
+        # AsyncEngine only exposes cursor events on its sync_engine.
+        self.engines = [getattr(engine, "sync_engine", engine) for engine in engines]
+        self.statements: List[str] = []
+
+    def record(self, conn, cursor, statement, parameters, context, executemany):
+        self.statements.append(statement)
+
+    @property
+    def count(self) -> int:
+        return len(self.statements)
+
+    def __enter__(self) -> "QueryCounter":
+        for engine in self.engines:
+            event.listen(engine, "before_cursor_execute", self.record)
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        for engine in self.engines:
+            event.remove(engine, "before_cursor_execute", self.record)
@@ -0,0 +1,236 @@
+import asyncio
+import math
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from fastapi import HTTPException, Request
+from starlette.concurrency import run_in_threadpool
+from starlette.responses import JSONResponse
+
+from config import Settings
+from metrics import Counter, registry
+
+rejected_requests = registry.register(Counter(
+    "http_requests_rejected_total", "Requests turned away by rate limits or write admission.", ("limit", "reason")))
+
+WRITE_METHODS = frozenset(("POST", "PUT", "PATCH", "DELETE"))
+
+
+class Limit:
+    """``count`` requests per ``seconds``, refilled evenly: "20/60" allows a
+    burst of 20, then one more every 3 seconds."""
+
+    def __init__(self, count: int, seconds: float):
+        if count < 1 or seconds <= 0:
+            raise ValueError("a limit needs a positive count and window")
+        self.count = count
+        self.seconds = seconds
+        self.interval = seconds / count
+
+    @classmethod
+    def parse(cls, spec: str) -> "Limit":
+        count, _, seconds = spec.partition("/")
+        return cls(int(count), float(seconds or 1))
+
+
+def gcra(tat: Optional[float], now: float, limit: Limit, cost: int = 1) -> Tuple[Optional[float], float]:
+    """One token-bucket step in GCRA form, keeping a single timestamp per key.
+
+    ``tat`` is when the bucket would be full again. Returns the new ``tat``
+    and 0 when the request's ``cost`` tokens are available, or None and the
+    seconds until they would be.
+    """
+    tat = max(tat or now, now)
+    new_tat = tat + cost * limit.interval
+    allow_at = new_tat - limit.count * limit.interval
+    if now < allow_at:
+        return None, allow_at - now
+    return new_tat, 0.0
+
+
+class RateLimiter:
+    # True when acquire does network I/O and must stay off the event loop.
+    blocking = False
+
+    def acquire(self, key: str, limit: Limit, cost: int = 1) -> float:
+        """Take ``cost`` tokens from ``key``'s bucket; seconds to wait, 0 if allowed."""
+        return 0.0
+
+
+class MemoryRateLimiter(RateLimiter):
+    """Buckets in this process. With several workers each has its own, so
+    the effective limit is multiplied by the worker count."""
+
+    def __init__(self, maxsize: int = 100000):
+        self.maxsize = maxsize
+        self.buckets: "OrderedDict[str, float]" = OrderedDict()
+        self.lock = threading.Lock()
+
+    def acquire(self, key: str, limit: Limit, cost: int = 1) -> float:
+        now = time.monotonic()
+        with self.lock:
+            tat, wait = gcra(self.buckets.get(key), now, limit, cost)
+            if tat is not None:
+                self.buckets[key] = tat
+                self.buckets.move_to_end(key)
+                # The least recently charged bucket is usually full again,
+                # so forgetting it changes nothing.
+                if len(self.buckets) > self.maxsize:
+                    self.buckets.popitem(last=False)
+        return wait
+
+
+# KEYS[1] bucket; ARGV now, interval, count, cost. Floats travel as strings
+# because Redis truncates Lua numbers to integers on return.
+GCRA_SCRIPT = """
+local now = tonumber(ARGV[1])
+local interval = tonumber(ARGV[2])
+local tat = math.max(tonumber(redis.call('GET', KEYS[1]) or ARGV[1]), now)
+local new_tat = tat + tonumber(ARGV[4]) * interval
+local allow_at = new_tat - tonumber(ARGV[3]) * interval
+if now < allow_at then
+    return tostring(allow_at - now)
+end
+redis.call('SET', KEYS[1], tostring(new_tat), 'PX', math.ceil((new_tat - now) * 1000))
+return '0'
+"""
+
+
+class SharedRateLimiter(RateLimiter):
+    """Buckets in a shared store, so every worker draws from the same one.
+
+    ``client`` needs redis-py's ``register_script``; the script updates a
+    bucket atomically with the same steps as ``gcra``. Times are wall-clock,
+    which workers on different hosts agree on closely enough for limits
+    measured in seconds.
+    """
+
+    blocking = True
+
+    def __init__(self, client: Any, prefix: str = "ratelimit:"):
+        self.script = client.register_script(GCRA_SCRIPT)
+        self.prefix = prefix
+
+    def acquire(self, key: str, limit: Limit, cost: int = 1) -> float:
+        wait = self.script(keys=[self.prefix + key],
+                           args=[repr(time.time()), repr(limit.interval), limit.count, cost])
+        return float(wait)
+
+
+def build_rate_limiter(settings: Settings, client: Optional[Any] = None) -> RateLimiter:
+    if settings.rate_limit_backend == "memory":
+        return MemoryRateLimiter(settings.rate_limit_maxsize)
+    if settings.rate_limit_backend == "redis":
+        if client is None:
+            import redis
+
+            client = redis.Redis.from_url(settings.redis_url)
+        return SharedRateLimiter(client)
+    return RateLimiter()
+
+
+def retry_after(seconds: float) -> str:
+    return str(max(1, math.ceil(seconds)))
+
+
+def client_key(request: Request) -> str:
+    """The signed-in user when the request carries a valid token, else the client address."""
+    scheme, _, token = request.headers.get("authorization", "").partition(" ")
+    if scheme.lower() == "bearer" and token:
+        try:
+            return "user:%d" % request.app.state.tokens.verify(token).id
+        except HTTPException:
+            pass
+    return "ip:%s" % (request.client.host if request.client else "unknown")
+
+
+def build_rate_limits(settings: Settings, limiter: RateLimiter) -> Dict[str, Tuple[RateLimiter, Limit]]:
+    return {
+        "signup": (limiter, Limit.parse(settings.rate_limit_signup)),
+        "announcements": (limiter, Limit.parse(settings.rate_limit_announcements)),
+        "comments": (limiter, Limit.parse(settings.rate_limit_comments)),
+        "bulk": (limiter, Limit.parse(settings.rate_limit_bulk_rows)),
+    }
+
+
+async def take_tokens(request: Request, name: str, cost: int = 1) -> float:
+    """Charge ``cost`` tokens to the caller's bucket for ``name``; seconds to wait, 0 if allowed."""
+    limiter, limit = request.app.state.rate_limits[name]
+    key = "%s:%s" % (name, client_key(request))
+    if limiter.blocking:
+        wait = await run_in_threadpool(limiter.acquire, key, limit, cost)
+    else:
+        wait = limiter.acquire(key, limit, cost)
+    if wait > 0:
+        rejected_requests.inc(name, "rate_limit")
+    return wait
+
+
+def rate_limited(name: str) -> Callable:
+    """Route dependency charging one token per request to the caller's bucket for ``name``.
+
+        @router.post("/x", dependencies=[Depends(rate_limited("x"))])
+
+    The limiter and limit are looked up in ``app.state.rate_limits`` when
+    the request comes in, so routes can be declared before the app exists.
+    """
+
+    async def check_rate_limit(request: Request) -> None:
+        wait = await take_tokens(request, name)
+        if wait > 0:
+            raise HTTPException(status_code=429, detail="Too many requests",
+                                headers={"Retry-After": retry_after(wait)})
+
+    return check_rate_limit
+
+
+class AdmissionMiddleware:
+    """Caps how many write requests run at once.
+
+    Up to ``limit`` run; up to ``queue`` more wait at most ``timeout``
+    seconds for a slot. Anything beyond that gets 503 with Retry-After
+    straight away, before its body is read, instead of piling up in front
+    of the single SQLite writer and the threadpool.
+    """
+
+    def __init__(self, app, limit: int, queue: int, timeout: float, methods=WRITE_METHODS):
+        self.app = app
+        self.limit = limit
+        self.queue = queue
+        self.timeout = timeout
+        self.methods = methods
+        self.slots = asyncio.Semaphore(limit)
+        self.waiting = 0
+
+    async def __call__(self, scope, receive, send) -> None:
+        if scope["type"] != "http" or scope["method"] not in self.methods:
+            await self.app(scope, receive, send)
+            return
+
+        if self.slots.locked():
+            if self.waiting >= self.queue:
+                await self.reject("queue_full", scope, receive, send)
+                return
+            self.waiting += 1
+            try:
+                await asyncio.wait_for(self.slots.acquire(), self.timeout)
+            except asyncio.TimeoutError:
+                await self.reject("queue_timeout", scope, receive, send)
+                return
+            finally:
+                self.waiting -= 1
+        else:
+            await self.slots.acquire()
+
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self.slots.release()
+
+    async def reject(self, reason: str, scope, receive, send) -> None:
+        rejected_requests.inc("writes", reason)
+        response = JSONResponse({"detail": "Server busy, retry later"}, status_code=503,
+                                headers={"Retry-After": retry_after(self.timeout)})
+        await response(scope, receive, send)
@@ -0,0 +1,193 @@
+import asyncio
+import itertools
+import logging
+import os
+import time
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, List, Optional
+
+from sqlalchemy import text
+from sqlalchemy.engine import make_url
+from sqlalchemy.exc import InterfaceError, OperationalError
+from sqlalchemy.orm import Session
+
+from config import Settings
+from database import Database, DbSession, is_sqlite, run_sync
+
+logger = logging.getLogger(__name__)
+
+# Errors that mean the replica itself is unusable (unreachable, gone,
+# missing tables) rather than that the query was wrong.
+REPLICA_ERRORS = (OperationalError, InterfaceError)
+
+POSTGRES_LAG = text("SELECT COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)")
+
+
+def on_replica(db: Session) -> bool:
+    """Whether ``db`` reads from a replica; what it returns may be behind the primary."""
+    return db.info.get("replica", False)
+
+
+def replica_urls(spec: str) -> List[str]:
+    """``DB_REPLICA_URLS`` is a comma-separated list of database URLs."""
+    return [url.strip() for url in spec.split(",") if url.strip()]
+
+
+def sqlite_file(url: str) -> Optional[str]:
+    path = make_url(url).database
+    if not path or path == ":memory:":
+        return None
+    return path[len("file:"):] if path.startswith("file:") else path
+
+
+def modified_at(path: str) -> float:
+    """Last write to a SQLite database, counting its WAL."""
+    return max((os.path.getmtime(name) for name in (path, path + "-wal") if os.path.exists(name)), default=0.0)
+
+
+class Replica:
+    def __init__(self, url: str, database: Database):
+        self.name = make_url(url).render_as_string(hide_password=True)
+        self.url = url
+        self.database = database
+        self.in_flight = 0
+        self.reads = 0
+        self.errors = 0
+        self.lag: Optional[float] = None
+        self.ejected_until = 0.0
+
+    def available(self, now: float, max_lag: float) -> bool:
+        return self.ejected_until <= now and (self.lag is None or self.lag <= max_lag)
+
+    def stats(self, now: float) -> dict:
+        return {
+            "name": self.name,
+            "in_flight": self.in_flight,
+            "reads": self.reads,
+            "errors": self.errors,
+            "lag": None if self.lag is None else round(self.lag, 3),
+            "ejected_for": round(max(self.ejected_until - now, 0), 1),
+        }
+
+
+class ReplicaSet:
+    """Read-only copies of the primary that GET endpoints read from.
+
+    ``pick`` balances over the replicas that are in rotation, by turns
+    ("round_robin") or by fewest reads in progress ("least_connections").
+    A replica leaves the rotation for ``eject_seconds`` when a read on it
+    fails with a connection-level error or its health check fails, and
+    stays out while the last check put it more than ``max_lag`` seconds
+    behind the primary. Checks run every ``check_interval`` seconds. When
+    none is in rotation reads go to the primary, so an empty set is a
+    plain pass-through.
+    """
+
+    def __init__(self, primary: Database, replicas: List[Replica], balance: str = "round_robin",
+                 max_lag: float = 5, eject_seconds: float = 10, check_interval: float = 2):
+        self.primary = primary
+        self.replicas = replicas
+        self.balance = balance
+        self.max_lag = max_lag
+        self.eject_seconds = eject_seconds
+        self.check_interval = check_interval
+        self.turns = itertools.count()
+        self.checker: Optional[asyncio.Task] = None
+        self.primary_reads = 0
+        self.ejections = 0
+
+    def pick(self) -> Optional[Replica]:
+        now = time.monotonic()
+        candidates = [replica for replica in self.replicas if replica.available(now, self.max_lag)]
+        if not candidates:
+            return None
+        # Rotate the start so least_connections spreads ties too.
+        start = next(self.turns) % len(candidates)
+        candidates = candidates[start:] + candidates[:start]
+        if self.balance == "least_connections":
+            return min(candidates, key=lambda replica: replica.in_flight)
+        return candidates[0]
+
+    def eject(self, replica: Replica, error: Exception) -> None:
+        replica.errors += 1
+        if replica.ejected_until <= time.monotonic():
+            self.ejections += 1
+            logger.warning("replica %s out of rotation for %ss: %r", replica.name, self.eject_seconds, error)
+        replica.ejected_until = time.monotonic() + self.eject_seconds
+
+    @asynccontextmanager
+    async def session(self) -> AsyncIterator[DbSession]:
+        replica = self.pick()
+        if replica is None:
+            self.primary_reads += 1
+            async with self.primary.session() as db:
+                yield db
+            return
+        replica.in_flight += 1
+        replica.reads += 1
+        try:
+            async with replica.database.session() as db:
+                db.info["replica"] = True
+                yield db
+        except REPLICA_ERRORS as exc:
+            self.eject(replica, exc)
+            raise
+        finally:
+            replica.in_flight -= 1
+
+    def measure_lag(self, db: Session, replica: Replica) -> Optional[float]:
+        """Seconds ``replica`` is behind the primary, None when the backend cannot tell.
+
+        Also reads alembic_version, so a replica without the schema fails the check.
+        """
+        db.execute(text("SELECT version_num FROM alembic_version")).all()
+        if db.get_bind().dialect.name == "postgresql":
+            return float(db.execute(POSTGRES_LAG).scalar_one())
+        primary_file = sqlite_file(self.primary.settings.database_url) if is_sqlite(replica.url) else None
+        if primary_file is None:
+            return None
+        # A copied file is as old as its last refresh; writes to the primary since then are missing.
+        return max(modified_at(primary_file) - modified_at(sqlite_file(replica.url)), 0.0)
+
+    async def check(self) -> None:
+        for replica in self.replicas:
+            try:
+                async with replica.database.session() as db:
+                    replica.lag = await run_sync(db, self.measure_lag, replica)
+            except Exception as exc:
+                self.eject(replica, exc)
+
+    async def check_periodically(self) -> None:
+        while True:
+            try:
+                await self.check()
+            except Exception:
+                logger.exception("replica check failed")
+            await asyncio.sleep(self.check_interval)
+
+    def start(self) -> None:
+        if self.replicas:
+            self.checker = asyncio.create_task(self.check_periodically())
+
+    async def stop(self) -> None:
+        if self.checker is not None:
+            self.checker.cancel()
+            await asyncio.gather(self.checker, return_exceptions=True)
+        for replica in self.replicas:
+            await replica.database.dispose()
+
+    def stats(self) -> dict:
+        now = time.monotonic()
+        return {
+            "balance": self.balance,
+            "primary_reads": self.primary_reads,
+            "ejections": self.ejections,
+            "replicas": [replica.stats(now) for replica in self.replicas],
+        }
+
+
+def build_replicas(settings: Settings, primary: Database) -> ReplicaSet:
+    replicas = [Replica(url, Database(settings.model_copy(update={"database_url": url})))
+                for url in replica_urls(settings.db_replica_urls)]
+    return ReplicaSet(primary, replicas, settings.db_replica_balance, settings.db_replica_max_lag,
+                      settings.db_replica_eject_seconds, settings.db_replica_check_interval)
@@ -1,17 +1,111 @@
-from typing import List
+import math
+import re
+from bisect import bisect_right
+from collections import Counter
+from datetime import datetime
+from importlib import import_module
+from typing import Dict, List, Optional, Tuple
 
-from models import User, UserUpdate, \
-    Announcement, AnnouncementUpdate, \
-    Comment, CommentUpdate
+from cache import Cache, NullCache, MISSING
+from counters import CounterBuffer
+from geocoding import Geocoder, NullGeocoder, Point, KM_PER_DEGREE, bounding_box, haversine_km
+from replicas import on_replica
+from similar import NullSimilarIndex, SimilarIndex, similar_row
+from tasks import InlineTasks
+from models import User, UserResponse, UserUpdate, \
+    Announcement, AnnouncementFacet, AnnouncementResponse, AnnouncementSearch, AnnouncementUpdate, \
+    Comment, CommentUpdate, Favorite
+from sqlalchemy import Row, Select, func, and_, or_, table, column, literal, literal_column, text, \
+    select, insert, update, delete, bindparam, tuple_, case
 from sqlalchemy.orm import Session
 from fastapi import HTTPException
 
 
+def user_key(id: int) -> str:
+    return "user:%d" % id
+
+
+def announcement_key(id: int) -> str:
+    return "announcement:%d" % id
+
+
+def comments_key(ads_id: int) -> str:
+    return "comments:%d" % ads_id
+
+
+def touch_announcement(db: Session, id: int, comments: int = 0) -> bool:
+    """Bump the version of an announcement, adjusting comment_count in the same UPDATE.
+
+    The counter is changed relative to the stored value, so concurrent
+    comment posts cannot overwrite each other. Returns False if there is
+    no such announcement.
+    """
+    values = {Announcement.version: Announcement.version + 1, Announcement.updated_at: func.now()}
+    if comments:
+        values[Announcement.comment_count] = func.coalesce(Announcement.comment_count, 0) + comments
+    return db.query(Announcement).filter(Announcement.id == id).update(values, synchronize_session=False) > 0
+
+
+# Lower bounds of the price buckets in announcement_facets; the last one is
+# open-ended. Changing them needs ``manage.py rebuild-facets``.
+PRICE_BUCKETS = [0, 50000, 100000, 150000, 200000, 300000, 500000, 1000000]
+
+
+def upsert_insert(dialect: str):
+    """The dialect's INSERT with ON CONFLICT support (sqlite and postgresql).
+
+    Imported on first use: the postgresql dialect alone is a noticeable
+    share of startup for a SQLite deployment.
+    """
+    return import_module("sqlalchemy.dialects." + dialect).insert
+
+FacetKey = Tuple[str, int, int]
+
+
+def price_bucket(price: int) -> int:
+    return PRICE_BUCKETS[max(bisect_right(PRICE_BUCKETS, price) - 1, 0)]
+
+
+def price_bucket_until(bucket: int) -> Optional[int]:
+    index = PRICE_BUCKETS.index(bucket)
+    return PRICE_BUCKETS[index + 1] - 1 if index + 1 < len(PRICE_BUCKETS) else None
+
+
+def facet_key(type: Optional[str], rooms_count: Optional[int], price: Optional[int]) -> Optional[FacetKey]:
+    # Rows missing any faceted value are left out of the summary.
+    if type is None or rooms_count is None or price is None:
+        return None
+    return type, rooms_count, price_bucket(price)
+
+
+def response_columns(model, response_model) -> list:
+    """Columns of ``model`` named like the fields of ``response_model``.
+
+    List endpoints select these instead of whole entities, so a page is
+    plain row tuples already shaped like the documented response.
+    """
+    return [getattr(model, name) for name in response_model.model_fields]
+
+
+ANNOUNCEMENT_COLUMNS = response_columns(Announcement, AnnouncementResponse)
+
+
+def comment_response(row) -> dict:
+    # Same shape as CommentResponse, built directly: a model per row cost
+    # more than the query on 100-comment pages.
+    return {"id": row.id,
+            "content": row.content,
+            "created_at": str(row.created_at),
+            "author_id": row.author_id}
+
+
 class UsersRepository:
+    def __init__(self, cache: Optional[Cache] = None):
+        self.cache = cache or NullCache()
+
     def save(self, db: Session, user: User) -> bool:
         db.add(user)
         db.commit()
-        db.refresh(user)
         return True
 
     def update(self, db: Session, user_id: int, upd_data: UserUpdate) -> bool:
@@ -25,32 +119,73 @@ class UsersRepository:
             user.city = upd_data.city
 
         db.commit()
-        db.refresh(user)
+        self.cache.delete(user_key(user_id))
         return True
 
+    def update_password(self, db: Session, user_id: int, password: str) -> None:
+        db.query(User).filter(User.id == user_id).update({User.password: password}, synchronize_session=False)
+        db.commit()
+
     def get_user_by_username(self, db: Session, username: str) -> User:
         return db.query(User).filter(User.username == username).first()
 
     def get_user_by_id(self, db:Session, id: int) -> User:
         return db.query(User).filter(User.id == id).first()
 
+    def get_user_response(self, db: Session, id: int) -> Optional[dict]:
+        key = user_key(id)
+        cached = self.cache.get(key)
+        if cached is not MISSING:
+            return cached
+
+        user = self.get_user_by_id(db, id)
+        if user is None:
+            return None
+        response = UserResponse.model_validate(user, from_attributes=True).model_dump()
+        if not on_replica(db):
+            self.cache.set(key, response)
+        return response
+
 
 
 class AnnouncementsRepository:
+    def __init__(self, cache: Optional[Cache] = None, geocoder: Optional[Geocoder] = None,
+                 tasks: Optional[InlineTasks] = None, similar: Optional[SimilarIndex] = None):
+        self.cache = cache or NullCache()
+        self.geocoder = geocoder or NullGeocoder()
+        self.similar = similar or NullSimilarIndex()
+        # Facet counts only feed the filter sidebar, so they may trail the
+        # write by a batch; with an inline runner they move in its transaction.
+        self.tasks = tasks or InlineTasks()
+        self.tasks.register("adjust_facets", self.apply_facet_tasks)
+
+    def locate(self, address: Optional[str]) -> Tuple[Optional[float], Optional[float]]:
+        return self.geocoder.geocode(address) or (None, None)
+
     def save(self, db: Session, ads: Announcement) -> bool:
+        if ads.latitude is None or ads.longitude is None:
+            ads.latitude, ads.longitude = self.locate(ads.address)
         db.add(ads)
+        self.defer_facets(db, {facet_key(ads.type, ads.rooms_count, ads.price): 1})
+        db.flush()
+        row = similar_row(ads)
         db.commit()
-        db.refresh(ads)
+        self.similar.upsert(row)
         return True
 
     def update(self, db: Session, id: int, upd_data: AnnouncementUpdate, user_id: int) -> bool:
         announcement = self.get_announcement_by_id(db, id)
 
         if user_id == announcement.user_id:
+            old_key = facet_key(announcement.type, announcement.rooms_count, announcement.price)
             if upd_data.type.lower() != "string" and upd_data.type is not None:
                 announcement.type = upd_data.type
             if upd_data.price != 0:
                 announcement.price = upd_data.price
+            if upd_data.latitude is not None and upd_data.longitude is not None:
+                announcement.latitude, announcement.longitude = upd_data.latitude, upd_data.longitude
+            elif upd_data.address.lower() != "string" and upd_data.address != announcement.address:
+                announcement.latitude, announcement.longitude = self.locate(upd_data.address)
             if upd_data.address.lower() != "string" and upd_data.address is not None:
                 announcement.address = upd_data.address
             if upd_data.area != 0:
@@ -59,63 +194,541 @@ class AnnouncementsRepository:
                 announcement.rooms_count = upd_data.rooms_count
             if upd_data.description.lower() != "string" and upd_data.description is not None:
                 announcement.description = upd_data.description
+            new_key = facet_key(announcement.type, announcement.rooms_count, announcement.price)
+            if new_key != old_key:
+                self.defer_facets(db, {old_key: -1, new_key: 1})
+            touch_announcement(db, id)
         else:
             raise HTTPException(status_code=403, detail="Forbidden")
 
+        row = similar_row(announcement)
         db.commit()
-        db.refresh(announcement)
+        self.cache.delete(announcement_key(id))
+        self.similar.upsert(row)
         return True
 
     def delete(self, db: Session, id: int, user_id: int):
         announcement = self.get_announcement_by_id(db, id)
 
         if user_id == announcement.user_id:
+            db.query(Favorite).filter(Favorite.announcement_id == id).delete(synchronize_session=False)
+            self.defer_facets(db, {facet_key(announcement.type, announcement.rooms_count, announcement.price): -1})
             db.delete(announcement)
         else:
             raise HTTPException(status_code=403, detail="Forbidden")
 
         db.commit()
+        self.cache.delete(announcement_key(id), comments_key(id))
+        self.similar.remove(id)
+
+    def insert_many(self, db: Session, rows: List[dict]) -> int:
+        for row in rows:
+            if row.get("latitude") is None or row.get("longitude") is None:
+                row["latitude"], row["longitude"] = self.locate(row["address"])
+        db.execute(insert(Announcement), rows)
+        self.defer_facets(db, Counter(facet_key(row["type"], row["rooms_count"], row["price"]) for row in rows))
+        db.commit()
+        return len(rows)
+
+    def export_statement(self, user_id: Optional[int] = None) -> Select:
+        statement = select(*(getattr(Announcement, name) for name in AnnouncementResponse.model_fields)) \
+            .order_by(Announcement.id)
+        if user_id is not None:
+            statement = statement.where(Announcement.user_id == user_id)
+        return statement
 
     def get_announcement_by_id(self, db: Session, id: int) -> Announcement:
         return db.query(Announcement).filter(Announcement.id == id).first()
 
-    def get_announcements(self, db: Session) -> List[Announcement]:
-        return db.query(Announcement).all()
+    def get_announcement_rows(self, db: Session, ids: List[int]) -> Dict[int, Row]:
+        if not ids:
+            return {}
+        rows = db.execute(select(*ANNOUNCEMENT_COLUMNS).where(Announcement.id.in_(set(ids)))).all()
+        return {row.id: row for row in rows}
+
+    def get_announcements_by_ids(self, db: Session, ids: List[int]) -> List[Announcement]:
+        if not ids:
+            return []
+        found = {announcement.id: announcement
+                 for announcement in db.query(Announcement).filter(Announcement.id.in_(set(ids))).all()}
+        return [found[id] for id in dict.fromkeys(ids) if id in found]
+
+    def get_announcement_version(self, db: Session, id: int) -> Optional[Tuple[int, Optional[datetime]]]:
+        row = db.query(Announcement.version, Announcement.updated_at).filter(Announcement.id == id).first()
+        return tuple(row) if row is not None else None
+
+    def get_announcement_response(self, db: Session, id: int, version: int) -> Optional[dict]:
+        """The response for ``id``, read through the cache.
+
+        ``version`` is the one the caller read (and built the ETag from)
+        before this call. Entries are stored under that version and only
+        hit for it, so a reader that loaded the row before a write and
+        fills the cache after the write's invalidation cannot serve the
+        old body to readers of the new version.
+        """
+        key = announcement_key(id)
+        cached = self.cache.get(key)
+        if cached is not MISSING and cached["version"] == version:
+            return cached["announcement"]
+
+        announcement = self.get_announcement_by_id(db, id)
+        if announcement is None:
+            return None
+        response = AnnouncementResponse.model_validate(announcement, from_attributes=True).model_dump()
+        # A replica may still hold the row from before the last write, while
+        # the cache is shared with primary reads; only the primary fills it.
+        if not on_replica(db):
+            self.cache.set(key, {"version": version, "announcement": response})
+        return response
+
+    def get_announcements_by_user(self, db: Session, user_id: int) -> List[Announcement]:
+        return db.query(Announcement).filter(Announcement.user_id == user_id).order_by(Announcement.id).all()
+
+    def search_filters(self, criteria: AnnouncementSearch) -> list:
+        filters = []
+        if criteria.type is not None:
+            filters.append(Announcement.type == criteria.type)
+        if criteria.rooms_count is not None:
+            filters.append(Announcement.rooms_count == criteria.rooms_count)
+        if criteria.price_from is not None:
+            filters.append(Announcement.price >= criteria.price_from)
+        if criteria.price_until is not None:
+            filters.append(Announcement.price <= criteria.price_until)
+        return filters
+
+    def search(self, db: Session, criteria: AnnouncementSearch, limit: int,
+               offset: int = 0, after_id: Optional[int] = None) -> List[Row]:
+        query = select(*ANNOUNCEMENT_COLUMNS).where(*self.search_filters(criteria)).order_by(Announcement.id)
+        if after_id is not None:
+            query = query.where(Announcement.id > after_id)
+        else:
+            query = query.offset(offset)
+        return db.execute(query.limit(limit)).all()
+
+    def text_search_query(self, query: str, operator: str = "AND") -> Optional[str]:
+        # Every word becomes a quoted term, so user input can never be parsed
+        # as FTS5 syntax. Long words lose their last two letters and are
+        # prefix-matched, a crude stemmer for Russian/Kazakh endings
+        # ("комнаты" and "комнатная" both match "комнат"*). Numbers match
+        # exactly; one-letter words are prepositions ("у", "в") and are noise.
+        terms = []
+        for word in re.findall(r"\w+", query.lower()):
+            if word.isdigit():
+                terms.append('"%s"' % word)
+            elif len(word) >= 6:
+                terms.append('"%s"*' % word[:-2])
+            elif len(word) > 1:
+                terms.append('"%s"*' % word)
+        if not terms:
+            return None
+        return (" %s " % operator).join(terms)
+
+    def text_search(self, db: Session, query: str, criteria: AnnouncementSearch,
+                    limit: int, offset: int = 0) -> List[Tuple[Announcement, float]]:
+        # All words must match first; only when no listing matches them all
+        # does the search widen to any word. Ranking every row that shares one
+        # common word ("квартира") is what makes OR queries slow. The choice
+        # depends on the query, not the page, so every page of a search uses
+        # the operator its first page did: an empty AND page past the first
+        # only falls back when AND matches nothing at all. That check ranks
+        # fewer than ``offset`` rows, the ones the earlier pages showed.
+        rows = self.ranked_text_search(db, query, "AND", criteria, limit, offset)
+        if rows or (offset > 0 and self.ranked_text_search(db, query, "AND", criteria, 1)):
+            return rows
+        return self.ranked_text_search(db, query, "OR", criteria, limit, offset)
+
+    def ranked_text_search(self, db: Session, query: str, operator: str, criteria: AnnouncementSearch,
+                           limit: int, offset: int = 0) -> List[Tuple[Announcement, float]]:
+        match = self.text_search_query(query, operator)
+        if match is None:
+            return []
+
+        filters = self.search_filters(criteria)
+        if db.get_bind().dialect.name != "sqlite":
+            combine = and_ if operator == "AND" else or_
+            matches = [or_(Announcement.address.ilike("%" + word + "%"),
+                           Announcement.description.ilike("%" + word + "%"))
+                       for word in re.findall(r"\w+", query.lower())]
+            rows = db.query(Announcement, literal(0.0)).filter(combine(*matches), *filters) \
+                .order_by(Announcement.id).offset(offset).limit(limit).all()
+            return [tuple(row) for row in rows]
+
+        fts = table("announcements_fts", column("rowid"))
+        # bm25() is lower-is-better; the address column weighs double since
+        # it carries the city and street.
+        rank = literal_column("bm25(announcements_fts, 2.0, 1.0)")
+        rows = db.query(Announcement, -rank) \
+            .join(fts, fts.c.rowid == Announcement.id) \
+            .filter(text("announcements_fts MATCH :match").bindparams(match=match), *filters) \
+            .order_by(rank) \
+            .offset(offset).limit(limit).all()
+        return [tuple(row) for row in rows]
+
+    def nearby_query(self, db: Session, center: Point, radius_km: float,
+                     box: Tuple[float, float, float, float], criteria: AnnouncementSearch):
+        lat, lon = center
+        circle = bounding_box(center, radius_km)
+        min_lat, max_lat = max(circle[0], box[0]), min(circle[1], box[1])
+        min_lon, max_lon = max(circle[2], box[2]), min(circle[3], box[3])
+        dy = (Announcement.latitude - lat) * KM_PER_DEGREE
+        dx = (Announcement.longitude - lon) * (KM_PER_DEGREE * math.cos(math.radians(lat)))
+        distance_sq = dy * dy + dx * dx
+
+        query = db.query(Announcement)
+        if db.get_bind().dialect.name == "sqlite":
+            rtree = table("announcements_rtree", column("id"), column("min_lat"), column("max_lat"),
+                          column("min_lon"), column("max_lon"))
+            # A rowid IN list keeps the R*Tree as the driving side, so the
+            # cost follows the ring rather than how many rows the filters hit.
+            query = query.filter(Announcement.id.in_(
+                select(rtree.c.id).where(rtree.c.max_lat >= min_lat, rtree.c.min_lat <= max_lat,
+                                         rtree.c.max_lon >= min_lon, rtree.c.min_lon <= max_lon)))
+            # The R*Tree stores 32-bit floats, so the exact box test stays,
+            # written so the planner does not pick the b-tree over it.
+            latitude, longitude = Announcement.latitude + 0, Announcement.longitude + 0
+        else:
+            latitude, longitude = Announcement.latitude, Announcement.longitude
+        return query.filter(latitude.between(min_lat, max_lat), longitude.between(min_lon, max_lon),
+                            distance_sq <= radius_km * radius_km, *self.search_filters(criteria)) \
+            .order_by(distance_sq, Announcement.id)
+
+    def nearby(self, db: Session, center: Point, criteria: AnnouncementSearch, limit: int,
+               radius_km: Optional[float] = None,
+               box: Optional[Tuple[float, float, float, float]] = None) -> List[Tuple[Announcement, float]]:
+        """Announcements within ``radius_km`` of ``center`` and/or inside ``box``, nearest first.
+
+        Searches outward: a circle a sixteenth of the full size first, four
+        times wider on each retry. Once it holds ``limit`` matches nothing
+        outside can be nearer, so dense areas read a few hundred candidates
+        instead of everything in range. Ordering and the radius test use an
+        equirectangular distance, exact to well under 0.1% at city scale;
+        returned distances are great-circle kilometres.
+        """
+        if box is None:
+            box = bounding_box(center, radius_km)
+        if radius_km is None:
+            corners = [(lat, lon) for lat in box[:2] for lon in box[2:]]
+            radius_km = max(haversine_km(center, corner) for corner in corners) * 1.01
+
+        step = radius_km / 16
+        while True:
+            step = min(step, radius_km)
+            rows = self.nearby_query(db, center, step, box, criteria).limit(limit).all()
+            if len(rows) >= limit or step >= radius_km:
+                break
+            step *= 4
+        return [(row, haversine_km(center, (row.latitude, row.longitude))) for row in rows]
+
+    def geocode_missing(self, db: Session, batch: int = 1000) -> int:
+        """Fill coordinates for announcements saved before geocoding existed."""
+        located = 0
+        after_id = 0
+        while True:
+            rows = db.query(Announcement.id, Announcement.address) \
+                .filter(Announcement.id > after_id, Announcement.latitude.is_(None)) \
+                .order_by(Announcement.id).limit(batch).all()
+            if not rows:
+                return located
+            after_id = rows[-1].id
+            points = [(row.id, self.geocoder.geocode(row.address)) for row in rows]
+            updates = [{"ads_id": id, "latitude": point[0], "longitude": point[1]} for id, point in points if point]
+            if updates:
+                table = Announcement.__table__
+                db.execute(update(table).where(table.c.id == bindparam("ads_id"))
+                           .values(latitude=bindparam("latitude"), longitude=bindparam("longitude")), updates)
+                db.commit()
+                located += len(updates)
+
+    def apply_counter_deltas(self, db: Session, deltas: Dict[str, Dict[int, int]]) -> int:
+        """Add buffered deltas to counter columns, one executemany per counter.
+
+        The counts are part of the cached, ETag-validated response, so every
+        touched row also gets a new version and its cache entry is dropped.
+        """
+        table = Announcement.__table__
+        rows = 0
+        touched = set()
+        for field, changes in deltas.items():
+            statement = update(table).where(table.c.id == bindparam("ads_id")) \
+                .values({field: table.c[field] + bindparam("delta"), table.c.version: table.c.version + 1})
+            db.execute(statement, [{"ads_id": id, "delta": delta} for id, delta in changes.items()])
+            rows += len(changes)
+            touched.update(changes)
+        db.commit()
+        self.cache.delete(*[announcement_key(id) for id in touched])
+        return rows
+
+    def reconcile_counters(self, db: Session) -> int:
+        """Recompute comment_count and favorites_count from their source tables.
+
+        Only rows that drifted are written (and get a new version, so cached
+        responses and ETags move on). view_count has no source table and is
+        left as is. Returns the number of rows corrected.
+        """
+        comments = select(func.count(Comment.id)).where(Comment.ads_id == Announcement.id).scalar_subquery()
+        favorites = select(func.count()).select_from(Favorite) \
+            .where(Favorite.announcement_id == Announcement.id).scalar_subquery()
+        statement = update(Announcement) \
+            .where(or_(func.coalesce(Announcement.comment_count, -1) != comments,
+                       Announcement.favorites_count != favorites)) \
+            .values(comment_count=comments, favorites_count=favorites, version=Announcement.version + 1) \
+            .execution_options(synchronize_session=False)
+        rows = db.execute(statement).rowcount
+        db.commit()
+        return rows
+
+    def adjust_facets(self, db: Session, deltas: Dict[Optional[FacetKey], int]) -> None:
+        """Add deltas to announcement_facets in the caller's transaction."""
+        rows = [{"type": key[0], "rooms_count": key[1], "price_bucket": key[2], "count": delta}
+                for key, delta in deltas.items() if key is not None and delta]
+        if not rows:
+            return
+        table = AnnouncementFacet.__table__
+        statement = upsert_insert(db.get_bind().dialect.name)(table)
+        statement = statement.on_conflict_do_update(
+            index_elements=[table.c.type, table.c.rooms_count, table.c.price_bucket],
+            set_={"count": table.c["count"] + statement.excluded["count"]},
+        )
+        db.execute(statement, rows)
+
+    def defer_facets(self, db: Session, deltas: Dict[Optional[FacetKey], int]) -> None:
+        deltas = [[*key, delta] for key, delta in deltas.items() if key is not None and delta]
+        if deltas:
+            self.tasks.defer(db, "adjust_facets", deltas)
+
+    def apply_facet_tasks(self, db: Session, payloads: List[list]) -> None:
+        """Task handler: sum a batch of deferred facet deltas into one upsert."""
+        deltas = Counter()
+        for payload in payloads:
+            for type, rooms_count, bucket, delta in payload:
+                deltas[(type, rooms_count, bucket)] += delta
+        self.adjust_facets(db, deltas)
+
+    def rebuild_facets(self, db: Session) -> int:
+        bucket = case(*((Announcement.price >= bound, bound) for bound in reversed(PRICE_BUCKETS[1:])), else_=0)
+        groups = select(Announcement.type, Announcement.rooms_count, bucket, func.count()) \
+            .where(Announcement.type.is_not(None), Announcement.rooms_count.is_not(None),
+                   Announcement.price.is_not(None)) \
+            .group_by(Announcement.type, Announcement.rooms_count, bucket)
+        db.execute(delete(AnnouncementFacet))
+        rows = db.execute(insert(AnnouncementFacet).from_select(
+            ["type", "rooms_count", "price_bucket", "count"], groups)).rowcount
+        db.commit()
+        return rows
+
+    def get_facets(self, db: Session, criteria: AnnouncementSearch) -> dict:
+        """Counts per type, rooms_count and price bucket under ``criteria``.
+
+        Each facet applies every filter except its own, so the numbers next
+        to a filter say how many results picking that value would give.
+        Buckets fully inside the price range are summed from the summary
+        table; the (at most two) buckets a price bound cuts through are
+        counted exactly from announcements over the price index.
+        """
+        summary = db.query(AnnouncementFacet.type, AnnouncementFacet.rooms_count,
+                           AnnouncementFacet.price_bucket, AnnouncementFacet.count) \
+            .filter(AnnouncementFacet.count > 0).all()
+        low, high = criteria.price_from, criteria.price_until
+
+        in_price = []
+        partial = set()
+        for type, rooms_count, bucket, count in summary:
+            until = price_bucket_until(bucket)
+            if (high is not None and bucket > high) or (low is not None and until is not None and until < low):
+                continue
+            if (low is not None and bucket < low) or (high is not None and (until is None or until > high)):
+                partial.add(bucket)
+                continue
+            in_price.append((type, rooms_count, count))
+
+        if partial:
+            ranges = [and_(Announcement.price >= bucket, Announcement.price <= price_bucket_until(bucket))
+                      if price_bucket_until(bucket) is not None else Announcement.price >= bucket
+                      for bucket in sorted(partial)]
+            price_filter = AnnouncementSearch(price_from=low, price_until=high)
+            in_price.extend(db.query(Announcement.type, Announcement.rooms_count, func.count())
+                            .filter(or_(*ranges), *self.search_filters(price_filter))
+                            .filter(Announcement.type.is_not(None), Announcement.rooms_count.is_not(None))
+                            .group_by(Announcement.type, Announcement.rooms_count).all())
+
+        def matches_type(type):
+            return criteria.type is None or type == criteria.type
+
+        def matches_rooms(rooms_count):
+            return criteria.rooms_count is None or rooms_count == criteria.rooms_count
+
+        types, rooms, prices = Counter(), Counter(), Counter()
+        for type, rooms_count, count in in_price:
+            if matches_rooms(rooms_count):
+                types[type] += count
+            if matches_type(type):
+                rooms[rooms_count] += count
+        for type, rooms_count, bucket, count in summary:
+            if matches_type(type) and matches_rooms(rooms_count):
+                prices[bucket] += count
+
+        return {
+            "total": sum(count for type, rooms_count, count in in_price
+                         if matches_type(type) and matches_rooms(rooms_count)),
+            "type": dict(sorted(types.items())),
+            "rooms_count": dict(sorted(rooms.items())),
+            "price": [{"price_from": bucket, "price_until": price_bucket_until(bucket), "count": prices[bucket]}
+                      for bucket in PRICE_BUCKETS],
+        }
+
+    def rebuild_text_index(self, db: Session) -> None:
+        db.execute(text("INSERT INTO announcements_fts(announcements_fts) VALUES ('rebuild')"))
+        db.commit()
+
+    def count(self, db: Session, criteria: AnnouncementSearch, cap: Optional[int] = None) -> int:
+        filters = self.search_filters(criteria)
+        if cap is None:
+            return db.query(func.count(Announcement.id)).filter(*filters).scalar()
+        capped = db.query(Announcement.id).filter(*filters).limit(cap).subquery()
+        return db.query(func.count()).select_from(capped).scalar()
 
 
 class CommentsRepository:
-    def save(self, db: Session, comment: Comment) -> bool:
+    def __init__(self, cache: Optional[Cache] = None):
+        self.cache = cache or NullCache()
+
+    def save(self, db: Session, comment: Comment) -> dict:
+        ads_id = comment.ads_id
+        if not touch_announcement(db, ads_id, comments=1):
+            db.rollback()
+            raise HTTPException(status_code=404, detail="Announcement not found")
         db.add(comment)
+        db.flush()
+        response = comment_response(comment)
         db.commit()
-        db.refresh(comment)
-        return True
+        self.cache.delete(comments_key(ads_id), announcement_key(ads_id))
+        return response
+
+    def comments_statement(self, ads_id: int, after: Optional[Tuple[datetime, int]] = None,
+                           limit: Optional[int] = None) -> Select:
+        statement = select(Comment.id, Comment.content, Comment.created_at, Comment.author_id) \
+            .where(Comment.ads_id == ads_id) \
+            .order_by(Comment.created_at, Comment.id)
+        if after is not None:
+            created_at = bindparam("after_created_at", after[0], type_=Comment.created_at.type)
+            statement = statement.where(tuple_(Comment.created_at, Comment.id) > tuple_(created_at, after[1]))
+        if limit is not None:
+            statement = statement.limit(limit)
+        return statement
+
+    def get_comments_by_ads_id(self, db: Session, ads_id: int, after: Optional[Tuple[datetime, int]] = None,
+                               limit: Optional[int] = None) -> List[Row]:
+        return db.execute(self.comments_statement(ads_id, after, limit)).all()
+
+    def get_comments_after_id(self, db: Session, ads_id: int, after_id: int, limit: int) -> List[Row]:
+        statement = select(Comment.id, Comment.content, Comment.created_at, Comment.author_id) \
+            .where(Comment.ads_id == ads_id, Comment.id > after_id) \
+            .order_by(Comment.id) \
+            .limit(limit)
+        return db.execute(statement).all()
 
-    def get_comments_by_ads(self, ads: Announcement) -> List[Comment]:
-        return ads.comment
+    def get_comment_responses(self, db: Session, ads_id: int, limit: int,
+                              after: Optional[Tuple[datetime, int]] = None,
+                              version: Optional[int] = None) -> List[dict]:
+        # Only the first page is cached: it is what polling clients fetch.
+        # Like announcements it is kept under the announcement version read
+        # before the comments, and only hit for that version.
+        key = comments_key(ads_id)
+        if after is None and version is not None:
+            cached = self.cache.get(key)
+            if cached is not MISSING and cached["limit"] == limit and cached["version"] == version:
+                return cached["comments"]
+
+        responses = [comment_response(row) for row in self.get_comments_by_ads_id(db, ads_id, after, limit)]
+        if after is None and version is not None and not on_replica(db):
+            self.cache.set(key, {"limit": limit, "version": version, "comments": responses})
+        return responses
 
     def get_comment_by_id_and_ads_id(self, db:Session, id: int, ads_id: int) -> Comment:
-        return db.query(Comment).filter(Comment.id == id).first()
+        """The comment, if it belongs to announcement ``ads_id``; 404 otherwise."""
+        comment = db.query(Comment).filter(Comment.id == id, Comment.ads_id == ads_id).first()
+        if comment is None:
+            raise HTTPException(status_code=404, detail="Comment not found")
+        return comment
 
-    def update(self, db: Session, comment_id: int, ads_id: int, user_id: int, upd_data: CommentUpdate) -> bool:
+    def update(self, db: Session, comment_id: int, ads_id: int, user_id: int, upd_data: CommentUpdate) -> dict:
         comment = self.get_comment_by_id_and_ads_id(db, comment_id, ads_id)
 
         if user_id == comment.author_id:
             if upd_data.content.lower() != "string" and upd_data.content is not None:
                 comment.content = upd_data.content
+            touch_announcement(db, comment.ads_id)
         else:
             raise HTTPException(status_code=403, detail="Forbidden")
 
+        ads_id = comment.ads_id
+        response = comment_response(comment)
         db.commit()
-        db.refresh(comment)
-        return True
+        self.cache.delete(comments_key(ads_id))
+        return response
 
     def delete(self, db: Session, comment_id: int, ads_id: int, user_id: int) -> bool:
         comment = self.get_comment_by_id_and_ads_id(db, comment_id, ads_id)
 
         if user_id == comment.author_id:
             db.delete(comment)
+            touch_announcement(db, comment.ads_id, comments=-1)
         else:
             raise HTTPException(status_code=403, detail="Forbidden")
 
+        ads_id = comment.ads_id
+        db.commit()
+        self.cache.delete(comments_key(ads_id), announcement_key(ads_id))
+        return True
+
+
+class FavoritesRepository:
+    def __init__(self, counters: Optional[CounterBuffer] = None):
+        self.counters = counters
+
+    def track(self, ids: List[int], delta: int) -> None:
+        if self.counters is not None:
+            for id in ids:
+                self.counters.incr("favorites_count", id, delta)
+
+    def add(self, db: Session, user_id: int, ids: List[int]) -> List[int]:
+        """Add announcements to the user's favorites in one INSERT ... SELECT.
+
+        Ids that are already favorites or do not exist are skipped; returns
+        the ids actually added. Duplicates are left to ON CONFLICT DO NOTHING
+        on the primary key, so two requests adding the same id at once both
+        succeed instead of one failing on the unique constraint.
+        """
+        ids = set(ids)
+        if not ids:
+            return []
+        rows = select(literal(user_id), Announcement.id).where(Announcement.id.in_(ids))
+        statement = upsert_insert(db.get_bind().dialect.name)(Favorite) \
+            .from_select([Favorite.user_id, Favorite.announcement_id], rows) \
+            .on_conflict_do_nothing(index_elements=[Favorite.user_id, Favorite.announcement_id]) \
+            .returning(Favorite.announcement_id)
+        added = db.execute(statement).scalars().all()
         db.commit()
-        return True
\ No newline at end of file
+        self.track(added, 1)
+        return added
+
+    def remove(self, db: Session, user_id: int, ids: List[int]) -> List[int]:
+        ids = set(ids)
+        if not ids:
+            return []
+        statement = delete(Favorite).where(Favorite.user_id == user_id, Favorite.announcement_id.in_(ids)) \
+            .returning(Favorite.announcement_id)
+        removed = db.execute(statement).scalars().all()
+        db.commit()
+        self.track(removed, -1)
+        return removed
+
+    def get_favorite_announcements(self, db: Session, user_id: int, limit: int,
+                                   after_id: Optional[int] = None) -> List[Row]:
+        query = select(*ANNOUNCEMENT_COLUMNS) \
+            .join(Favorite, Favorite.announcement_id == Announcement.id) \
+            .where(Favorite.user_id == user_id) \
+            .order_by(Favorite.announcement_id)
+        if after_id is not None:
+            query = query.where(Favorite.announcement_id > after_id)
+        return db.execute(query.limit(limit)).all()
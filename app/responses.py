@@ -0,0 +1,35 @@
+import json
+from datetime import date, datetime
+from typing import Any
+
+from starlette.responses import JSONResponse
+
+try:
+    import orjson
+except ImportError:  # optional: the stdlib encoder gives the same output, slower
+    orjson = None
+
+
+def default(value: Any) -> Any:
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    raise TypeError("%s is not JSON serializable" % type(value).__name__)
+
+
+def dumps(content: Any) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(content)
+    return json.dumps(content, ensure_ascii=False, separators=(",", ":"), default=default).encode()
+
+
+class FastJSONResponse(JSONResponse):
+    """JSON response for content that is already plain dicts and lists.
+
+    Returning one from a handler skips FastAPI's response_model validation
+    and jsonable_encoder walk; the route's response_model still documents
+    the shape. Keep it for handlers that build their rows from
+    ``response_columns`` so what is sent matches what is documented.
+    """
+
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
@@ -0,0 +1,395 @@
+import logging
+import math
+import re
+import threading
+import time
+import zlib
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from config import Settings
+from models import Announcement
+
+logger = logging.getLogger(__name__)
+
+# Numeric features, each scaled to zero mean and unit variance over the
+# listings at the last rebuild. Prices and areas are compared on a log
+# scale: 10% dearer counts the same for a studio and for a house.
+NUMERIC = ("price", "area", "rooms_count", "latitude", "longitude")
+LOG_SCALED = ("price", "area")
+
+# Relative weight of each feature in the distance. ``type`` is one-hot,
+# ``text`` the unit-length hashed word counts of the description.
+WEIGHTS = {"price": 1.0, "area": 1.0, "rooms_count": 1.0, "latitude": 1.0, "longitude": 1.0,
+           "type": 1.5, "text": 1.0}
+
+
+class SimilarRow(NamedTuple):
+    id: int
+    type: Optional[str]
+    price: Optional[int]
+    area: Optional[float]
+    rooms_count: Optional[int]
+    latitude: Optional[float]
+    longitude: Optional[float]
+    description: Optional[str]
+
+
+SIMILAR_COLUMNS = [getattr(Announcement, name) for name in SimilarRow._fields]
+
+
+def similar_row(announcement) -> SimilarRow:
+    """Snapshot of what the index reads from a listing (an ORM object or a row)."""
+    return SimilarRow(*(getattr(announcement, name) for name in SimilarRow._fields))
+
+
+def description_tokens(description: Optional[str]) -> List[str]:
+    # The text search's crude stemming: long words lose their last two letters.
+    words = re.findall(r"\w+", (description or "").lower())
+    return [word[:-2] if len(word) >= 6 else word for word in words if len(word) > 1]
+
+
+class Layout(NamedTuple):
+    """How rows become vectors; fixed between two rebuilds."""
+    means: object
+    stds: object
+    types: Dict[str, int]
+    text_features: int
+
+    @property
+    def width(self) -> int:
+        # One column per known type plus one for types first seen since the rebuild.
+        return len(NUMERIC) + len(self.types) + 1 + self.text_features
+
+
+class SimilarIndex:
+    """Finds listings close to a given one; this base finds nothing.
+
+    The repository tells the index about every listing it saves, updates
+    or deletes, after the commit; rows written around the repository (bulk
+    imports, other workers) show up at the next ``rebuild``.
+    """
+
+    def start(self) -> None:
+        pass
+
+    def rebuild(self, db: Session) -> None:
+        pass
+
+    def upsert(self, row: SimilarRow) -> None:
+        pass
+
+    def remove(self, id: int) -> None:
+        pass
+
+    def similar_to(self, id: int, k: int) -> Optional[List[Tuple[int, float]]]:
+        """Up to ``k`` (id, distance) pairs nearest first, None when ``id`` is not indexed."""
+        return None
+
+    def nearest(self, row: SimilarRow, k: int) -> List[Tuple[int, float]]:
+        return []
+
+    def stats(self) -> dict:
+        return {"backend": type(self).__name__}
+
+
+class NullSimilarIndex(SimilarIndex):
+    pass
+
+
+class NumpySimilarIndex(SimilarIndex):
+    """All listings as rows of one float32 matrix, searched by brute force.
+
+    A query is one matrix-vector product over the weighted, normalised
+    features (squared distance = |x|^2 - 2x.y + |y|^2, with |x|^2 kept per
+    row) and an ``argpartition`` for the top k, so its cost grows linearly
+    with the listings but stays a few vectorised passes. Deleted rows keep
+    their slot, with an infinite norm, until it is reused. Listing ids are
+    autoincrement keys, so slots are found through an array indexed by id
+    rather than a dict, which at a million listings is twice the matrix.
+
+    ``rebuild`` reads every listing and recomputes the scaling; writes that
+    land while it runs are replayed on the new matrix before it is swapped
+    in. numpy is imported by ``start``, in the lifespan, so importing the
+    app does not load it.
+    """
+
+    def __init__(self, text_features: int = 0, weights: Dict[str, float] = WEIGHTS):
+        self.text_features = text_features
+        self.weights = weights
+        self.np = None
+        self.lock = threading.Lock()
+        self.layout: Optional[Layout] = None
+        self.vectors = None
+        self.norms = None
+        self.ids = None
+        self.slots = None
+        self.free: List[int] = []
+        self.size = 0
+        self.count = 0
+        # Writes seen while a rebuild reads the table; None when none runs.
+        self.pending: Optional[List[Tuple[str, object]]] = None
+        self.queries = 0
+        self.rebuilds = 0
+        self.rebuild_seconds: Optional[float] = None
+        self.built_at: Optional[float] = None
+
+    def start(self) -> None:
+        try:
+            import numpy
+        except ImportError:  # optional: without it the index stays empty
+            logger.warning("numpy is not installed (poetry install -E similar); similar listings are disabled")
+            return
+
+        self.np = numpy
+        layout = Layout(numpy.zeros(len(NUMERIC)), numpy.ones(len(NUMERIC)), {}, self.text_features)
+        empty = numpy.zeros((0, layout.width), dtype=numpy.float32)
+        self.install(layout, empty, numpy.zeros(0, dtype=numpy.int64))
+
+    def encode(self, rows: List[SimilarRow], columns: Dict[str, int]) -> tuple:
+        """What the vectors of ``rows`` are made of, before scaling.
+
+        Returns the numeric features, the types and the (row, column) cells
+        of description words, columns counted from the start of the text
+        features. ``columns`` memoises the hash of each word.
+        """
+        np = self.np
+        # None becomes NaN, and after scaling 0: an unknown value sits at the mean.
+        raw = np.array([[getattr(row, name) for name in NUMERIC] for row in rows], dtype=np.float64)
+        raw = raw.reshape(len(rows), len(NUMERIC))
+        for i, name in enumerate(NUMERIC):
+            if name in LOG_SCALED:
+                raw[:, i] = np.log1p(np.maximum(raw[:, i], 0))
+        lines, words = [], []
+        if self.text_features:
+            for i, row in enumerate(rows):
+                for token in description_tokens(row.description):
+                    column = columns.get(token)
+                    if column is None:
+                        column = columns[token] = zlib.crc32(token.encode()) % self.text_features
+                    lines.append(i)
+                    words.append(column)
+        cells = (np.array(lines, dtype=np.int64), np.array(words, dtype=np.int64))
+        return raw, [row.type for row in rows], cells
+
+    def make_layout(self, raw, types) -> Layout:
+        np = self.np
+        if len(raw):
+            means, stds = np.nanmean(raw, axis=0), np.nanstd(raw, axis=0)
+        else:
+            means, stds = np.zeros(len(NUMERIC)), np.ones(len(NUMERIC))
+        means = np.nan_to_num(means, nan=0.0)
+        stds = np.where(np.isnan(stds) | (stds == 0), 1.0, stds)
+        known = sorted(type for type in types if type is not None)
+        return Layout(means, stds, {type: i for i, type in enumerate(known)}, self.text_features)
+
+    def features(self, raw, type_columns, cells: tuple, layout: Layout):
+        """Weighted, scaled vectors; ``type_columns`` holds each row's one-hot column."""
+        np = self.np
+        n = len(raw)
+        vectors = np.zeros((n, layout.width), dtype=np.float32)
+        scaled = np.nan_to_num((raw - layout.means) / layout.stds, nan=0.0)
+        vectors[:, :len(NUMERIC)] = scaled * np.array([self.weights[name] for name in NUMERIC])
+
+        offset = len(NUMERIC)
+        vectors[np.arange(n), offset + type_columns] = self.weights["type"]
+
+        if layout.text_features:
+            offset += len(layout.types) + 1
+            text = vectors[:, offset:]
+            np.add.at(text, cells, 1.0)
+            lengths = np.linalg.norm(text, axis=1, keepdims=True)
+            text *= self.weights["text"] / np.where(lengths == 0, 1.0, lengths)
+        return vectors
+
+    def vector(self, row: SimilarRow):
+        raw, _, cells = self.encode([row], {})
+        column = self.layout.types.get(row.type, len(self.layout.types))
+        return self.features(raw, self.np.array([column]), cells, self.layout)[0]
+
+    def install(self, layout: Layout, vectors, ids) -> None:
+        """Swap in a freshly built matrix, with room to grow. Call with the lock held."""
+        np = self.np
+        n = len(ids)
+        capacity = n + max(n // 8, 1024)
+        self.layout = layout
+        self.vectors = np.zeros((capacity, layout.width), dtype=np.float32)
+        self.vectors[:n] = vectors
+        self.norms = np.full(capacity, np.inf, dtype=np.float32)
+        self.norms[:n] = np.einsum("ij,ij->i", vectors, vectors)
+        self.ids = np.zeros(capacity, dtype=np.int64)
+        self.ids[:n] = ids
+        top = int(ids.max()) + 1 if n else 0
+        self.slots = np.full(top + max(top // 8, 1024), -1, dtype=np.int64)
+        self.slots[ids] = np.arange(n)
+        self.free = []
+        self.size = n
+        self.count = n
+
+    def slot(self, id: int) -> Optional[int]:
+        if 0 <= id < len(self.slots):
+            position = int(self.slots[id])
+            if position >= 0:
+                return position
+        return None
+
+    def grow(self) -> None:
+        np = self.np
+        capacity = len(self.ids) * 2
+        vectors = np.zeros((capacity, self.layout.width), dtype=np.float32)
+        vectors[:self.size] = self.vectors[:self.size]
+        norms = np.full(capacity, np.inf, dtype=np.float32)
+        norms[:self.size] = self.norms[:self.size]
+        ids = np.zeros(capacity, dtype=np.int64)
+        ids[:self.size] = self.ids[:self.size]
+        self.vectors, self.norms, self.ids = vectors, norms, ids
+
+    def place(self, row: SimilarRow) -> None:
+        vector = self.vector(row)
+        position = self.slot(row.id)
+        if position is None:
+            if self.free:
+                position = self.free.pop()
+            else:
+                if self.size == len(self.ids):
+                    self.grow()
+                position = self.size
+                self.size += 1
+            if row.id >= len(self.slots):
+                slots = self.np.full(max(row.id + 1, len(self.slots) * 2), -1, dtype=self.np.int64)
+                slots[:len(self.slots)] = self.slots
+                self.slots = slots
+            self.slots[row.id] = position
+            self.count += 1
+        self.vectors[position] = vector
+        self.norms[position] = vector @ vector
+        self.ids[position] = row.id
+
+    def discard(self, id: int) -> None:
+        position = self.slot(id)
+        if position is not None:
+            self.slots[id] = -1
+            self.count -= 1
+            self.vectors[position] = 0
+            self.norms[position] = self.np.inf
+            self.ids[position] = 0
+            self.free.append(position)
+
+    def upsert(self, row: SimilarRow) -> None:
+        if self.np is None:
+            return
+        with self.lock:
+            if self.pending is not None:
+                self.pending.append(("upsert", row))
+            self.place(row)
+
+    def remove(self, id: int) -> None:
+        if self.np is None:
+            return
+        with self.lock:
+            if self.pending is not None:
+                self.pending.append(("remove", id))
+            self.discard(id)
+
+    def rebuild(self, db: Session) -> None:
+        if self.np is None:
+            return
+        started = time.perf_counter()
+        with self.lock:
+            self.pending = []
+        try:
+            np = self.np
+            raws, codes, lines, words, ids = [], [], [], [], []
+            # Types are numbered as first met, and renumbered once all are known.
+            columns, type_codes, read = {}, {}, 0
+            result = db.execute(select(*SIMILAR_COLUMNS).execution_options(yield_per=10000))
+            for partition in result.partitions():
+                rows = [SimilarRow(*row) for row in partition]
+                raw, types, (chunk_lines, chunk_words) = self.encode(rows, columns)
+                raws.append(raw)
+                codes.append(np.array([type_codes.setdefault(type, len(type_codes)) for type in types],
+                                      dtype=np.int64))
+                lines.append(chunk_lines + read)
+                words.append(chunk_words)
+                ids.append(np.array([row.id for row in rows], dtype=np.int64))
+                read += len(rows)
+            if not raws:
+                raws, ids = [np.zeros((0, len(NUMERIC)))], [np.zeros(0, dtype=np.int64)]
+                codes = lines = words = [np.zeros(0, dtype=np.int64)]
+            raw = np.concatenate(raws)
+            layout = self.make_layout(raw, type_codes)
+            renumber = np.array([layout.types.get(type, len(layout.types)) for type in type_codes] or [0],
+                                dtype=np.int64)
+            vectors = self.features(raw, renumber[np.concatenate(codes)],
+                                    (np.concatenate(lines), np.concatenate(words)), layout)
+            ids = np.concatenate(ids)
+            with self.lock:
+                self.install(layout, vectors, ids)
+                for operation, argument in self.pending:
+                    if operation == "upsert":
+                        self.place(argument)
+                    else:
+                        self.discard(argument)
+        finally:
+            with self.lock:
+                self.pending = None
+        self.rebuilds += 1
+        self.rebuild_seconds = time.perf_counter() - started
+        self.built_at = time.time()
+
+    def search(self, vector, k: int, exclude: Optional[int] = None) -> List[Tuple[int, float]]:
+        """Nearest rows to ``vector`` skipping position ``exclude``. Call with the lock held."""
+        np = self.np
+        self.queries += 1
+        n = self.size
+        if n == 0 or k <= 0:
+            return []
+        distances = self.norms[:n] - 2 * (self.vectors[:n] @ vector) + vector @ vector
+        if exclude is not None:
+            distances[exclude] = np.inf
+        k = min(k, n)
+        nearest = np.argpartition(distances, k - 1)[:k] if k < n else np.arange(n)
+        nearest = nearest[np.argsort(distances[nearest], kind="stable")]
+        return [(int(self.ids[i]), math.sqrt(max(float(distances[i]), 0.0)))
+                for i in nearest if distances[i] != np.inf]
+
+    def similar_to(self, id: int, k: int) -> Optional[List[Tuple[int, float]]]:
+        if self.np is None:
+            return None
+        with self.lock:
+            position = self.slot(id)
+            if position is None:
+                return None
+            return self.search(self.vectors[position].copy(), k, exclude=position)
+
+    def nearest(self, row: SimilarRow, k: int) -> List[Tuple[int, float]]:
+        if self.np is None:
+            return []
+        with self.lock:
+            vector = self.vector(row)
+            return [(id, distance) for id, distance in self.search(vector, k + 1) if id != row.id][:k]
+
+    def stats(self) -> dict:
+        stats = super().stats()
+        if self.np is None:
+            return stats
+        stats.update(
+            rows=self.count,
+            capacity=len(self.ids),
+            dimensions=self.layout.width,
+            text_features=self.text_features,
+            bytes=self.vectors.nbytes + self.norms.nbytes + self.ids.nbytes + self.slots.nbytes,
+            queries=self.queries,
+            rebuilds=self.rebuilds,
+            rebuild_seconds=None if self.rebuild_seconds is None else round(self.rebuild_seconds, 3),
+            age_seconds=None if self.built_at is None else round(time.time() - self.built_at, 1),
+        )
+        return stats
+
+
+def build_similar_index(settings: Settings) -> SimilarIndex:
+    if settings.similar_index == "numpy":
+        return NumpySimilarIndex(settings.similar_text_features)
+    return NullSimilarIndex()
@@ -0,0 +1,307 @@
+import asyncio
+import json
+import logging
+import time
+from collections import defaultdict
+from typing import Any, AsyncContextManager, Callable, Dict, List, Optional
+
+from sqlalchemy import delete, event, insert, or_, select, update
+from sqlalchemy.orm import Session
+
+from config import Settings
+from database import run_sync
+from models import TaskOutbox
+
+logger = logging.getLogger(__name__)
+
+# handler(session, payloads): does its writes in the session it is given;
+# the queue commits. Payloads must be JSON-compatible, like cache values.
+Handler = Callable[[Session, List[Any]], None]
+
+
+class Task:
+    __slots__ = ("name", "payload", "id", "attempts")
+
+    def __init__(self, name: str, payload: Any, id: Optional[int] = None, attempts: int = 0):
+        self.name = name
+        self.payload = payload
+        self.id = id
+        self.attempts = attempts
+
+
+class InlineTasks:
+    """Runs each task at once, inside the transaction that deferred it.
+
+    The default for repositories built without a queue (scripts, manage.py,
+    benchmarks), and the fallback of TaskQueue whenever it is not running
+    or is full: the side effect then costs what it did before, but is never
+    lost.
+    """
+
+    def __init__(self):
+        self.handlers: Dict[str, Handler] = {}
+        self.inline = 0
+
+    def register(self, name: str, handler: Handler) -> None:
+        self.handlers[name] = handler
+
+    def defer(self, db: Session, name: str, payload: Any) -> None:
+        """Schedule ``name`` to run once ``db``'s transaction commits."""
+        self.inline += 1
+        self.handlers[name](db, [payload])
+
+    def start(self) -> None:
+        pass
+
+    async def drain(self, timeout: float) -> None:
+        pass
+
+    def stats(self) -> dict:
+        return {"backend": type(self).__name__, "inline": self.inline}
+
+
+class TaskQueue(InlineTasks):
+    """Bounded in-process queue worked by one background task.
+
+    Tasks are handed over only when the deferring transaction commits and
+    are dropped with it on rollback, so the endpoint returns as soon as the
+    primary row is committed. The worker collects tasks for up to
+    ``batch_window`` seconds or ``batch_size`` tasks and runs each handler
+    once per batch, in one transaction, so a burst of writes costs the
+    side effect's commit once rather than per request. A failing batch is
+    retried task by task with exponential backoff, up to ``max_attempts``.
+
+    With ``durable`` every task is also written to task_outbox in the
+    deferring transaction and deleted in the transaction that runs it, so
+    queued work survives restarts: rows whose lease lapsed are swept back
+    in every ``poll_interval`` seconds, including by other processes.
+    Without it, tasks still queued at shutdown past the drain timeout are
+    lost.
+    """
+
+    def __init__(self, open_db: Callable[[], AsyncContextManager], maxsize: int = 10000,
+                 batch_size: int = 100, batch_window: float = 0.05, max_attempts: int = 5,
+                 retry_delay: float = 0.5, durable: bool = False, poll_interval: float = 5,
+                 lease: float = 30):
+        super().__init__()
+        self.open_db = open_db
+        self.maxsize = maxsize
+        self.batch_size = batch_size
+        self.batch_window = batch_window
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.durable = durable
+        self.poll_interval = poll_interval
+        self.lease = lease
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self.accepting = False
+        self.queue: Optional[asyncio.Queue] = None
+        self.workers: List[asyncio.Task] = []
+        self.retries: List[asyncio.TimerHandle] = []
+        self.processed = 0
+        self.batches = 0
+        self.retried = 0
+        self.failed = 0
+        self.dropped = 0
+
+    def running(self) -> bool:
+        return self.accepting
+
+    def full(self) -> bool:
+        return self.queue.qsize() >= self.maxsize
+
+    def defer(self, db: Session, name: str, payload: Any) -> None:
+        if not self.running() or self.full():
+            super().defer(db, name, payload)
+            return
+        task = Task(name, payload)
+        if self.durable:
+            now = time.time()
+            task.id = db.execute(insert(TaskOutbox).values(
+                name=name, payload=json.dumps(payload), attempts=0, available_at=now,
+                claimed_until=now + self.lease).returning(TaskOutbox.id)).scalar_one()
+        db.info.setdefault("deferred_tasks", []).append((self, task))
+
+    def submit(self, task: Task) -> None:
+        # Runs on the event loop: commits in the threadpool hand over through
+        # call_soon_threadsafe.
+        if self.queue is None:
+            self.dropped += 1
+            return
+        try:
+            self.queue.put_nowait(task)
+        except asyncio.QueueFull:
+            if not self.durable:
+                self.dropped += 1
+                logger.warning("task queue full; dropped %s", task.name)
+            # A durable task is picked up again by the sweep once its lease lapses.
+
+    def start(self) -> None:
+        self.loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue(self.maxsize)
+        self.accepting = True
+        self.workers = [asyncio.create_task(self.work())]
+        if self.durable:
+            self.workers.append(asyncio.create_task(self.sweep_periodically()))
+
+    async def drain(self, timeout: float) -> None:
+        """Stop taking tasks and finish the queued ones, waiting at most ``timeout`` seconds."""
+        if not self.running():
+            return
+        # New writes run their tasks inline from here on; ones committing
+        # right now still reach the queue before it is joined.
+        self.accepting = False
+        for handle in self.retries:
+            handle.cancel()
+        try:
+            await asyncio.wait_for(self.queue.join(), timeout)
+        except asyncio.TimeoutError:
+            logger.warning("task drain timed out with %d tasks queued", self.queue.qsize())
+        for worker in self.workers:
+            worker.cancel()
+        await asyncio.gather(*self.workers, return_exceptions=True)
+        self.loop = None
+        self.queue = None
+
+    async def work(self) -> None:
+        while True:
+            batch = [await self.queue.get()]
+            deadline = self.loop.time() + self.batch_window
+            while len(batch) < self.batch_size:
+                if not self.queue.empty():
+                    batch.append(self.queue.get_nowait())
+                    continue
+                timeout = deadline - self.loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            try:
+                await self.process(batch)
+            except Exception:
+                logger.exception("task batch failed outside its handlers")
+            finally:
+                for _ in batch:
+                    self.queue.task_done()
+
+    async def process(self, batch: List[Task]) -> None:
+        groups = defaultdict(list)
+        for task in batch:
+            groups[task.name].append(task)
+        for name, tasks in groups.items():
+            await self.run_group(name, tasks)
+        self.batches += 1
+
+    async def run_group(self, name: str, tasks: List[Task]) -> None:
+        try:
+            async with self.open_db() as db:
+                await run_sync(db, self.apply, name, tasks)
+            self.processed += len(tasks)
+        except Exception as exc:
+            if len(tasks) > 1:
+                # Find the task that fails instead of charging the whole batch.
+                for task in tasks:
+                    await self.run_group(name, [task])
+                return
+            logger.warning("task %s failed (attempt %d): %r", name, tasks[0].attempts + 1, exc)
+            await self.retry(tasks[0], repr(exc))
+
+    def apply(self, db: Session, name: str, tasks: List[Task]) -> None:
+        self.handlers[name](db, [task.payload for task in tasks])
+        if self.durable:
+            db.execute(delete(TaskOutbox).where(TaskOutbox.id.in_([task.id for task in tasks])))
+        db.commit()
+
+    async def retry(self, task: Task, error: str) -> None:
+        task.attempts += 1
+        delay = self.retry_delay * 2 ** (task.attempts - 1)
+        gave_up = task.attempts >= self.max_attempts
+        if self.durable:
+            async with self.open_db() as db:
+                await run_sync(db, self.record_attempt, task, error, None if gave_up else delay)
+        if gave_up:
+            self.failed += 1
+            logger.error("task %s gave up after %d attempts: %s", task.name, task.attempts, error)
+            return
+        self.retried += 1
+        self.retries = [handle for handle in self.retries if not handle.cancelled()]
+        self.retries.append(asyncio.get_running_loop().call_later(delay, self.submit, task))
+
+    def record_attempt(self, db: Session, task: Task, error: str, delay: Optional[float]) -> None:
+        now = time.time()
+        values = {"attempts": task.attempts, "last_error": error}
+        if delay is None:
+            values.update(available_at=None, claimed_until=None)
+        else:
+            values.update(available_at=now + delay, claimed_until=now + delay + self.lease)
+        db.execute(update(TaskOutbox).where(TaskOutbox.id == task.id).values(values))
+        db.commit()
+
+    def claim(self, db: Session, limit: int) -> List[Task]:
+        """Lease outbox rows that are due and not held by a live process."""
+        now = time.time()
+        due = (TaskOutbox.available_at <= now,
+               or_(TaskOutbox.claimed_until.is_(None), TaskOutbox.claimed_until < now))
+        ids = select(TaskOutbox.id).where(*due).order_by(TaskOutbox.id).limit(limit).scalar_subquery()
+        rows = db.execute(update(TaskOutbox).where(TaskOutbox.id.in_(ids), *due)
+                          .values(claimed_until=now + self.lease)
+                          .returning(TaskOutbox.id, TaskOutbox.name, TaskOutbox.payload, TaskOutbox.attempts)).all()
+        db.commit()
+        return [Task(row.name, json.loads(row.payload), row.id, row.attempts) for row in rows]
+
+    async def sweep(self) -> int:
+        room = self.maxsize - self.queue.qsize()
+        if room <= 0:
+            return 0
+        async with self.open_db() as db:
+            tasks = await run_sync(db, self.claim, min(room, self.batch_size * 10))
+        for task in tasks:
+            self.submit(task)
+        return len(tasks)
+
+    async def sweep_periodically(self) -> None:
+        while True:
+            try:
+                await self.sweep()
+            except Exception:
+                logger.exception("outbox sweep failed")
+            await asyncio.sleep(self.poll_interval)
+
+    def stats(self) -> dict:
+        return {
+            "backend": type(self).__name__,
+            "durable": self.durable,
+            "running": self.running(),
+            "queued": self.queue.qsize() if self.queue is not None else 0,
+            "processed": self.processed,
+            "batches": self.batches,
+            "retried": self.retried,
+            "failed": self.failed,
+            "dropped": self.dropped,
+            "inline": self.inline,
+        }
+
+
+@event.listens_for(Session, "after_commit")
+def submit_deferred(session: Session) -> None:
+    for queue, task in session.info.pop("deferred_tasks", ()):
+        loop = queue.loop
+        if loop is not None:
+            loop.call_soon_threadsafe(queue.submit, task)
+        else:
+            queue.dropped += 1
+
+
+@event.listens_for(Session, "after_rollback")
+def discard_deferred(session: Session) -> None:
+    session.info.pop("deferred_tasks", None)
+
+
+def build_tasks(settings: Settings, open_db: Callable[[], AsyncContextManager]) -> InlineTasks:
+    if settings.tasks_backend == "inline":
+        return InlineTasks()
+    return TaskQueue(open_db, settings.tasks_maxsize, settings.tasks_batch_size, settings.tasks_batch_window,
+                     settings.tasks_max_attempts, settings.tasks_retry_delay, settings.tasks_backend == "outbox",
+                     settings.tasks_poll_interval, settings.tasks_lease)
@@ -0,0 +1,66 @@
+"""Per-request authentication overhead, before and after the claims cache.
+
+"before" is what every authenticated handler used to do: verify the HS256
+signature from scratch and, for the profile, load the user row. "after" is
+the current_user dependency (TokenIssuer.verify): a verified-claims cache
+hit, with the profile served from the response cache.
+
+    python benchmarks/auth_overhead.py --users 100000
+"""
+import argparse
+import os
+import statistics
+import tempfile
+import time
+
+from jose import jwt
+from sqlalchemy.orm import sessionmaker
+
+from datagen import make_engine, seed
+
+from auth import build_token_issuer  # noqa: E402
+from cache import LRUCache  # noqa: E402
+from config import settings  # noqa: E402
+from repositories import UsersRepository  # noqa: E402
+
+LEGACY_TOKEN = jwt.encode({"id": 1}, settings.jwt_secret, "HS256")
+
+
+def measure(fn, repeat):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        timings.append((time.perf_counter() - started) * 1e6)
+    return statistics.median(timings), statistics.quantiles(timings, n=20)[-1]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=100000)
+    parser.add_argument("--repeat", type=int, default=20000)
+    args = parser.parse_args()
+
+    engine = make_engine(os.path.join(tempfile.mkdtemp(), "auth.db"))
+    seed(engine, args.users, 0, 0)
+    Session = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+    users = UsersRepository()
+    cached_users = UsersRepository(LRUCache())
+    tokens = build_token_issuer(settings)
+    token = tokens.create(1, "user1")
+    with Session() as db:
+        cases = [
+            ("before: decode", lambda: jwt.decode(LEGACY_TOKEN, settings.jwt_secret, "HS256")),
+            ("before: decode + user query",
+             lambda: users.get_user_by_id(db, jwt.decode(LEGACY_TOKEN, settings.jwt_secret, "HS256")["id"])),
+            ("after: decode, cache miss", lambda: tokens.decode(token)),
+            ("after: cache hit", lambda: tokens.verify(token)),
+            ("after: hit + cached profile", lambda: cached_users.get_user_response(db, tokens.verify(token).id)),
+        ]
+        for name, fn in cases:
+            p50, p95 = measure(fn, args.repeat)
+            print("%-32s p50 %8.1f us  p95 %8.1f us" % (name, p50, p95))
+
+
+if __name__ == "__main__":
+    main()
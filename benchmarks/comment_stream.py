@@ -0,0 +1,193 @@
+"""How many comment streams one process holds, and how fast events reach them.
+
+For each size in ``--subscribers`` a fresh process opens that many
+``GET /shanyraks/{id}/comments/stream`` connections spread over
+``--topics`` announcements, then posts ``--posts`` comments round robin
+over those announcements and reports:
+
+- connect: time until every stream is subscribed, and resident memory per
+  stream;
+- post: latency of the comment POST, which publishes in the request;
+- delivery: latency from sending the POST to receiving the event, over
+  every delivered event, and how many of the expected deliveries arrived;
+- slow consumers: ``--stalled`` streams never read what they are sent and
+  must be dropped once their queue (``--queue`` events) is full, without
+  holding up the others.
+
+Streams are driven as raw ASGI calls in the process, so the figures cover
+the app, the broker and the event loop but not sockets: a real server adds
+a file descriptor and kernel buffers per connection.
+
+    python benchmarks/comment_stream.py
+    python benchmarks/comment_stream.py --subscribers 1000,20000 --posts 500
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+os.environ.setdefault("JWT_SECRET", "benchmark")
+
+APP_DIR = Path(__file__).resolve().parent.parent / "app"
+
+ANNOUNCEMENT = {"type": "rent", "price": 150000, "address": "Алматы, ул. Абая 10", "area": 42.0,
+                "rooms_count": 2, "description": "у метро"}
+
+
+def rss_kb() -> int:
+    with open("/proc/self/status") as status:
+        for line in status:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1])
+    return 0
+
+
+def quantiles(values) -> dict:
+    if len(values) < 2:
+        return {"p50_ms": None, "p99_ms": None}
+    cuts = statistics.quantiles(values, n=100)
+    return {"p50_ms": round(cuts[49] * 1000, 2), "p99_ms": round(cuts[98] * 1000, 2)}
+
+
+class Subscriber:
+    """One stream, called as the server would call the app for a connection."""
+
+    def __init__(self, app, path: str, token: str, stalled: bool):
+        self.app = app
+        self.scope = {
+            "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "GET",
+            "scheme": "http", "path": path, "raw_path": path.encode(), "root_path": "",
+            "query_string": b"timeout=3600", "client": ("127.0.0.1", 1), "server": ("bench", 80),
+            "headers": [(b"host", b"bench"), (b"authorization", b"Bearer " + token.encode())],
+        }
+        self.stalled = stalled
+        self.requested = False
+        self.disconnect = asyncio.Event()
+        self.status = None
+        self.latencies = []
+
+    async def receive(self) -> dict:
+        if not self.requested:
+            self.requested = True
+            return {"type": "http.request", "body": b"", "more_body": False}
+        await self.disconnect.wait()
+        return {"type": "http.disconnect"}
+
+    async def send(self, message: dict) -> None:
+        if message["type"] == "http.response.start":
+            self.status = message["status"]
+            return
+        body = message.get("body", b"")
+        if self.stalled and body.startswith(b"id:"):
+            # A client that stopped reading: the write never completes.
+            await self.disconnect.wait()
+            return
+        received = time.perf_counter()
+        for block in body.split(b"\n\n"):
+            if b"event: comment_created" in block:
+                data = json.loads(block.rsplit(b"data: ", 1)[1])
+                self.latencies.append(received - float(data["content"]))
+
+    async def run(self) -> None:
+        await self.app(self.scope, self.receive, self.send)
+
+
+async def child(args, size: int) -> dict:
+    import httpx
+
+    import main
+
+    app = main.app
+    services = app.state.services
+    async with app.router.lifespan_context(app):
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            user = {"username": "stream", "phone": "0", "password": "stream", "name": "s", "city": "Алматы"}
+            await client.post("/auth/users/", json=user)
+            token = (await client.post("/auth/users/login", data={"username": "stream", "password": "stream"})
+                     ).json()["access_token"]
+            headers = {"Authorization": "Bearer " + token}
+            for _ in range(args.topics):
+                await client.post("/shanyraks/", headers=headers, json=ANNOUNCEMENT)
+
+            stalled = min(args.stalled, size)
+            subscribers = [Subscriber(app, "/shanyraks/%d/comments/stream" % (i % args.topics + 1), token,
+                                      i < stalled) for i in range(size)]
+            before = rss_kb()
+            started = time.perf_counter()
+            tasks = [asyncio.create_task(subscriber.run()) for subscriber in subscribers]
+            while services.events.stats()["subscribers"] < size:
+                if any(task.done() for task in tasks):
+                    failed = [subscriber.status for subscriber in subscribers if subscriber.status != 200]
+                    raise SystemExit("streams ended early, statuses %s" % failed[:5])
+                await asyncio.sleep(0.01)
+            result = {"connect": {"seconds": round(time.perf_counter() - started, 2),
+                                  "rss_kb_per_stream": round((rss_kb() - before) / size, 1)}}
+
+            posts = []
+            for i in range(args.posts):
+                sent = time.perf_counter()
+                response = await client.post("/shanyraks/%d/comments" % (i % args.topics + 1), headers=headers,
+                                              json={"content": "%.6f" % sent})
+                response.raise_for_status()
+                posts.append(time.perf_counter() - sent)
+                await asyncio.sleep(args.interval)
+            await asyncio.sleep(0.5)
+
+            delivered = [latency for subscriber in subscribers if not subscriber.stalled
+                         for latency in subscriber.latencies]
+            expected = sum(args.posts // args.topics + (i < args.posts % args.topics)
+                           for i in (j % args.topics for j in range(stalled, size)))
+            stats = services.events.stats()
+            result["post"] = quantiles(posts)
+            result["delivery"] = dict(quantiles(delivered), delivered=len(delivered), expected=expected)
+            result["slow_consumers"] = {"stalled": stalled, "dropped": stats["dropped"],
+                                        "still_subscribed": stats["subscribers"]}
+
+            for subscriber in subscribers:
+                subscriber.disconnect.set()
+            await asyncio.gather(*tasks)
+            result["after_disconnect"] = services.events.stats()["subscribers"]
+    return result
+
+
+def main_() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--subscribers", default="1000,5000,10000", help="comma-separated stream counts")
+    parser.add_argument("--topics", type=int, default=10, help="announcements the streams are spread over")
+    parser.add_argument("--posts", type=int, default=200)
+    parser.add_argument("--interval", type=float, default=0.01, help="seconds between posts")
+    parser.add_argument("--stalled", type=int, default=20, help="streams that never read")
+    parser.add_argument("--queue", type=int, default=16, help="EVENTS_QUEUE_SIZE")
+    parser.add_argument("--child", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child is not None:
+        sys.path.insert(0, str(APP_DIR))
+        print(json.dumps(asyncio.run(child(args, args.child))))
+        return
+
+    sys.path.insert(0, str(APP_DIR))
+    from manage import migrate
+
+    for size in [int(value) for value in args.subscribers.split(",")]:
+        url = "sqlite:///" + os.path.join(tempfile.mkdtemp(), "stream.db")
+        migrate(url)
+        env = dict(os.environ, DATABASE_URL=url, RATE_LIMIT_BACKEND="none", CACHE_BACKEND="none",
+                   TASKS_BACKEND="inline", EVENTS_QUEUE_SIZE=str(args.queue), EVENTS_HEARTBEAT="600")
+        command = [sys.executable, __file__, "--child", str(size)] + sys.argv[1:]
+        output = subprocess.run(command, env=env, check=True, capture_output=True, text=True).stdout
+        result = json.loads(output.strip().splitlines()[-1])
+        print("== %d streams" % size)
+        for name, values in result.items():
+            print("  %-16s %s" % (name, values))
+
+
+if __name__ == "__main__":
+    main_()
@@ -0,0 +1,152 @@
+"""Seeded synthetic marketplace: users, announcements and comments.
+
+Type, rooms and price follow the shape of real listings (mostly 1-3 rooms,
+log-normal prices that grow with rooms and differ by city) and comments
+per announcement follow a power law, so a few listings carry most of the
+discussion. Rows go in through chunked bulk inserts; the same seed always
+gives the same database.
+
+    python benchmarks/datagen.py /tmp/market.db --announcements 100000 --comments 500000
+    DATABASE_URL=sqlite:////tmp/market.db uvicorn main:app --app-dir app
+"""
+import argparse
+import os
+import random
+import sys
+import time
+from itertools import accumulate
+from pathlib import Path
+from typing import List
+
+from sqlalchemy import create_engine, insert
+from sqlalchemy.orm import Session
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "app"))
+# The app has no default JWT secret; benchmarks sign throwaway tokens.
+os.environ.setdefault("JWT_SECRET", "benchmark")
+
+from manage import migrate  # noqa: E402
+from models import User, Announcement, Comment  # noqa: E402
+from repositories import AnnouncementsRepository  # noqa: E402
+
+TYPES = ["rent", "sale"]
+CITIES = ["Алматы", "Астана", "Шымкент", "Караганда", "Актобе"]
+STREETS = ["Абая", "Достык", "Толе би", "Сейфуллина", "Жандосова", "Аль-Фараби", "Кабанбай батыра"]
+FEATURES = ["у метро", "рядом школа", "с ремонтом", "без мебели", "с мебелью", "новостройка",
+            "высокий этаж", "тихий двор", "парковка", "вид на горы", "евроремонт", "торг уместен"]
+# City centres; listings scatter around them with a ~5 km spread.
+CENTRES = {"Алматы": (43.2389, 76.8897), "Астана": (51.1694, 71.4491), "Шымкент": (42.3417, 69.5901),
+           "Караганда": (49.8047, 73.1094), "Актобе": (50.2839, 57.1669)}
+# Relative price level per city.
+PRICE_LEVEL = {"Алматы": 1.2, "Астана": 1.1, "Шымкент": 0.7, "Караганда": 0.65, "Актобе": 0.6}
+CHUNK = 10000
+
+
+def make_engine(path: str):
+    return create_engine("sqlite:///" + path, connect_args={"check_same_thread": False})
+
+
+def _chunks(rows, size=CHUNK):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def price(rnd: random.Random, type: str, rooms_count: int, city: str) -> int:
+    if type == "rent":
+        median, step = 120000 * rooms_count ** 0.7, 1000
+    else:
+        median, step = 18000000 * rooms_count ** 0.8, 100000
+    return max(1, round(median * PRICE_LEVEL[city] * rnd.lognormvariate(0, 0.35) / step)) * step
+
+
+def comment_targets(rnd: random.Random, announcements: int, comments: int, skew: float) -> List[int]:
+    """Announcement ids for ``comments`` comments, Zipf-distributed with exponent
+    ``skew`` over a shuffled ranking (0 gives every announcement the same odds)."""
+    if not comments:
+        return []
+    ranking = list(range(1, announcements + 1))
+    rnd.shuffle(ranking)
+    weights = accumulate(1 / rank ** skew for rank in range(1, announcements + 1))
+    return rnd.choices(ranking, cum_weights=list(weights), k=comments)
+
+
+def seed(engine, users: int, announcements: int, comments: int, seed: int = 42,
+         comment_skew: float = 1.1) -> None:
+    rnd = random.Random(seed)
+    migrate(engine.url.render_as_string(hide_password=False))
+
+    user_rows = ({"id": i,
+                  "username": "user%d" % i,
+                  "phone": "+7700%07d" % i,
+                  "password": "password",
+                  "name": "User %d" % i,
+                  "city": rnd.choice(CITIES)} for i in range(1, users + 1))
+
+    geo = random.Random(seed + 1)
+
+    def announcement_rows():
+        for i in range(1, announcements + 1):
+            type = rnd.choice(TYPES)
+            rooms_count = min(1 + int(rnd.expovariate(0.6)), 8)
+            city = rnd.choice(CITIES)
+            yield {"id": i,
+                   "type": type,
+                   "price": price(rnd, type, rooms_count, city),
+                   "address": "%s, ул. %s %d" % (city, rnd.choice(STREETS), rnd.randrange(1, 300)),
+                   "latitude": geo.gauss(CENTRES[city][0], 0.045),
+                   "longitude": geo.gauss(CENTRES[city][1], 0.06),
+                   "area": round(rooms_count * rnd.uniform(18, 35), 1),
+                   "rooms_count": rooms_count,
+                   "description": "%d комнатная квартира, %s" % (rooms_count, ", ".join(rnd.sample(FEATURES, 3))),
+                   "user_id": rnd.randrange(1, users + 1),
+                   "comment_count": 0}
+
+    targets = comment_targets(random.Random(seed + 2), announcements, comments, comment_skew)
+    comment_rows = ({"id": i,
+                     "content": "comment %d" % i,
+                     "author_id": rnd.randrange(1, users + 1),
+                     "ads_id": ads_id} for i, ads_id in enumerate(targets, 1))
+
+    with engine.begin() as conn:
+        for table, rows in ((User.__table__, user_rows),
+                            (Announcement.__table__, announcement_rows()),
+                            (Comment.__table__, comment_rows)):
+            for batch in _chunks(rows):
+                conn.execute(insert(table), batch)
+
+    # The rows bypass the repository, so derive the counters and the facet
+    # summary the way the maintenance commands do.
+    with Session(engine) as db:
+        repository = AnnouncementsRepository()
+        repository.reconcile_counters(db)
+        repository.rebuild_facets(db)
+
+    with engine.begin() as conn:
+        conn.exec_driver_sql("ANALYZE")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("path")
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--announcements", type=int, default=20000)
+    parser.add_argument("--comments", type=int, default=100000)
+    parser.add_argument("--comment-skew", type=float, default=1.1)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    if Path(args.path).exists():
+        parser.error("%s exists; seed into a new file" % args.path)
+    started = time.perf_counter()
+    seed(make_engine(args.path), args.users, args.announcements, args.comments, args.seed, args.comment_skew)
+    print("seeded %s in %.1f s" % (args.path, time.perf_counter() - started))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,395 @@
+"""Per-endpoint latency and a concurrent load profile over every route.
+
+Seeds a fresh database with datagen (same seed, same data), then:
+
+1. endpoints: each route in app/main.py ``--repeat`` times, one request at
+   a time, for p50/p95/p99 and requests per second per endpoint.
+2. load: ``--requests`` requests drawn from a read-heavy marketplace mix
+   (searches, listing and comment reads, some posts and edits) with
+   ``--concurrency`` in flight.
+
+Requests go through an in-process ASGI client by default. With ``--url``
+they go over HTTP to a running server instead; seed its database with
+datagen using the same sizes and seed, and give it the same JWT settings
+and RATE_LIMIT_BACKEND=none. The run fails if a route has no scenario, so
+new routes get measured too.
+
+Results are printed as JSON (or written to ``--output``). ``--baseline``
+compares them with an earlier run and exits 1 when an endpoint's p50 or
+p95 in the first phase grew, or the load throughput fell, by more than
+``--tolerance``; ``--save-baseline`` stores the run. Baselines only
+compare runs on the same machine with the same sizes.
+
+    python benchmarks/load.py --save-baseline benchmarks/baseline.json
+    python benchmarks/load.py --baseline benchmarks/baseline.json
+    DB_ASYNC=false python benchmarks/load.py --baseline benchmarks/baseline.json
+    python benchmarks/load.py --url http://127.0.0.1:8000 --skip-endpoints
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import statistics
+import sys
+import tempfile
+import time
+from contextlib import AsyncExitStack
+from itertools import count
+from pathlib import Path
+from typing import Callable, Dict, List, Tuple
+
+os.environ.setdefault("JWT_SECRET", "benchmark")
+
+APP_DIR = Path(__file__).resolve().parent.parent / "app"
+ALMATY = (43.2389, 76.8897)
+ANNOUNCEMENT = {"type": "rent", "price": 150000, "address": "Алматы, ул. Абая 10", "area": 42.0,
+                "rooms_count": 2, "description": "2 комнатная квартира, у метро, с ремонтом"}
+QUERIES = ["у метро", "вид на горы", "евроремонт парковка", "Алматы Абая", "новостройка с мебелью"]
+
+
+class Context:
+    """What the scenarios draw on: sizes of the seeded data, the bench
+    user's token, and pools of rows the bench user owns so edits and deletes
+    pass the ownership checks."""
+
+    def __init__(self, args, hot: List[int]):
+        self.rnd = random.Random(args.seed)
+        self.users = args.users
+        self.announcements = args.announcements
+        self.hot = hot
+        self.names = count()
+        self.headers: Dict[str, str] = {}
+        self.user_id = 0
+        self.owned: List[int] = []
+        self.doomed: List[int] = []
+        self.comments: List[Tuple[int, int]] = []
+        self.resume_points: List[Tuple[int, int]] = []
+        self.favorites: List[int] = []
+
+    def announcement(self) -> int:
+        return self.rnd.randrange(1, self.announcements + 1)
+
+    def popular(self) -> int:
+        return self.rnd.choice(self.hot)
+
+    def search_params(self) -> dict:
+        params = {"type": self.rnd.choice(["rent", "sale"])}
+        if self.rnd.random() < 0.7:
+            params["rooms_count"] = self.rnd.choice([1, 1, 2, 2, 3, 4])
+        if self.rnd.random() < 0.5:
+            params["price_until"] = 300000 if params["type"] == "rent" else 40000000
+        return params
+
+
+Build = Callable[[Context], Tuple[str, dict]]
+
+
+def username(ctx: Context) -> str:
+    return "load%d_%d" % (os.getpid(), next(ctx.names))
+
+
+def bulk_body(rows: int) -> str:
+    return "\n".join(json.dumps(dict(ANNOUNCEMENT, price=100000 + i * 1000)) for i in range(rows))
+
+
+def stream_resume(ctx: Context) -> Tuple[str, dict]:
+    ads_id, comment_id = ctx.rnd.choice(ctx.resume_points)
+    return "/shanyraks/%d/comments/stream" % ads_id, {"params": {"timeout": 0},
+                                                     "headers": {"Last-Event-ID": str(comment_id)}}
+
+
+NDJSON = {"Content-Type": "application/x-ndjson"}
+
+# (name, method, route path, weight in the load mix, build). build returns
+# the URL and request kwargs; weight 0 keeps a route out of the mix, for
+# health probes and for writes that use up the pools.
+SCENARIOS: List[Tuple[str, str, str, int, Build]] = [
+    ("health_db", "GET", "/health/db", 0, lambda ctx: ("/health/db", {})),
+    ("health_cache", "GET", "/health/cache", 0, lambda ctx: ("/health/cache", {})),
+    ("health_counters", "GET", "/health/counters", 0, lambda ctx: ("/health/counters", {})),
+    ("health_tasks", "GET", "/health/tasks", 0, lambda ctx: ("/health/tasks", {})),
+    ("health_events", "GET", "/health/events", 0, lambda ctx: ("/health/events", {})),
+    ("health_similar", "GET", "/health/similar", 0, lambda ctx: ("/health/similar", {})),
+    ("metrics", "GET", "/metrics", 0, lambda ctx: ("/metrics", {})),
+    ("post_signup", "POST", "/auth/users/", 0, lambda ctx: ("/auth/users/", {"json": {
+        "username": username(ctx), "phone": "0", "password": "load", "name": "load", "city": "Алматы"}})),
+    ("post_login", "POST", "/auth/users/login", 1, lambda ctx: ("/auth/users/login", {
+        "data": {"username": "load%d" % os.getpid(), "password": "load"}})),
+    ("get_profile", "GET", "/auth/users/me", 2, lambda ctx: ("/auth/users/me", {})),
+    ("patch_profile", "PATCH", "/auth/users/me", 0, lambda ctx: ("/auth/users/me", {
+        "json": {"phone": str(ctx.rnd.randrange(10 ** 6)), "name": "string", "city": "string"}})),
+    ("post_add_ads", "POST", "/shanyraks/", 2, lambda ctx: ("/shanyraks/", {"json": ANNOUNCEMENT})),
+    ("post_bulk_ads", "POST", "/shanyraks/bulk", 0, lambda ctx: ("/shanyraks/bulk", {
+        "content": bulk_body(50), "headers": NDJSON})),
+    ("export_announcements", "GET", "/shanyraks/export", 0, lambda ctx: ("/shanyraks/export", {
+        "params": {"user_id": ctx.rnd.randrange(1, ctx.users + 1)}})),
+    ("search_announcements", "GET", "/shanyraks", 30, lambda ctx: ("/shanyraks", {
+        "params": ctx.search_params()})),
+    ("get_announcement_facets", "GET", "/shanyraks/facets", 6, lambda ctx: ("/shanyraks/facets", {
+        "params": ctx.search_params()})),
+    ("get_nearby_announcements", "GET", "/shanyraks/nearby", 5, lambda ctx: ("/shanyraks/nearby", {
+        "params": dict(ctx.search_params(), lat=ALMATY[0] + ctx.rnd.uniform(-0.05, 0.05),
+                       lon=ALMATY[1] + ctx.rnd.uniform(-0.05, 0.05), radius_km=2)})),
+    ("text_search_announcements", "GET", "/shanyraks/search", 5, lambda ctx: ("/shanyraks/search", {
+        "params": {"q": ctx.rnd.choice(QUERIES)}})),
+    ("get_announcement", "GET", "/shanyraks/{id}", 25, lambda ctx: ("/shanyraks/%d" % ctx.popular(), {})),
+    ("get_similar_announcements", "GET", "/shanyraks/{id}/similar", 5, lambda ctx: (
+        "/shanyraks/%d/similar" % ctx.popular(), {})),
+    ("patch_announcement", "PATCH", "/shanyraks/{id}", 2, lambda ctx: ("/shanyraks/%d" % ctx.rnd.choice(ctx.owned), {
+        "json": dict(ANNOUNCEMENT, price=ctx.rnd.randrange(100, 400) * 1000)})),
+    ("delete_announcements", "DELETE", "/shanyraks/{id}", 0, lambda ctx: ("/shanyraks/%d" % ctx.doomed.pop(), {})),
+    ("post_add_comment", "POST", "/shanyraks/{id}/comments", 4, lambda ctx: (
+        "/shanyraks/%d/comments" % ctx.popular(), {"json": {"content": "load comment"}})),
+    ("get_comments", "GET", "/shanyraks/{id}/comments", 12, lambda ctx: (
+        "/shanyraks/%d/comments" % ctx.popular(), {})),
+    # A reconnect catching up from Last-Event-ID; timeout=0 ends the stream after it.
+    ("stream_comments", "GET", "/shanyraks/{id}/comments/stream", 1, lambda ctx: stream_resume(ctx)),
+    ("patch_comment", "PATCH", "/shanyraks/{id}/comments/{comment_id}", 0, lambda ctx: (
+        "/shanyraks/%d/comments/%d" % ctx.rnd.choice(ctx.comments), {"json": {"content": "edited"}})),
+    ("delete_comment", "DELETE", "/shanyraks/{id}/comments/{comment_id}", 0, lambda ctx: (
+        "/shanyraks/%d/comments/%d" % ctx.comments.pop(), {})),
+    ("post_favorites", "POST", "/auth/users/favorites/shanyraks/{id}", 2, lambda ctx: (
+        "/auth/users/favorites/shanyraks/%d" % ctx.announcement(), {})),
+    ("post_favorites_batch", "POST", "/auth/users/favorites/shanyraks", 0, lambda ctx: (
+        "/auth/users/favorites/shanyraks", {"json": {"ids": [ctx.announcement() for _ in range(10)]}})),
+    ("get_to_favorite_ads", "GET", "/auth/users/favorites/shanyraks", 3, lambda ctx: (
+        "/auth/users/favorites/shanyraks", {})),
+    ("delete_favorites_batch", "DELETE", "/auth/users/favorites/shanyraks", 0, lambda ctx: (
+        "/auth/users/favorites/shanyraks", {"json": {"ids": [ctx.favorites.pop() for _ in range(5)]}})),
+    ("delete_favorites", "DELETE", "/auth/users/favorites/shanyraks/{id}", 0, lambda ctx: (
+        "/auth/users/favorites/shanyraks/%d" % ctx.favorites.pop(), {})),
+]
+
+
+def uncovered_routes(app) -> List[str]:
+    from fastapi.routing import APIRoute
+
+    covered = {(method, path) for _, method, path, _, _ in SCENARIOS}
+    return sorted("%s %s" % (method, route.path) for route in app.routes if isinstance(route, APIRoute)
+                  for method in route.methods if (method, route.path) not in covered)
+
+
+def failed(response) -> bool:
+    # Several handlers report errors as a 200 with an "error" key.
+    return response.status_code >= 400 or response.content[:9] == b'{"error":'
+
+
+def summarize(timings: List[float], errors: int, elapsed: float) -> dict:
+    cuts = statistics.quantiles(timings, n=100) if len(timings) > 1 else timings * 99
+    return {"count": len(timings),
+            "errors": errors,
+            "rps": round(len(timings) / elapsed, 1) if elapsed else None,
+            "p50_ms": round(cuts[49], 3),
+            "p95_ms": round(cuts[94], 3),
+            "p99_ms": round(cuts[98], 3)}
+
+
+async def request(client, ctx: Context, method: str, build: Build) -> Tuple[float, bool]:
+    url, kwargs = build(ctx)
+    kwargs["headers"] = dict(ctx.headers, **kwargs.get("headers", {}))
+    started = time.perf_counter()
+    response = await client.request(method, url, **kwargs)
+    return (time.perf_counter() - started) * 1000, failed(response)
+
+
+async def prepare(client, ctx: Context, pool: int) -> None:
+    """Sign up the bench user and give it announcements, comments and
+    favorites to edit and delete."""
+    name = "load%d" % os.getpid()
+    await client.post("/auth/users/", json={"username": name, "phone": "0", "password": "load",
+                                            "name": "load", "city": "Алматы"})
+    response = await client.post("/auth/users/login", data={"username": name, "password": "load"})
+    ctx.headers = {"Authorization": "Bearer " + response.json()["access_token"]}
+    ctx.user_id = (await client.get("/auth/users/me", headers=ctx.headers)).json()["id"]
+
+    await client.post("/shanyraks/bulk", content=bulk_body(pool + 20), headers=dict(ctx.headers, **NDJSON))
+    export = await client.get("/shanyraks/export", params={"user_id": ctx.user_id})
+    ids = [json.loads(line)["id"] for line in export.text.splitlines() if line]
+    ctx.owned, ctx.doomed = ids[:20], ids[20:]
+
+    for i in range(pool):
+        await client.post("/shanyraks/%d/comments" % ctx.owned[i % len(ctx.owned)], headers=ctx.headers,
+                          json={"content": "own comment %d" % i})
+    for ads_id in ctx.owned:
+        rows = (await client.get("/shanyraks/%d/comments" % ads_id, headers=ctx.headers,
+                                 params={"limit": 500})).json()
+        ctx.comments += [(ads_id, row["id"]) for row in rows if row["author_id"] == ctx.user_id]
+    # Comments get deleted as the run goes; streams resume after any of them.
+    ctx.resume_points = list(ctx.comments)
+
+    favorites = ctx.rnd.sample(range(1, ctx.announcements + 1), min(pool * 6, ctx.announcements))
+    for start in range(0, len(favorites), 100):
+        await client.post("/auth/users/favorites/shanyraks", headers=ctx.headers,
+                          json={"ids": favorites[start:start + 100]})
+    ctx.favorites = favorites
+
+
+async def run_endpoints(client, ctx: Context, repeat: int) -> dict:
+    # Rounds over every route rather than one route at a time, so a stall on
+    # the machine spreads over all endpoints instead of skewing one.
+    timings = {name: [] for name, *_ in SCENARIOS}
+    errors = dict.fromkeys(timings, 0)
+    for _ in range(repeat):
+        for name, method, _, _, build in SCENARIOS:
+            ms, error = await request(client, ctx, method, build)
+            timings[name].append(ms)
+            errors[name] += error
+    return {name: summarize(values, errors[name], sum(values) / 1000) for name, values in timings.items()}
+
+
+async def run_load(client, ctx: Context, requests: int, concurrency: int) -> dict:
+    mix = [(name, method, build) for name, method, _, weight, build in SCENARIOS if weight]
+    picks = ctx.rnd.choices(mix, weights=[weight for *_, weight, _ in SCENARIOS if weight], k=requests)
+    timings: Dict[str, List[float]] = {}
+    errors: Dict[str, int] = {}
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one(name, method, build):
+        async with semaphore:
+            ms, error = await request(client, ctx, method, build)
+        timings.setdefault(name, []).append(ms)
+        errors[name] = errors.get(name, 0) + error
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one(*pick) for pick in picks))
+    elapsed = time.perf_counter() - started
+    return {"requests": requests,
+            "concurrency": concurrency,
+            "errors": sum(errors.values()),
+            "throughput_rps": round(requests / elapsed, 1),
+            "endpoints": {name: summarize(values, errors[name], elapsed) for name, values in sorted(timings.items())}}
+
+
+async def run(args) -> dict:
+    import httpx
+
+    from datagen import comment_targets
+
+    hot = comment_targets(random.Random(args.seed + 2), args.announcements, 10000, args.comment_skew)
+    ctx = Context(args, hot)
+    if args.url:
+        client = httpx.AsyncClient(base_url=args.url, timeout=60,
+                                   limits=httpx.Limits(max_connections=args.concurrency))
+        app = None
+    else:
+        import main
+
+        missing = uncovered_routes(main.app)
+        if missing:
+            raise SystemExit("routes without a scenario: " + ", ".join(missing))
+        app = main.app
+        client = httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://load", timeout=60)
+
+    results = {}
+    async with AsyncExitStack() as stack:
+        if app is not None:
+            await stack.enter_async_context(app.router.lifespan_context(app))
+        async with client:
+            await prepare(client, ctx, args.repeat)
+            if not args.skip_endpoints:
+                results["endpoints"] = await run_endpoints(client, ctx, args.repeat)
+            if args.requests:
+                results["load"] = await run_load(client, ctx, args.requests, args.concurrency)
+    return results
+
+
+def seed_database(args) -> None:
+    # Set before datagen pulls in the app's database module, which reads it once.
+    path = os.path.join(tempfile.mkdtemp(), "load.db")
+    os.environ["DATABASE_URL"] = "sqlite:///" + path
+    from datagen import make_engine, seed
+
+    started = time.perf_counter()
+    seed(make_engine(path), args.users, args.announcements, args.comments, args.seed, args.comment_skew)
+    print("seeded %d users, %d announcements, %d comments in %.1f s"
+          % (args.users, args.announcements, args.comments, time.perf_counter() - started), file=sys.stderr)
+
+
+def latency_rows(results: dict) -> Dict[str, dict]:
+    rows = {"endpoints " + name: values for name, values in results.get("endpoints", {}).items()}
+    rows.update(("load " + name, values) for name, values in results.get("load", {}).get("endpoints", {}).items())
+    return rows
+
+
+def compare(results: dict, baseline: dict, tolerance: float, min_delta_ms: float) -> List[str]:
+    """Lines describing regressions against ``baseline``; also prints the full table."""
+    regressions = []
+    current, before = latency_rows(results), latency_rows(baseline)
+    print("%-40s %10s %10s %8s" % ("", "p95 before", "p95 now", "change"), file=sys.stderr)
+    for name in sorted(current.keys() & before.keys()):
+        now, then = current[name], before[name]
+        print("%-40s %10.2f %10.2f %+7.0f%%" % (name, then["p95_ms"], now["p95_ms"],
+                                                 (now["p95_ms"] / then["p95_ms"] - 1) * 100 if then["p95_ms"] else 0),
+              file=sys.stderr)
+        # p99 is reported but too noisy over a few hundred samples to gate on,
+        # and under the closed-loop mix latency only mirrors throughput.
+        if not name.startswith("endpoints "):
+            continue
+        for key in ("p50_ms", "p95_ms"):
+            if now[key] > then[key] * (1 + tolerance) and now[key] - then[key] > min_delta_ms:
+                regressions.append("%s %s %.2f -> %.2f" % (name, key, then[key], now[key]))
+    if "load" in results and "load" in baseline:
+        now, then = results["load"]["throughput_rps"], baseline["load"]["throughput_rps"]
+        print("%-40s %10.1f %10.1f %+7.0f%%" % ("load throughput_rps", then, now, (now / then - 1) * 100),
+              file=sys.stderr)
+        if now < then * (1 - tolerance):
+            regressions.append("load throughput_rps %.1f -> %.1f" % (then, now))
+    return regressions
+
+
+def main_() -> int:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--announcements", type=int, default=20000)
+    parser.add_argument("--comments", type=int, default=100000)
+    parser.add_argument("--comment-skew", type=float, default=1.1)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--repeat", type=int, default=200, help="requests per endpoint")
+    parser.add_argument("--requests", type=int, default=5000, help="requests in the load mix, 0 to skip")
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--skip-endpoints", action="store_true")
+    parser.add_argument("--url", help="drive a running server instead of the app in-process")
+    parser.add_argument("--output")
+    parser.add_argument("--baseline")
+    parser.add_argument("--save-baseline")
+    parser.add_argument("--tolerance", type=float, default=0.3)
+    parser.add_argument("--min-delta-ms", type=float, default=2.0,
+                        help="ignore latency changes smaller than this, whatever the ratio")
+    args = parser.parse_args()
+
+    sys.path.insert(0, str(APP_DIR))
+    if not args.url:
+        # One client plays every user, so per-client limits would cut the run short.
+        os.environ["RATE_LIMIT_BACKEND"] = "none"
+        os.environ.setdefault("WRITE_QUEUE", "100000")
+        os.environ.setdefault("SLOW_QUERY_MS", "100000")
+        seed_database(args)
+
+    results = {"meta": {"target": args.url or "in-process",
+                        "db_async": os.getenv("DB_ASYNC", "default"),
+                        "users": args.users, "announcements": args.announcements, "comments": args.comments,
+                        "comment_skew": args.comment_skew, "seed": args.seed, "repeat": args.repeat,
+                        "python": platform.python_version(), "machine": platform.machine()}}
+    results.update(asyncio.run(run(args)))
+
+    regressions = []
+    if args.baseline:
+        baseline = json.loads(Path(args.baseline).read_text())
+        regressions = compare(results, baseline, args.tolerance, args.min_delta_ms)
+        results["regressions"] = regressions
+        for line in regressions:
+            print("REGRESSION " + line, file=sys.stderr)
+    output = json.dumps(results, indent=2, ensure_ascii=False)
+    if args.output:
+        Path(args.output).write_text(output + "\n")
+    else:
+        print(output)
+    if args.save_baseline:
+        Path(args.save_baseline).write_text(output + "\n")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main_())
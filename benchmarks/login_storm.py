@@ -0,0 +1,127 @@
+"""Login throughput and the latency of other endpoints during a login storm.
+
+Fires a burst of concurrent logins while a second group of clients keeps
+reading announcements, and reports logins/s plus the p50/p99 of the reads.
+--compare runs the storm once with scrypt inline on the event loop and once
+per pool mode, each in a fresh process and database.
+
+    python benchmarks/login_storm.py --compare
+    PASSWORD_WORKERS=4 python benchmarks/login_storm.py --logins 400
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+os.environ.setdefault("JWT_SECRET", "benchmark")
+
+APP_DIR = Path(__file__).resolve().parent.parent / "app"
+
+PROFILES = {
+    "inline": {"PASSWORD_POOL": "inline"},
+    "thread": {"PASSWORD_POOL": "thread"},
+    "process": {"PASSWORD_POOL": "process"},
+}
+
+
+def percentile(values, q):
+    return round(statistics.quantiles(values, n=100)[q - 1], 2) if len(values) > 1 else None
+
+
+async def run_storm(args) -> dict:
+    import httpx
+
+    sys.path.insert(0, str(APP_DIR))
+    import main
+    from manage import migrate
+
+    migrate()
+    async with main.app.router.lifespan_context(main.app):
+        transport = httpx.ASGITransport(app=main.app, raise_app_exceptions=False)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            for i in range(args.users):
+                await client.post("/auth/users/", json={"username": "storm%d" % i, "phone": "0", "password": "storm",
+                                                        "name": "storm", "city": "Almaty"})
+            response = await client.post("/auth/users/login", data={"username": "storm0", "password": "storm"})
+            headers = {"Authorization": "Bearer " + response.json()["access_token"]}
+            await client.post("/shanyraks/", headers=headers, json={
+                "type": "rent", "price": 100000, "address": "Almaty", "area": 40.0, "rooms_count": 2,
+                "description": "storm"})
+
+            logins = asyncio.Semaphore(args.concurrency)
+            login_errors = 0
+            read_timings = []
+            done = asyncio.Event()
+
+            async def login(i):
+                nonlocal login_errors
+                async with logins:
+                    response = await client.post("/auth/users/login", data={"username": "storm%d" % (i % args.users),
+                                                                            "password": "storm"})
+                    if response.status_code != 200:
+                        login_errors += 1
+
+            async def reader():
+                while not done.is_set():
+                    started = time.perf_counter()
+                    await client.get("/shanyraks/1")
+                    read_timings.append((time.perf_counter() - started) * 1000)
+
+            readers = [asyncio.create_task(reader()) for _ in range(args.readers)]
+            started = time.perf_counter()
+            await asyncio.gather(*(login(i) for i in range(args.logins)))
+            elapsed = time.perf_counter() - started
+            done.set()
+            await asyncio.gather(*readers)
+
+    return {
+        "logins": args.logins,
+        "login_errors": login_errors,
+        "logins_per_s": round(args.logins / elapsed, 1),
+        "reads": len(read_timings),
+        "read_p50_ms": percentile(read_timings, 50),
+        "read_p99_ms": percentile(read_timings, 99),
+    }
+
+
+def compare(args) -> None:
+    results = {}
+    for profile, overrides in PROFILES.items():
+        env = dict(os.environ, **overrides)
+        env["DATABASE_URL"] = "sqlite:///" + os.path.join(tempfile.mkdtemp(), "storm.db")
+        command = [sys.executable, __file__, "--logins", str(args.logins), "--users", str(args.users),
+                   "--concurrency", str(args.concurrency), "--readers", str(args.readers)]
+        output = subprocess.run(command, env=env, check=True, capture_output=True, text=True).stdout
+        results[profile] = json.loads(output.strip().splitlines()[-1])
+        print("%-8s %7.1f logins/s  reads %5d  read p50 %7.2f ms  p99 %7.2f ms"
+              % (profile, results[profile]["logins_per_s"], results[profile]["reads"],
+                 results[profile]["read_p50_ms"], results[profile]["read_p99_ms"]))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--logins", type=int, default=200)
+    parser.add_argument("--users", type=int, default=20)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--readers", type=int, default=8)
+    parser.add_argument("--compare", action="store_true")
+    args = parser.parse_args()
+
+    # One client plays every user, so the per-client limits would cut the run short.
+    os.environ.setdefault("RATE_LIMIT_BACKEND", "none")
+    if args.compare:
+        compare(args)
+        return
+    if "DATABASE_URL" not in os.environ:
+        os.environ["DATABASE_URL"] = "sqlite:///" + os.path.join(tempfile.mkdtemp(), "storm.db")
+    print(json.dumps(asyncio.run(run_storm(args))))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+"""Per-request cost of the metrics middleware and SQL timing hooks.
+
+Runs the same in-process requests with METRICS_ENABLED off and on (and on
+with the Server-Timing header), each in a fresh interpreter because the
+app reads its settings at import.
+
+    python benchmarks/metrics_overhead.py --repeat 2000
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+os.environ.setdefault("JWT_SECRET", "benchmark")
+
+MODES = [
+    ("metrics off", {"METRICS_ENABLED": "false"}),
+    ("metrics on", {"METRICS_ENABLED": "true", "SERVER_TIMING": "false"}),
+    ("metrics + Server-Timing", {"METRICS_ENABLED": "true", "SERVER_TIMING": "true"}),
+]
+
+REQUESTS = [
+    ("get_announcement", "/shanyraks/1", {}),
+    ("search_announcements", "/shanyraks", {"type": "rent", "limit": 20}),
+    ("get_comments", "/shanyraks/1/comments", {}),
+]
+
+
+def child(repeat: int) -> None:
+    sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "app"))
+    from fastapi.testclient import TestClient
+
+    import main
+    from manage import migrate
+
+    migrate()
+    with TestClient(main.app) as client:
+        user = {"username": "bench", "phone": "0", "password": "bench", "name": "bench", "city": "Almaty"}
+        client.post("/auth/users/", json=user)
+        token = client.post("/auth/users/login", data={"username": "bench", "password": "bench"}).json()["access_token"]
+        headers = {"Authorization": "Bearer " + token}
+        for i in range(50):
+            client.post("/shanyraks/", headers=headers, json={
+                "type": "rent" if i % 2 else "sale", "price": 100000 + i, "address": "Алматы, Абая %d" % i,
+                "area": 40.0, "rooms_count": 2, "description": "у метро"})
+        for i in range(20):
+            client.post("/shanyraks/1/comments", headers=headers, json={"content": "comment %d" % i})
+
+        for name, url, params in REQUESTS:
+            for _ in range(repeat // 10):
+                client.get(url, params=params)
+            timings = []
+            for _ in range(repeat):
+                started = time.perf_counter()
+                client.get(url, params=params)
+                timings.append((time.perf_counter() - started) * 1e6)
+            print("%s %.1f %.1f" % (name, statistics.median(timings), statistics.quantiles(timings, n=20)[-1]))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--repeat", type=int, default=2000)
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        child(args.repeat)
+        return
+
+    for mode, env in MODES:
+        env = dict(os.environ, CACHE_BACKEND="none", SLOW_QUERY_MS="1000", RATE_LIMIT_BACKEND="none",
+                   DATABASE_URL="sqlite:///" + os.path.join(tempfile.mkdtemp(), "metrics.db"), **env)
+        output = subprocess.run([sys.executable, __file__, "--child", "--repeat", str(args.repeat)],
+                                env=env, check=True, capture_output=True, text=True).stdout
+        for line in output.splitlines():
+            name, p50, p95 = line.split()
+            print("%-24s %-22s p50 %8s us  p95 %8s us" % (mode, name, p50, p95))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,136 @@
+"""Mixed read/write load against the existing endpoints.
+
+Runs the app in-process behind an ASGI client and fires a mix of searches,
+announcement reads, comment listings, comment posts and listing edits with a
+fixed concurrency. --compare runs the same load once with SQLite's default
+rollback journal and once with the WAL/pragma settings from config.py, each
+in a fresh process and database.
+
+    python benchmarks/mixed_load.py --compare
+    DB_ASYNC=false python benchmarks/mixed_load.py --requests 5000
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+os.environ.setdefault("JWT_SECRET", "benchmark")
+
+APP_DIR = Path(__file__).resolve().parent.parent / "app"
+
+PROFILES = {
+    "rollback-journal": {"SQLITE_JOURNAL_MODE": "DELETE", "SQLITE_SYNCHRONOUS": "FULL",
+                         "SQLITE_BUSY_TIMEOUT": "5000", "SQLITE_CACHE_SIZE": "-2000",
+                         "SQLITE_MMAP_SIZE": "0"},
+    "wal": {},
+}
+
+
+async def run_load(args) -> dict:
+    import httpx
+
+    sys.path.insert(0, str(APP_DIR))
+    import main
+    from manage import migrate
+
+    migrate()
+    async with main.app.router.lifespan_context(main.app):
+        transport = httpx.ASGITransport(app=main.app, raise_app_exceptions=False)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            await client.post("/auth/users/", json={"username": "bench", "phone": "0", "password": "bench",
+                                                    "name": "bench", "city": "Almaty"})
+            response = await client.post("/auth/users/login", data={"username": "bench", "password": "bench"})
+            headers = {"Authorization": "Bearer " + response.json()["access_token"]}
+            for i in range(args.announcements):
+                await client.post("/shanyraks/", headers=headers, json={
+                    "type": "rent" if i % 2 else "sale", "price": 100000 + i * 1000, "address": "Almaty",
+                    "area": 40.0, "rooms_count": i % 4 + 1, "description": "bench"})
+
+            rnd = random.Random(7)
+            semaphore = asyncio.Semaphore(args.concurrency)
+            timings = {}
+            errors = 0
+
+            def pick():
+                id = rnd.randrange(1, args.announcements + 1)
+                if rnd.random() < args.write_ratio:
+                    if rnd.random() < 0.7:
+                        return "post_comment", ("POST", "/shanyraks/%d/comments" % id, {"json": {"content": "hi"}})
+                    return "patch_announcement", ("PATCH", "/shanyraks/%d" % id, {"json": {
+                        "type": "rent", "price": rnd.randrange(100000, 900000), "address": "string",
+                        "area": 0, "rooms_count": 0, "description": "string"}})
+                choice = rnd.random()
+                if choice < 0.4:
+                    return "search", ("GET", "/shanyraks", {"params": {"rooms_count": rnd.randrange(1, 5)}})
+                if choice < 0.8:
+                    return "get_announcement", ("GET", "/shanyraks/%d" % id, {})
+                return "get_comments", ("GET", "/shanyraks/%d/comments" % id, {})
+
+            async def one(name, method, url, kwargs):
+                nonlocal errors
+                async with semaphore:
+                    started = time.perf_counter()
+                    response = await client.request(method, url, headers=headers, **kwargs)
+                    timings.setdefault(name, []).append((time.perf_counter() - started) * 1000)
+                    if response.status_code >= 400 or "error" in response.text[:20]:
+                        errors += 1
+
+            started = time.perf_counter()
+            await asyncio.gather(*(one(name, *request) for name, request in (pick() for _ in range(args.requests))))
+            elapsed = time.perf_counter() - started
+
+    return {
+        "requests": args.requests,
+        "concurrency": args.concurrency,
+        "errors": errors,
+        "throughput_rps": round(args.requests / elapsed, 1),
+        "endpoints": {name: {"count": len(values),
+                             "p50_ms": round(statistics.median(values), 2),
+                             "p95_ms": round(statistics.quantiles(values, n=20)[-1], 2) if len(values) > 1 else None}
+                      for name, values in sorted(timings.items())},
+    }
+
+
+def compare(args) -> None:
+    results = {}
+    for profile, overrides in PROFILES.items():
+        env = dict(os.environ, **overrides)
+        env["DATABASE_URL"] = "sqlite:///" + os.path.join(tempfile.mkdtemp(), "load.db")
+        command = [sys.executable, __file__, "--requests", str(args.requests),
+                   "--concurrency", str(args.concurrency), "--write-ratio", str(args.write_ratio),
+                   "--announcements", str(args.announcements)]
+        output = subprocess.run(command, env=env, check=True, capture_output=True, text=True).stdout
+        results[profile] = json.loads(output.strip().splitlines()[-1])
+        print("%-18s %8.1f req/s  errors %d" % (profile, results[profile]["throughput_rps"],
+                                                results[profile]["errors"]))
+    print(json.dumps(results, indent=2))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=3000)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--write-ratio", type=float, default=0.3)
+    parser.add_argument("--announcements", type=int, default=200)
+    parser.add_argument("--compare", action="store_true")
+    args = parser.parse_args()
+
+    # One client plays every user, so the per-client limits would cut the run short.
+    os.environ.setdefault("RATE_LIMIT_BACKEND", "none")
+    if args.compare:
+        compare(args)
+        return
+    if "DATABASE_URL" not in os.environ:
+        os.environ["DATABASE_URL"] = "sqlite:///" + os.path.join(tempfile.mkdtemp(), "load.db")
+    print(json.dumps(asyncio.run(run_load(args))))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+"""Latency of GET /shanyraks/nearby queries on a seeded dataset.
+
+Seeds announcements scattered around the city centres, runs radius and
+bounding-box queries with and without the search filters through the
+repository, checks the results against a brute-force scan, and exits
+non-zero when a query's p95 misses the target.
+
+    python benchmarks/nearby.py --announcements 200000 --target-p95-ms 25
+"""
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+from sqlalchemy.orm import sessionmaker
+
+from datagen import make_engine, seed
+
+from geocoding import haversine_km  # noqa: E402
+from models import Announcement, AnnouncementSearch  # noqa: E402
+from repositories import AnnouncementsRepository  # noqa: E402
+
+ALMATY = (43.2389, 76.8897)
+ASTANA_EDGE = (51.2100, 71.5200)
+
+QUERIES = [
+    ("radius_2km", ALMATY, dict(radius_km=2), {}),
+    ("radius_5km_filters", ALMATY, dict(radius_km=5), dict(type="rent", rooms_count=2, price_until=300000)),
+    ("radius_1km_edge", ASTANA_EDGE, dict(radius_km=1), {}),
+    ("box_city_centre", ALMATY, dict(box=(43.22, 43.26, 76.86, 76.92)), dict(type="sale")),
+]
+
+announcements_repository = AnnouncementsRepository()
+
+
+def brute_force(points, center, radius_km, box, criteria, limit):
+    matches = []
+    for id, type, rooms_count, price, lat, lon in points:
+        if criteria.type is not None and type != criteria.type:
+            continue
+        if criteria.rooms_count is not None and rooms_count != criteria.rooms_count:
+            continue
+        if criteria.price_until is not None and price > criteria.price_until:
+            continue
+        if box is not None and not (box[0] <= lat <= box[1] and box[2] <= lon <= box[3]):
+            continue
+        distance = haversine_km(center, (lat, lon))
+        if radius_km is not None and distance > radius_km:
+            continue
+        matches.append((distance, id))
+    return [id for distance, id in sorted(matches)[:limit]]
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=20000)
+    parser.add_argument("--announcements", type=int, default=200000)
+    parser.add_argument("--repeat", type=int, default=50)
+    parser.add_argument("--limit", type=int, default=20)
+    parser.add_argument("--target-p95-ms", type=float, default=25)
+    args = parser.parse_args()
+
+    engine = make_engine(os.path.join(tempfile.mkdtemp(), "nearby.db"))
+    seed(engine, args.users, args.announcements, 0)
+    Session = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+    failures = []
+    with Session() as db:
+        points = db.query(Announcement.id, Announcement.type, Announcement.rooms_count, Announcement.price,
+                          Announcement.latitude, Announcement.longitude).all()
+        for name, center, area, params in QUERIES:
+            criteria = AnnouncementSearch(**params)
+            radius_km, box = area.get("radius_km"), area.get("box")
+            rows = announcements_repository.nearby(db, center, criteria, args.limit, radius_km, box)
+            expected = brute_force(points, center, radius_km, box, criteria, args.limit)
+            if [row.id for row, distance in rows] != expected:
+                failures.append("%s: results differ from the brute-force scan" % name)
+
+            timings = []
+            for _ in range(args.repeat):
+                db.expunge_all()
+                started = time.perf_counter()
+                announcements_repository.nearby(db, center, criteria, args.limit, radius_km, box)
+                timings.append((time.perf_counter() - started) * 1000)
+            p95 = statistics.quantiles(timings, n=20)[-1]
+            print("%-22s %3d hits  p50 %7.2f ms  p95 %7.2f ms" % (name, len(rows), statistics.median(timings), p95))
+            if p95 > args.target_p95_ms:
+                failures.append("%s: p95 %.2f ms over the %.2f ms target" % (name, p95, args.target_p95_ms))
+
+    for failure in failures:
+        print("FAIL " + failure)
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,160 @@
+"""Query-plan and latency regression check for the announcement search workload.
+
+Seeds a synthetic SQLite database, runs the search, comment-list and owner
+queries through the repositories and exits non-zero when a plan contains a
+full table scan or when p95 latency regresses past the stored baseline
+(query_plans_baseline.json, from the default dataset). A missing baseline
+is a failure too, not a pass.
+
+    python benchmarks/query_plans.py --announcements 200000
+    python benchmarks/query_plans.py --save-baseline
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime
+from pathlib import Path
+
+from sqlalchemy import event
+from sqlalchemy.orm import sessionmaker
+
+from datagen import make_engine, seed
+
+from models import AnnouncementSearch  # noqa: E402
+from repositories import AnnouncementsRepository, CommentsRepository  # noqa: E402
+
+BASELINE = Path(__file__).resolve().parent / "query_plans_baseline.json"
+
+# Summary tables hold a few hundred rows by construction; reading them whole
+# is what they are for.
+SUMMARY_TABLES = {"announcement_facets"}
+
+announcements_repository = AnnouncementsRepository()
+comments_repository = CommentsRepository()
+
+
+def workload(users: int):
+    search = [
+        ("search_type", dict(type="rent")),
+        ("search_rooms", dict(rooms_count=2)),
+        ("search_type_rooms", dict(type="sale", rooms_count=3)),
+        ("search_type_rooms_price", dict(type="rent", rooms_count=2, price_from=150000, price_until=300000)),
+        ("search_rooms_price", dict(rooms_count=1, price_from=100000, price_until=200000)),
+        ("search_price", dict(price_from=150000, price_until=160000)),
+    ]
+    for name, params in search:
+        criteria = AnnouncementSearch(**params)
+        yield name + "_page", True, lambda db, c=criteria: announcements_repository.search(db, c, 10)
+        yield name + "_count", False, lambda db, c=criteria: announcements_repository.count(db, c)
+    yield "comments_by_ads", True, \
+        lambda db: comments_repository.get_comments_by_ads_id(db, users // 2, limit=100)
+    yield "comments_by_ads_after", True, \
+        lambda db: comments_repository.get_comments_by_ads_id(db, users // 2, (datetime(2000, 1, 1), 1), 100)
+    yield "announcements_by_user", False, \
+        lambda db: announcements_repository.get_announcements_by_user(db, users // 2)
+    yield "facets", False, \
+        lambda db: announcements_repository.get_facets(db, AnnouncementSearch(type="rent"))
+    yield "facets_price_edges", False, \
+        lambda db: announcements_repository.get_facets(
+            db, AnnouncementSearch(rooms_count=2, price_from=120000, price_until=450000))
+
+
+def capture_plans(engine, fn, db):
+    statements = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        statements.append((statement, parameters))
+
+    event.listen(engine, "before_cursor_execute", record)
+    try:
+        fn(db)
+    finally:
+        event.remove(engine, "before_cursor_execute", record)
+
+    plans = []
+    with engine.connect() as conn:
+        for statement, parameters in statements:
+            rows = conn.exec_driver_sql("EXPLAIN QUERY PLAN " + statement, parameters).fetchall()
+            plans.extend(row[-1] for row in rows)
+    return plans
+
+
+def full_scans(plans, limited):
+    # A bare "SCAN t" walks the whole table. The one exception is a LIMITed
+    # page read in rowid order (no temp b-tree): the planner picks it for
+    # unselective filters because it stops after the first few matches.
+    if limited and not any("TEMP B-TREE" in p for p in plans):
+        return []
+    return [p for p in plans if p.startswith("SCAN ") and "INDEX" not in p and p.split()[1] not in SUMMARY_TABLES]
+
+
+def measure(fn, db, repeat: int):
+    """p50 and p95 of ``repeat`` runs of ``fn``, in milliseconds."""
+    timings = []
+    for _ in range(repeat):
+        db.expunge_all()
+        started = time.perf_counter()
+        fn(db)
+        timings.append((time.perf_counter() - started) * 1000)
+    return statistics.median(timings), statistics.quantiles(timings, n=20)[-1]
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=20000)
+    parser.add_argument("--announcements", type=int, default=200000)
+    parser.add_argument("--comments", type=int, default=400000)
+    parser.add_argument("--repeat", type=int, default=50)
+    parser.add_argument("--passes", type=int, default=5, help="timing passes per query")
+    parser.add_argument("--tolerance", type=float, default=1.5,
+                        help="fail when p95 exceeds baseline p95 times this factor")
+    parser.add_argument("--baseline", type=Path, default=BASELINE)
+    parser.add_argument("--save-baseline", action="store_true")
+    args = parser.parse_args()
+
+    path = os.path.join(tempfile.mkdtemp(), "bench.db")
+    engine = make_engine(path)
+    started = time.perf_counter()
+    seed(engine, args.users, args.announcements, args.comments)
+    print("seeded %d announcements in %.1fs" % (args.announcements, time.perf_counter() - started))
+
+    Session = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+    results = {}
+    failures = []
+    with Session() as db:
+        for name, limited, fn in workload(args.users):
+            scans = full_scans(capture_plans(engine, fn, db), limited)
+            if scans:
+                failures.append("%s: full table scan (%s)" % (name, "; ".join(scans)))
+
+            # Host noise moves sub-millisecond p95s by 2x between runs. A
+            # baseline keeps its slowest pass and a check its fastest, so
+            # only a slowdown that shows in every pass counts.
+            passes = [measure(fn, db, args.repeat) for _ in range(args.passes)]
+            p50, p95 = (max if args.save_baseline else min)(passes, key=lambda timing: timing[1])
+            results[name] = {"p50_ms": round(p50, 3), "p95_ms": round(p95, 3)}
+            print("%-32s p50 %8.3f ms  p95 %8.3f ms" % (name, p50, p95))
+
+    if args.save_baseline:
+        args.baseline.write_text(json.dumps(results, indent=2, sort_keys=True) + "\n")
+        print("baseline written to %s" % args.baseline)
+    elif not args.baseline.exists():
+        failures.append("no baseline at %s to compare p95 against; write one with --save-baseline" % args.baseline)
+    else:
+        baseline = json.loads(args.baseline.read_text())
+        for name, result in results.items():
+            if name in baseline and result["p95_ms"] > baseline[name]["p95_ms"] * args.tolerance:
+                failures.append("%s: p95 %.3f ms regressed from baseline %.3f ms"
+                                % (name, result["p95_ms"], baseline[name]["p95_ms"]))
+
+    for failure in failures:
+        print("FAIL " + failure)
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,142 @@
+"""Rate limits and write admission under a comment flood and a write burst.
+
+1. Cost of one bucket check, in-memory and shared (a local fake stands in
+   for Redis, so this measures the limiter, not the network).
+2. Two workers with their own buckets vs one shared store: how many of a
+   flood each lets through.
+3. A bot floods POST /shanyraks/{id}/comments while another user posts a
+   few: the bot is cut off with 429 + Retry-After, the user is not.
+4. A burst of concurrent POST /shanyraks/ against a small write cap: the
+   excess is shed with 503 instead of queueing, and admitted requests keep
+   their latency.
+
+    python benchmarks/rate_limit.py --flood 200 --burst 200
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+os.environ.setdefault("JWT_SECRET", "benchmark")
+os.environ.setdefault("DATABASE_URL", "sqlite:///" + os.path.join(tempfile.mkdtemp(), "ratelimit.db"))
+os.environ["RATE_LIMIT_BACKEND"] = "memory"
+os.environ["RATE_LIMIT_COMMENTS"] = "20/60"
+os.environ["RATE_LIMIT_ANNOUNCEMENTS"] = "100000/1"
+os.environ.setdefault("WRITE_CONCURRENCY", "4")
+os.environ.setdefault("WRITE_QUEUE", "8")
+os.environ.setdefault("WRITE_QUEUE_TIMEOUT", "0.5")
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "app"))
+
+import httpx  # noqa: E402
+
+import main  # noqa: E402
+from manage import migrate  # noqa: E402
+from ratelimit import Limit, MemoryRateLimiter, SharedRateLimiter, gcra  # noqa: E402
+
+tokens = main.app.state.tokens
+
+
+class LocalScriptClient:
+    """Stands in for Redis: ``register_script`` returns a callable doing the
+    GCRA script's work on a dict under a lock, shared by every limiter built
+    on this client."""
+
+    def __init__(self):
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def register_script(self, script):
+        def run(keys, args):
+            now, interval, count, cost = float(args[0]), float(args[1]), int(args[2]), int(args[3])
+            with self.lock:
+                tat, wait = gcra(self.values.get(keys[0]), now, Limit(count, interval * count), cost)
+                if tat is not None:
+                    self.values[keys[0]] = tat
+            return repr(wait).encode()
+        return run
+
+
+def check_cost(repeat: int) -> None:
+    limit = Limit(1000000, 1)
+    for name, limiter in (("memory", MemoryRateLimiter()), ("shared (local fake)", SharedRateLimiter(LocalScriptClient()))):
+        started = time.perf_counter()
+        for i in range(repeat):
+            limiter.acquire("bench:user:%d" % (i % 1000), limit)
+        print("acquire %-20s %6.2f us" % (name, (time.perf_counter() - started) / repeat * 1e6))
+
+
+def workers_sharing(flood: int) -> None:
+    limit = Limit(20, 60)
+    client = LocalScriptClient()
+    for name, workers in (("memory, 2 workers", [MemoryRateLimiter(), MemoryRateLimiter()]),
+                          ("shared, 2 workers", [SharedRateLimiter(client), SharedRateLimiter(client)])):
+        allowed = sum(workers[i % 2].acquire("comments:ip:1", limit) == 0 for i in range(flood))
+        print("%-20s %d of %d allowed (limit %d/%gs)" % (name, allowed, flood, limit.count, limit.seconds))
+
+
+async def flood_comments(client, flood: int) -> None:
+    bot = {"Authorization": "Bearer " + tokens.create(1, "bot")}
+    user = {"Authorization": "Bearer " + tokens.create(2, "user")}
+    statuses, retry = {}, set()
+    for i in range(flood):
+        response = await client.post("/shanyraks/1/comments", headers=bot, json={"content": "spam %d" % i})
+        statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+        if "retry-after" in response.headers:
+            retry.add(response.headers["retry-after"])
+    user_statuses = [(await client.post("/shanyraks/1/comments", headers=user, json={"content": "hi %d" % i})).status_code
+                     for i in range(5)]
+    print("comment flood: bot %s, Retry-After %s; other user %s" % (statuses, sorted(retry), user_statuses))
+
+
+async def write_burst(client, burst: int) -> None:
+    announcement = {"type": "rent", "price": 100000, "address": "Алматы, Абая 1", "area": 40.0,
+                    "rooms_count": 2, "description": "у метро"}
+
+    async def post(i):
+        headers = {"Authorization": "Bearer " + tokens.create(1000 + i, "burst%d" % i)}
+        started = time.perf_counter()
+        response = await client.post("/shanyraks/", headers=headers, json=announcement)
+        return response.status_code, (time.perf_counter() - started) * 1000
+
+    results = await asyncio.gather(*(post(i) for i in range(burst)))
+    admitted = sorted(ms for status, ms in results if status == 200)
+    shed = sorted(ms for status, ms in results if status == 503)
+    print("write burst of %d (cap %s, queue %s): %d admitted p95 %.1f ms, %d shed (503) p95 %.1f ms"
+          % (burst, os.environ["WRITE_CONCURRENCY"], os.environ["WRITE_QUEUE"], len(admitted),
+             statistics.quantiles(admitted, n=20)[-1] if len(admitted) > 1 else 0,
+             len(shed), statistics.quantiles(shed, n=20)[-1] if len(shed) > 1 else 0))
+
+
+async def run(args) -> None:
+    migrate()
+    async with main.app.router.lifespan_context(main.app):
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            await client.post("/auth/users/", json={"username": "bench", "phone": "0", "password": "bench",
+                                                     "name": "bench", "city": "Almaty"})
+            await client.post("/shanyraks/", headers={"Authorization": "Bearer " + tokens.create(1, "bench")}, json={
+                "type": "rent", "price": 1, "address": "x", "area": 1.0, "rooms_count": 1, "description": "x"})
+            await flood_comments(client, args.flood)
+            await write_burst(client, args.burst)
+    print(main.registry.render().split("# HELP http_requests_rejected_total")[1].split("# HELP")[0].strip())
+
+
+def main_() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--flood", type=int, default=200)
+    parser.add_argument("--burst", type=int, default=200)
+    parser.add_argument("--repeat", type=int, default=100000)
+    args = parser.parse_args()
+
+    check_cost(args.repeat)
+    workers_sharing(args.flood)
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main_()
@@ -0,0 +1,218 @@
+"""Read/write splitting against file-copied SQLite replicas.
+
+Seeds a primary with datagen, copies it to ``--replicas`` files and keeps
+refreshing them every ``--refresh`` seconds with SQLite's online backup,
+which stands in for asynchronous replication: a replica is up to one
+refresh interval behind. The app reads the copies through read-only URIs:
+
+    DB_REPLICA_URLS=sqlite:///file:/tmp/r1.db?mode=ro&uri=true,sqlite:///file:/tmp/r2.db?mode=ro&uri=true
+
+The app keeps its default memory cache; only reads on the primary fill
+it, so a cached response is never older than the primary.
+
+Each balance mode runs in a fresh process and reports:
+
+1. a read-heavy mix (95% GETs): throughput and where the reads went;
+2. read-your-writes: how often a comment is missing from the list fetched
+   right after posting it, with and without the client's cookie;
+3. ejection: a replica is reset to an empty database mid-run; the reads
+   that failed on it before it left the rotation, and how soon it is back
+   once the replicator restores it.
+
+    python benchmarks/replicas.py
+    python benchmarks/replicas.py --replicas 3 --requests 3000
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+os.environ.setdefault("JWT_SECRET", "benchmark")
+
+PROFILES = {
+    "primary only": {},
+    "round_robin": {"DB_REPLICA_BALANCE": "round_robin"},
+    "least_connections": {"DB_REPLICA_BALANCE": "least_connections"},
+}
+
+
+def copy_database(source: str, target: str) -> None:
+    src, dst = sqlite3.connect(source), sqlite3.connect(target)
+    try:
+        src.backup(dst)
+    finally:
+        src.close()
+        dst.close()
+
+
+class Replicator(threading.Thread):
+    def __init__(self, primary: str, replicas, interval: float):
+        super().__init__(daemon=True)
+        self.primary = primary
+        self.replicas = replicas
+        self.interval = interval
+        self.paused = set()
+        self.stopped = threading.Event()
+
+    def run(self) -> None:
+        while not self.stopped.wait(self.interval):
+            for replica in self.replicas:
+                if replica not in self.paused:
+                    copy_database(self.primary, replica)
+
+
+async def health(client) -> dict:
+    return (await client.get("/health/db")).json()["replicas"]
+
+
+async def read_mix(client, writer, headers, args) -> dict:
+    rnd = random.Random(5)
+    semaphore = asyncio.Semaphore(args.concurrency)
+    errors = 0
+
+    async def one():
+        nonlocal errors
+        id = rnd.randrange(1, args.announcements + 1)
+        async with semaphore:
+            if rnd.random() < 0.05:
+                # Writers are other clients: their read-primary cookie stays in their own jar.
+                response = await writer.post("/shanyraks/%d/comments" % id, headers=headers, json={"content": "mix"})
+            elif rnd.random() < 0.5:
+                response = await client.get("/shanyraks/%d" % id)
+            else:
+                response = await client.get("/shanyraks", params={"rooms_count": rnd.randrange(1, 5),
+                                                                  "count": "none"})
+            errors += response.status_code >= 400
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one() for _ in range(args.requests)))
+    elapsed = time.perf_counter() - started
+    stats = await health(client)
+    return {"throughput_rps": round(args.requests / elapsed, 1), "errors": errors,
+            "primary_reads": stats["primary_reads"], "replica_reads": [r["reads"] for r in stats["replicas"]]}
+
+
+async def read_your_writes(client, headers, args) -> dict:
+    missing = {"cookie": 0, "no cookie": 0}
+    for i in range(args.checks):
+        for mode in missing:
+            content = "ryw %s %d %d" % (mode, os.getpid(), i)
+            client.cookies.clear()
+            await client.post("/shanyraks/1/comments", headers=headers, json={"content": content})
+            if mode == "no cookie":
+                client.cookies.clear()
+            comments = (await client.get("/shanyraks/1/comments", headers=headers, params={"limit": 500})).json()
+            missing[mode] += all(comment["content"] != content for comment in comments)
+    client.cookies.clear()
+    result = {mode: "%d/%d stale" % (count, args.checks) for mode, count in missing.items()}
+    result["lag"] = [replica["lag"] for replica in (await health(client))["replicas"]]
+    return result
+
+
+async def ejection(client, replicator, settings) -> dict:
+    # Reset the first replica to an empty database in place, as a replica
+    # being rebuilt would be, then let the replicator restore it.
+    victim = replicator.replicas[0]
+    replicator.paused.add(victim)
+    empty = victim + ".empty"
+    sqlite3.connect(empty).close()
+    copy_database(empty, victim)
+    failed = 0
+    for _ in range(50):
+        failed += (await client.get("/shanyraks/2")).status_code >= 500
+    stats = await health(client)
+    out = {"failed_before_ejection": failed, "ejected_for": stats["replicas"][0]["ejected_for"]}
+
+    replicator.paused.discard(victim)
+    started = time.perf_counter()
+    before = stats["replicas"][0]["reads"]
+    while time.perf_counter() - started < settings.db_replica_eject_seconds + 10:
+        await client.get("/shanyraks/2")
+        if (await health(client))["replicas"][0]["reads"] > before:
+            out["back_after_s"] = round(time.perf_counter() - started, 1)
+            break
+        await asyncio.sleep(0.1)
+    return out
+
+
+async def child(args) -> dict:
+    import httpx
+
+    import main
+
+    app = main.app
+    services = app.state.services
+    replicator = Replicator(args.primary, args.replica_files, args.refresh)
+    replicator.start()
+    results = {}
+    try:
+        async with app.router.lifespan_context(app):
+            transport = httpx.ASGITransport(app=app, raise_app_exceptions=False)
+            async with httpx.AsyncClient(transport=transport, base_url="http://replicas") as client, \
+                    httpx.AsyncClient(transport=transport, base_url="http://replicas") as writer:
+                headers = {"Authorization": "Bearer " + app.state.tokens.create(1, "user1")}
+                results["mix"] = await read_mix(client, writer, headers, args)
+                if services.replicas.replicas:
+                    results["read_your_writes"] = await read_your_writes(client, headers, args)
+                    results["ejection"] = await ejection(client, replicator, services.settings)
+    finally:
+        replicator.stopped.set()
+    return results
+
+
+def main_() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--announcements", type=int, default=5000)
+    parser.add_argument("--comments", type=int, default=20000)
+    parser.add_argument("--replicas", type=int, default=2)
+    parser.add_argument("--refresh", type=float, default=1.0, help="seconds between replica refreshes")
+    parser.add_argument("--max-lag", type=float, help="DB_REPLICA_MAX_LAG, three refreshes by default")
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--checks", type=int, default=20, help="read-your-writes attempts")
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp()
+    args.primary = os.path.join(directory, "primary.db")
+    args.replica_files = [os.path.join(directory, "replica%d.db" % i) for i in range(1, args.replicas + 1)]
+    if args.child:
+        args.primary, args.replica_files = os.environ["BENCH_PRIMARY"], json.loads(os.environ["BENCH_REPLICAS"])
+        sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "app"))
+        print(json.dumps(asyncio.run(child(args))))
+        return
+
+    os.environ["DATABASE_URL"] = "sqlite:///" + args.primary
+    from datagen import make_engine, seed
+
+    seed(make_engine(args.primary), args.users, args.announcements, args.comments)
+    urls = ",".join("sqlite:///file:%s?mode=ro&uri=true" % path for path in args.replica_files)
+    for profile, overrides in PROFILES.items():
+        for path in args.replica_files:
+            copy_database(args.primary, path)
+        env = dict(os.environ, RATE_LIMIT_BACKEND="none", WRITE_QUEUE="100000",
+                   DB_REPLICA_CHECK_INTERVAL="0.5", DB_REPLICA_MAX_LAG=str(args.max_lag or args.refresh * 3),
+                   BENCH_PRIMARY=args.primary, BENCH_REPLICAS=json.dumps(args.replica_files), **overrides)
+        if overrides:
+            env["DB_REPLICA_URLS"] = urls
+        command = [sys.executable, __file__, "--child"] + sys.argv[1:]
+        output = subprocess.run(command, env=env, check=True, capture_output=True, text=True).stdout
+        result = json.loads(output.strip().splitlines()[-1])
+        print("== %s" % profile)
+        for name, values in result.items():
+            print("  %-16s %s" % (name, values))
+    shutil.rmtree(directory, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main_()
@@ -0,0 +1,110 @@
+"""Requests per second on the list endpoints, before and after column rows.
+
+"before" routes are the old handlers, added to the app for the run:
+/shanyraks returned ORM entities in a dict for jsonable_encoder to walk,
+and comments built a CommentResponse per row and went through
+response_model validation. "after" are the current handlers, which send
+row dicts through FastJSONResponse. Pages hold 100 items; the cache is off.
+
+    python benchmarks/serialization.py --seconds 3
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import List
+
+os.environ.setdefault("JWT_SECRET", "benchmark")
+os.environ.setdefault("DATABASE_URL", "sqlite:///" + os.path.join(tempfile.mkdtemp(), "serialization.db"))
+os.environ["CACHE_BACKEND"] = "none"
+os.environ["METRICS_ENABLED"] = "false"
+os.environ["RATE_LIMIT_BACKEND"] = "none"
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "app"))
+
+from fastapi import Depends  # noqa: E402
+from fastapi.testclient import TestClient  # noqa: E402
+
+import main  # noqa: E402
+from async_repositories import AsyncRepository  # noqa: E402
+from manage import migrate  # noqa: E402
+from models import Announcement, CommentResponse  # noqa: E402
+from repositories import CommentsRepository  # noqa: E402
+from responses import orjson  # noqa: E402
+
+PAGE = 100
+
+
+class LegacyRepository:
+    def search(self, db):
+        return db.query(Announcement).filter(Announcement.type == "rent") \
+            .order_by(Announcement.id).limit(PAGE).all()
+
+    def comments(self, db, id):
+        rows = CommentsRepository().get_comments_by_ads_id(db, id, None, PAGE)
+        return [CommentResponse(id=row.id, content=row.content, created_at=str(row.created_at),
+                                author_id=row.author_id).model_dump() for row in rows]
+
+
+class AsyncLegacyRepository(AsyncRepository):
+    repository_class = LegacyRepository
+
+
+legacy_repository = AsyncLegacyRepository()
+
+
+@main.app.get("/before/shanyraks")
+async def before_search(db=Depends(main.get_db)):
+    announcements = await legacy_repository.search(db)
+    return {"total": None, "announcements": announcements, "next_cursor": None}
+
+
+@main.app.get("/before/shanyraks/{id}/comments", response_model=List[CommentResponse])
+async def before_comments(id: int, db=Depends(main.get_db)):
+    return await legacy_repository.comments(db, id)
+
+
+def requests_per_second(client, url, params, seconds):
+    client.get(url, params=params)
+    done = 0
+    started = time.perf_counter()
+    while time.perf_counter() - started < seconds:
+        client.get(url, params=params)
+        done += 1
+    return done / (time.perf_counter() - started)
+
+
+def main_() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--seconds", type=float, default=3)
+    args = parser.parse_args()
+
+    migrate()
+    # One portal for the whole run; without the context manager every
+    # request starts its own event loop thread, which swamps the handler.
+    with TestClient(main.app) as client:
+        user = {"username": "bench", "phone": "0", "password": "bench", "name": "bench", "city": "Almaty"}
+        client.post("/auth/users/", json=user)
+        token = client.post("/auth/users/login", data={"username": "bench", "password": "bench"}).json()["access_token"]
+        headers = {"Authorization": "Bearer " + token}
+        rows = "\n".join('{"type": "rent", "price": %d, "address": "Алматы, Абая %d", "area": 40.0, '
+                         '"rooms_count": 2, "description": "у метро, с мебелью"}' % (100000 + i, i) for i in range(300))
+        client.post("/shanyraks/bulk", content=rows, headers=dict(headers, **{"Content-Type": "application/x-ndjson"}))
+        for i in range(PAGE):
+            client.post("/shanyraks/1/comments", headers=headers, json={"content": "comment %d" % i})
+
+        client.headers.update(headers)
+        cases = [
+            ("/shanyraks", "/before/shanyraks", "/shanyraks", {"type": "rent", "limit": PAGE, "count": "none"}),
+            ("comments", "/before/shanyraks/1/comments", "/shanyraks/1/comments", {"limit": PAGE}),
+        ]
+        print("encoder: %s" % ("orjson" if orjson is not None else "json (stdlib)"))
+        for name, before, after, params in cases:
+            old = requests_per_second(client, before, params, args.seconds)
+            new = requests_per_second(client, after, params, args.seconds)
+            print("%-12s before %8.1f req/s  after %8.1f req/s  x%.2f" % (name, old, new, new / old))
+
+
+if __name__ == "__main__":
+    main_()
@@ -0,0 +1,155 @@
+"""Similar listings: index build, query latency and the SQL scan it replaces.
+
+Seeds a database per size in ``--sizes`` with datagen, then for each
+``--text-features`` setting starts the app in a fresh process, waits for
+the index's first rebuild and reports:
+
+- build: rebuild time from the database, matrix size, process RSS;
+- index: ``similar_to`` alone, for random listings;
+- endpoint: ``GET /shanyraks/{id}/similar`` end to end, which adds one
+  query for the rows found;
+- upsert: one incremental update, as a save or an edit does;
+- sql_scan: an ad-hoc weighted distance in ORDER BY ... LIMIT, the per-view
+  scan the index avoids.
+
+    python benchmarks/similar.py
+    python benchmarks/similar.py --sizes 100000 --text-features 0,16,64
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+os.environ.setdefault("JWT_SECRET", "benchmark")
+
+APP_DIR = Path(__file__).resolve().parent.parent / "app"
+
+SQL_SCAN = """
+SELECT id FROM announcements
+WHERE id != :id
+ORDER BY abs(price - :price) / :price_std + abs(area - :area) / :area_std + abs(rooms_count - :rooms_count)
+         + (type != :type) * 1.5
+         + abs(latitude - :latitude) / :latitude_std + abs(longitude - :longitude) / :longitude_std
+LIMIT :limit
+"""
+
+SQL_STDS = """
+SELECT sqrt(avg(price * price) - avg(price) * avg(price)), sqrt(avg(area * area) - avg(area) * avg(area)),
+       sqrt(avg(latitude * latitude) - avg(latitude) * avg(latitude)),
+       sqrt(avg(longitude * longitude) - avg(longitude) * avg(longitude))
+FROM announcements
+"""
+
+
+def rss_mb() -> float:
+    with open("/proc/self/status") as status:
+        for line in status:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) / 1024
+    return 0.0
+
+
+def quantiles(seconds) -> dict:
+    cuts = statistics.quantiles(seconds, n=100)
+    return {"p50_ms": round(cuts[49] * 1000, 3), "p99_ms": round(cuts[98] * 1000, 3)}
+
+
+def timed(call, arguments) -> list:
+    timings = []
+    for argument in arguments:
+        started = time.perf_counter()
+        call(argument)
+        timings.append(time.perf_counter() - started)
+    return timings
+
+
+async def child(args, size: int) -> dict:
+    import httpx
+    from sqlalchemy import select, text
+
+    import main
+    from similar import SIMILAR_COLUMNS, SimilarRow
+
+    app = main.app
+    services = app.state.services
+    index = services.similar
+    rnd = random.Random(7)
+    ids = [rnd.randrange(1, size + 1) for _ in range(args.queries)]
+    result = {}
+    async with app.router.lifespan_context(app):
+        while index.rebuilds == 0:
+            await asyncio.sleep(0.05)
+        stats = index.stats()
+        result["build"] = {"seconds": stats["rebuild_seconds"], "dimensions": stats["dimensions"],
+                           "matrix_mb": round(stats["bytes"] / 2 ** 20, 1), "rss_mb": round(rss_mb(), 1)}
+
+        result["index"] = quantiles(timed(lambda id: index.similar_to(id, args.limit), ids))
+
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://similar") as client:
+            timings = []
+            for id in ids:
+                started = time.perf_counter()
+                response = await client.get("/shanyraks/%d/similar" % id, params={"limit": args.limit})
+                timings.append(time.perf_counter() - started)
+                response.raise_for_status()
+            result["endpoint"] = quantiles(timings)
+
+        with services.database.SessionLocal() as db:
+            rows = [SimilarRow(*row) for row in db.execute(
+                select(*SIMILAR_COLUMNS).where(SIMILAR_COLUMNS[0].in_(ids)))]
+            result["upsert"] = quantiles(timed(index.upsert, rows * 5))
+
+            stds = dict(zip(("price_std", "area_std", "latitude_std", "longitude_std"),
+                            db.execute(text(SQL_STDS)).one()))
+            scans = [dict(row._asdict(), limit=args.limit, **stds) for row in rows[:args.scans]]
+            result["sql_scan"] = quantiles(timed(lambda params: db.execute(text(SQL_SCAN), params).all(), scans))
+    return result
+
+
+def main_() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", default="100000,1000000", help="comma-separated listing counts")
+    parser.add_argument("--text-features", default="0,32", help="comma-separated SIMILAR_TEXT_FEATURES")
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("--scans", type=int, default=20, help="SQL scan queries, they are slow")
+    parser.add_argument("--limit", type=int, default=10)
+    parser.add_argument("--child", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    sys.path.insert(0, str(APP_DIR))
+    if args.child is not None:
+        print(json.dumps(asyncio.run(child(args, args.child))))
+        return
+
+    from datagen import make_engine, seed
+
+    for size in [int(value) for value in args.sizes.split(",")]:
+        directory = tempfile.mkdtemp()
+        path = os.path.join(directory, "similar.db")
+        started = time.perf_counter()
+        seed(make_engine(path), 1000, size, 1000)
+        print("== %d listings (seeded in %.0f s)" % (size, time.perf_counter() - started))
+        for text_features in args.text_features.split(","):
+            env = dict(os.environ, DATABASE_URL="sqlite:///" + path, SIMILAR_TEXT_FEATURES=text_features,
+                       SIMILAR_REBUILD_INTERVAL="3600", CACHE_BACKEND="none", RATE_LIMIT_BACKEND="none",
+                       TASKS_BACKEND="inline")
+            command = [sys.executable, __file__, "--child", str(size)] + sys.argv[1:]
+            output = subprocess.run(command, env=env, check=True, capture_output=True, text=True).stdout
+            result = json.loads(output.strip().splitlines()[-1])
+            print("  text_features=%s" % text_features)
+            for name, values in result.items():
+                print("    %-10s %s" % (name, values))
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main_()
@@ -0,0 +1,141 @@
+"""Worker startup time, cold and forked from a preloaded parent.
+
+Each cold run is a fresh interpreter that imports the app, runs its
+lifespan startup and serves one request, timing each step. The preload
+run imports the app once, checks that nothing a forked worker must not
+share exists yet (no database engine, no threads besides the main one),
+then forks ``--workers`` children that each start up and serve a request,
+as ``gunicorn --preload`` does.
+
+    python benchmarks/startup.py
+    python benchmarks/startup.py --runs 10 --workers 8
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+os.environ.setdefault("JWT_SECRET", "benchmark")
+
+APP_DIR = Path(__file__).resolve().parent.parent / "app"
+
+STEPS = ["import", "create_app", "startup", "first_request", "shutdown"]
+
+
+async def serve_once(app) -> dict:
+    import httpx
+
+    timings = {}
+    started = time.perf_counter()
+    async with app.router.lifespan_context(app):
+        timings["startup"] = time.perf_counter() - started
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://startup") as client:
+            started = time.perf_counter()
+            response = await client.get("/shanyraks", params={"limit": 1})
+            timings["first_request"] = time.perf_counter() - started
+            response.raise_for_status()
+        started = time.perf_counter()
+    timings["shutdown"] = time.perf_counter() - started
+    return timings
+
+
+def cold() -> dict:
+    started = time.perf_counter()
+    sys.path.insert(0, str(APP_DIR))
+    import main
+
+    timings = {"import": time.perf_counter() - started}
+    started = time.perf_counter()
+    app = main.create_app()
+    timings["create_app"] = time.perf_counter() - started
+    timings.update(asyncio.run(serve_once(app)))
+    return timings
+
+
+def preload(workers: int) -> dict:
+    import httpx  # noqa: F401  loaded by the server itself before it forks
+
+    sys.path.insert(0, str(APP_DIR))
+    started = time.perf_counter()
+    import main
+
+    imported = time.perf_counter() - started
+    if main.app.state.services.database is not None or threading.active_count() != 1:
+        raise SystemExit("the imported app already holds connections or threads")
+
+    children = {}
+    for _ in range(workers):
+        read, write = os.pipe()
+        forked = time.perf_counter()
+        pid = os.fork()
+        if pid == 0:
+            os.close(read)
+            timings = asyncio.run(serve_once(main.app))
+            timings["ready"] = time.perf_counter() - forked - timings["shutdown"]
+            os.write(write, json.dumps(timings).encode())
+            os._exit(0)
+        os.close(write)
+        children[pid] = read
+
+    results = []
+    for pid, read in children.items():
+        with os.fdopen(read) as pipe:
+            results.append(json.loads(pipe.read()))
+        os.waitpid(pid, 0)
+    return {"import": imported, "workers": results}
+
+
+def ms(seconds: float) -> str:
+    return "%7.1f ms" % (seconds * 1000)
+
+
+def main_() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--child", choices=["cold", "preload"], help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child == "cold":
+        print(json.dumps(cold()))
+        return
+    if args.child == "preload":
+        print(json.dumps(preload(args.workers)))
+        return
+
+    sys.path.insert(0, str(APP_DIR))
+    from manage import migrate
+
+    url = "sqlite:///" + os.path.join(tempfile.mkdtemp(), "startup.db")
+    migrate(url)
+    env = dict(os.environ, DATABASE_URL=url)
+
+    def child(*argv: str) -> dict:
+        output = subprocess.run([sys.executable, __file__, *argv], env=env, check=True,
+                                capture_output=True, text=True).stdout
+        return json.loads(output.strip().splitlines()[-1])
+
+    runs = [child("--child", "cold") for _ in range(args.runs)]
+    print("cold start, median of %d fresh interpreters:" % args.runs)
+    for step in STEPS:
+        print("  %-14s %s" % (step, ms(statistics.median(run[step] for run in runs))))
+    ready = [sum(run[step] for step in STEPS[:-1]) for run in runs]
+    print("  %-14s %s" % ("ready", ms(statistics.median(ready))))
+
+    result = child("--child", "preload", "--workers", str(args.workers))
+    workers = result["workers"]
+    print("preload: import once %s, then %d forked workers:" % (ms(result["import"]), args.workers))
+    for step in ("startup", "first_request", "ready"):
+        values = [worker[step] for worker in workers]
+        print("  %-14s median %s  max %s" % (step, ms(statistics.median(values)), ms(max(values))))
+
+
+if __name__ == "__main__":
+    main_()
@@ -0,0 +1,79 @@
+"""Full-text search benchmark over a seeded announcement corpus.
+
+Compares the ranked FTS5 search behind GET /shanyraks/search with a
+LIKE scan that ranks in Python, for a handful of typical queries.
+
+    python benchmarks/text_search.py --announcements 200000
+"""
+import argparse
+import os
+import statistics
+import tempfile
+import time
+
+from sqlalchemy import and_, or_
+from sqlalchemy.orm import sessionmaker
+
+from datagen import make_engine, seed
+
+from models import Announcement, AnnouncementSearch  # noqa: E402
+from repositories import AnnouncementsRepository  # noqa: E402
+
+QUERIES = [
+    ("Алматы 2 комнаты у метро", {}),
+    ("Астана новостройка", {"type": "sale"}),
+    ("Абая с ремонтом", {"rooms_count": 3}),
+    ("вид на горы", {"price_from": 100000, "price_until": 400000}),
+]
+
+announcements_repository = AnnouncementsRepository()
+
+
+def like_scan(db, query, criteria, limit):
+    # What an index-less implementation would do: every word must appear,
+    # and without a relevance score the whole match set is read and sorted
+    # by how many times the words occur.
+    words = query.lower().split()
+    matches = [or_(Announcement.address.ilike("%" + word + "%"),
+                   Announcement.description.ilike("%" + word + "%")) for word in words]
+    rows = db.query(Announcement).filter(and_(*matches), *announcements_repository.search_filters(criteria)).all()
+    rows.sort(key=lambda a: -sum((a.address + " " + a.description).lower().count(word) for word in words))
+    return rows[:limit]
+
+
+def measure(fn, repeat):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        timings.append((time.perf_counter() - started) * 1000)
+    return statistics.median(timings), statistics.quantiles(timings, n=20)[-1]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=20000)
+    parser.add_argument("--announcements", type=int, default=200000)
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--limit", type=int, default=20)
+    args = parser.parse_args()
+
+    engine = make_engine(os.path.join(tempfile.mkdtemp(), "text.db"))
+    started = time.perf_counter()
+    seed(engine, args.users, args.announcements, 0)
+    print("seeded and indexed %d announcements in %.1fs" % (args.announcements, time.perf_counter() - started))
+
+    Session = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+    with Session() as db:
+        for query, params in QUERIES:
+            criteria = AnnouncementSearch(**params)
+            hits = announcements_repository.text_search(db, query, criteria, args.limit)
+            fts = measure(lambda: announcements_repository.text_search(db, query, criteria, args.limit), args.repeat)
+            like = measure(lambda: like_scan(db, query, criteria, args.limit), args.repeat)
+            print("%-28s %-40s fts p50 %7.2f p95 %7.2f ms | like p50 %7.2f p95 %7.2f ms | top: %s"
+                  % (query, params, fts[0], fts[1], like[0], like[1],
+                     hits[0][0].address if hits else "-"))
+
+
+if __name__ == "__main__":
+    main()
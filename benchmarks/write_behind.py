@@ -0,0 +1,136 @@
+"""Write latency and facet convergence with the facet upsert inline vs queued.
+
+Each mode runs in a fresh interpreter (settings are read at import) against
+its own SQLite file:
+
+1. POST /shanyraks/ latency with TASKS_BACKEND=inline, memory and outbox,
+   one writer at a time and ``--concurrency`` writers at once.
+2. How long after the last write the facet summary catches up, and how
+   many worker batches that took.
+3. Shutdown drain: after the client exits, the summary matches the
+   announcements table.
+4. Outbox recovery: a process that dies with tasks still queued leaves
+   them in task_outbox; the next one sweeps them in once their lease
+   lapses and the summary matches again.
+
+    python benchmarks/write_behind.py --writes 500
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+os.environ.setdefault("JWT_SECRET", "benchmark")
+
+MODES = ["inline", "memory", "outbox"]
+
+
+def facet_drift(main) -> int:
+    from sqlalchemy import func, select
+
+    from models import Announcement, AnnouncementFacet
+
+    with main.app.state.services.database.SessionLocal() as db:
+        summary = db.scalar(select(func.coalesce(func.sum(AnnouncementFacet.count), 0)))
+        rows = db.scalar(select(func.count(Announcement.id)))
+    return rows - summary
+
+
+def wait_for_facets(main, timeout: float = 30) -> float:
+    started = time.perf_counter()
+    while facet_drift(main) and time.perf_counter() - started < timeout:
+        time.sleep(0.002)
+    return (time.perf_counter() - started) * 1000
+
+
+def child(args) -> None:
+    sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "app"))
+    from fastapi.testclient import TestClient
+
+    import main
+    from manage import migrate
+
+    migrate()
+    tasks = main.app.state.services.tasks
+
+    headers = {"Authorization": "Bearer " + main.app.state.tokens.create(1, "bench")}
+    announcement = {"type": "rent", "price": 100000, "address": "Алматы, Абая 1", "area": 40.0,
+                    "rooms_count": 2, "description": "у метро"}
+
+    if args.phase == "recover":
+        with TestClient(main.app):
+            print("recovered in %.1f ms (lease %ss) drift %d"
+                  % (wait_for_facets(main), main.settings.tasks_lease, facet_drift(main)))
+            print("stats %s" % tasks.stats())
+        return
+
+    with TestClient(main.app) as client:
+        if args.phase == "crash":
+            # Stop the worker so the writes below stay queued, then die without draining.
+            for worker in tasks.workers:
+                client.portal.call(cancel, worker)
+        def post(i: int) -> float:
+            body = dict(announcement, price=50000 + i * 1000, rooms_count=1 + i % 4)
+            started = time.perf_counter()
+            client.post("/shanyraks/", headers=headers, json=body)
+            return (time.perf_counter() - started) * 1000
+
+        for label, workers in (("serial", 1), ("concurrent", args.concurrency)):
+            started = time.perf_counter()
+            with ThreadPoolExecutor(workers) as pool:
+                timings = list(pool.map(post, range(args.writes)))
+            print("%s writes: p50 %.2f ms p95 %.2f ms, %.0f writes/s"
+                  % (label, statistics.median(timings), statistics.quantiles(timings, n=20)[-1],
+                     args.writes / (time.perf_counter() - started)))
+        if args.phase == "crash":
+            print("drift at crash: %d" % facet_drift(main))
+            sys.stdout.flush()
+            os._exit(0)
+        print("facets caught up %.1f ms after the last write" % wait_for_facets(main))
+        print("stats %s" % tasks.stats())
+    print("drift after shutdown drain: %d" % facet_drift(main))
+
+
+async def cancel(worker) -> None:
+    worker.cancel()
+
+
+def run_child(env: dict, *argv: str) -> str:
+    return subprocess.run([sys.executable, __file__, "--child", *argv], env=env, check=True,
+                          capture_output=True, text=True).stdout
+
+
+def main_() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--writes", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--phase", default="run", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        child(args)
+        return
+
+    base = dict(os.environ, CACHE_BACKEND="none", RATE_LIMIT_BACKEND="none", METRICS_ENABLED="false",
+                WRITE_QUEUE="100000")
+    for mode in MODES:
+        env = dict(base, TASKS_BACKEND=mode,
+                   DATABASE_URL="sqlite:///" + os.path.join(tempfile.mkdtemp(), "tasks.db"))
+        print("== %s" % mode)
+        print(run_child(env, "--writes", str(args.writes), "--concurrency", str(args.concurrency)), end="")
+
+    print("== outbox crash and recovery")
+    env = dict(base, TASKS_BACKEND="outbox", TASKS_LEASE="1", TASKS_POLL_INTERVAL="0.2",
+               DATABASE_URL="sqlite:///" + os.path.join(tempfile.mkdtemp(), "tasks.db"))
+    print(run_child(env, "--writes", str(args.writes), "--concurrency", str(args.concurrency),
+                    "--phase", "crash"), end="")
+    print(run_child(env, "--phase", "recover"), end="")
+
+
+if __name__ == "__main__":
+    main_()
@@ -0,0 +1,87 @@
+"""Fixtures: an app per test on its own migrated SQLite file.
+
+The app is built with ``create_app(Settings(...))`` and served through
+its lifespan by TestClient, the same way ``uvicorn --factory`` runs it.
+Background work that would make tests timing-dependent is pinned down:
+tasks run inline, rate limits are off and periodic flushes are far apart.
+Importing main builds the module-level app from the environment, which
+needs JWT_SECRET; the test apps get their own secret from TEST_SETTINGS.
+"""
+import os
+
+os.environ.setdefault("JWT_SECRET", "test-secret")
+
+import pytest  # noqa: E402
+from fastapi.testclient import TestClient  # noqa: E402
+from sqlalchemy import func, select  # noqa: E402
+
+from config import Settings  # noqa: E402
+from main import create_app  # noqa: E402
+from manage import migrate  # noqa: E402
+from models import Announcement  # noqa: E402
+
+TEST_SETTINGS = {
+    "jwt_secret": "test-secret",
+    "tasks_backend": "inline",
+    "rate_limit_backend": "none",
+    "password_scrypt_n": 1024,
+    "counter_flush_interval": 3600,
+    "similar_rebuild_interval": 3600,
+}
+
+USER = {"username": "user", "phone": "87001112233", "password": "secret", "name": "User", "city": "Алматы"}
+
+ANNOUNCEMENT = {"type": "rent", "price": 150000, "address": "Алматы, ул. Абая 10", "area": 42.0,
+                "rooms_count": 2, "description": "Светлая квартира у метро"}
+
+
+@pytest.fixture
+def make_client(tmp_path):
+    """``make_client(**settings)`` starts an app with those settings on a fresh database."""
+    clients = []
+
+    def make(**overrides) -> TestClient:
+        url = "sqlite:///%s" % (tmp_path / ("app%d.db" % len(clients)))
+        migrate(url)
+        client = TestClient(create_app(Settings(**dict(TEST_SETTINGS, database_url=url, **overrides))))
+        client.__enter__()
+        clients.append(client)
+        return client
+
+    yield make
+    for client in reversed(clients):
+        client.__exit__(None, None, None)
+
+
+@pytest.fixture
+def client(make_client) -> TestClient:
+    return make_client()
+
+
+@pytest.fixture
+def signup():
+    """``signup(client, username)`` registers a user and returns its auth headers."""
+    def register(client: TestClient, username: str = USER["username"]) -> dict:
+        response = client.post("/auth/users/", json=dict(USER, username=username))
+        assert response.json() == {"message": "User registered successfully"}
+        response = client.post("/auth/users/login", data={"username": username, "password": USER["password"]})
+        return {"Authorization": "Bearer " + response.json()["access_token"]}
+
+    return register
+
+
+@pytest.fixture
+def headers(client, signup) -> dict:
+    return signup(client)
+
+
+@pytest.fixture
+def post_announcement(client, headers):
+    """``post_announcement(**fields)`` saves a listing as the default user and returns its id."""
+    def post(**fields) -> int:
+        response = client.post("/shanyraks/", headers=headers, json=dict(ANNOUNCEMENT, **fields))
+        assert response.json() == {"message": "Announcement registered successfully"}
+        with client.app.state.services.database.SessionLocal() as db:
+            return db.scalar(select(func.max(Announcement.id)))
+
+    return post
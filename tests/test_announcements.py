@@ -0,0 +1,121 @@
+def test_search_filters_counts_and_pages(client, post_announcement):
+    for i in range(6):
+        post_announcement(type="rent" if i % 2 else "sale", price=100000 * (i + 1), rooms_count=i % 3 + 1)
+
+    page = client.get("/shanyraks", params={"type": "rent", "limit": 2}).json()
+    assert page["total"] == 3
+    assert [item["id"] for item in page["announcements"]] == [2, 4]
+    rest = client.get("/shanyraks", params={"type": "rent", "limit": 2, "cursor": page["next_cursor"],
+                                            "count": "none"}).json()
+    assert [item["id"] for item in rest["announcements"]] == [6]
+    assert rest["total"] is None and rest["next_cursor"] is None
+
+    page = client.get("/shanyraks", params={"price_from": 200000, "price_until": 400000}).json()
+    assert [item["id"] for item in page["announcements"]] == [2, 3, 4]
+    assert client.get("/shanyraks", params={"cursor": "not-a-cursor"}).status_code == 400
+
+
+def test_search_rejects_out_of_range_pages(client, post_announcement):
+    post_announcement()
+    for params in ({"limit": 0}, {"limit": -1}, {"limit": 101}, {"offset": -1}):
+        assert client.get("/shanyraks", params=params).status_code == 422
+    assert len(client.get("/shanyraks", params={"limit": 1, "offset": 0}).json()["announcements"]) == 1
+
+
+def test_get_announcement_revalidates_with_etag(client, headers, post_announcement):
+    id = post_announcement()
+    response = client.get("/shanyraks/%d" % id)
+    assert response.json()["price"] == 150000
+    etag = response.headers["ETag"]
+    assert client.get("/shanyraks/%d" % id, headers={"If-None-Match": etag}).status_code == 304
+
+    client.patch("/shanyraks/%d" % id, headers=headers, json={"type": "rent", "price": 160000, "address": "Алматы",
+                                                              "area": 40.0, "rooms_count": 2, "description": "-"})
+    response = client.get("/shanyraks/%d" % id, headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.json()["price"] == 160000
+    assert client.get("/shanyraks/999").status_code == 404
+
+
+def test_only_the_owner_edits_or_deletes(client, signup, post_announcement):
+    id = post_announcement()
+    other = signup(client, "other")
+    update = {"type": "rent", "price": 1, "address": "x", "area": 1.0, "rooms_count": 1, "description": "x"}
+    assert client.patch("/shanyraks/%d" % id, headers=other, json=update).status_code == 403
+    assert client.delete("/shanyraks/%d" % id, headers=other).status_code == 403
+    assert client.get("/shanyraks/%d" % id).json()["price"] == 150000
+
+
+def test_delete_announcement(client, headers, post_announcement):
+    id = post_announcement()
+    assert client.delete("/shanyraks/%d" % id, headers=headers).json() == {
+        "message": "Announcement deleted successfully", "id": id}
+    assert client.get("/shanyraks/%d" % id).status_code == 404
+
+
+def test_text_search_ranks_matches(client, post_announcement):
+    post_announcement(address="Алматы, ул. Абая 10", description="Квартира у парка")
+    post_announcement(address="Астана, ул. Достык 5", description="Квартира с ремонтом")
+    post_announcement(address="Алматы, ул. Толе би 1", description="Дом с садом")
+
+    found = client.get("/shanyraks/search", params={"q": "квартира алматы"}).json()["announcements"]
+    assert [item["id"] for item in found] == [1]
+    found = client.get("/shanyraks/search", params={"q": "квартиры"}).json()["announcements"]
+    assert sorted(item["id"] for item in found) == [1, 2]
+    assert all(item["score"] > 0 for item in found)
+
+
+def test_text_search_pages_through_the_any_word_fallback(client, post_announcement):
+    for i in range(3):
+        post_announcement(address="Алматы, ул. Абая %d" % i, description="Квартира")
+        post_announcement(address="Астана, ул. Достык %d" % i, description="Дом")
+
+    # No listing has both words, so every page matches any of them.
+    pages = [client.get("/shanyraks/search", params={"q": "квартира астана", "limit": 4, "offset": offset})
+             .json()["announcements"] for offset in (0, 4, 8)]
+    assert [len(page) for page in pages] == [4, 2, 0]
+    assert sorted(item["id"] for page in pages for item in page) == [1, 2, 3, 4, 5, 6]
+
+    # Past the end of an all-words search the pages stay empty.
+    params = {"q": "квартира алматы", "limit": 4}
+    assert len(client.get("/shanyraks/search", params=params).json()["announcements"]) == 3
+    assert client.get("/shanyraks/search", params=dict(params, offset=4)).json()["announcements"] == []
+
+    assert client.get("/shanyraks/search", params={"q": "дом", "limit": 0}).status_code == 422
+    assert client.get("/shanyraks/search", params={"q": "дом", "offset": -1}).status_code == 422
+
+
+def test_facets_count_each_filter_without_its_own(client, post_announcement):
+    post_announcement(type="rent", rooms_count=1, price=100000)
+    post_announcement(type="rent", rooms_count=2, price=200000)
+    post_announcement(type="sale", rooms_count=2, price=30000000)
+
+    facets = client.get("/shanyraks/facets", params={"type": "rent"}).json()
+    assert facets["total"] == 2
+    assert facets["type"] == {"rent": 2, "sale": 1}
+    assert facets["rooms_count"] == {"1": 1, "2": 1}
+    assert sum(bucket["count"] for bucket in facets["price"]) == 2
+
+
+def test_nearby_uses_geocoded_addresses(client, post_announcement):
+    post_announcement(address="Алматы, ул. Абая 10")
+    post_announcement(address="Алматы, пр. Достык 5")
+    post_announcement(address="Астана, ул. Абая 1")
+
+    nearby = client.get("/shanyraks/nearby", params={"lat": 43.2406, "lon": 76.9046, "radius_km": 10}).json()
+    assert [item["id"] for item in nearby] == [1, 2]
+    assert nearby[0]["distance_km"] < nearby[1]["distance_km"]
+    assert client.get("/shanyraks/nearby", params={"lat": 43.2, "lon": 76.9, "radius_km": 500}).status_code == 400
+    assert client.get("/shanyraks/nearby", params={"lat": 43.2, "lon": 76.9, "min_lat": 43}).status_code == 400
+
+
+def test_similar_ranks_closest_listings(client, post_announcement):
+    base = post_announcement(price=150000, area=42.0, rooms_count=2)
+    close = post_announcement(price=155000, area=44.0, rooms_count=2)
+    far = post_announcement(type="sale", price=90000000, area=300.0, rooms_count=6)
+
+    similar = client.get("/shanyraks/%d/similar" % base).json()
+    assert [item["id"] for item in similar] == [close, far]
+    assert similar[0]["distance"] < similar[1]["distance"]
+    assert [item["id"] for item in client.get("/shanyraks/%d/similar" % base, params={"limit": 1}).json()] == [close]
+    assert client.get("/shanyraks/999/similar").status_code == 404
@@ -0,0 +1,15 @@
+import asyncio
+
+import pytest
+
+from async_repositories import AsyncAnnouncementsRepository
+from cache import NullCache
+
+
+def test_only_repository_methods_are_proxied():
+    repository = AsyncAnnouncementsRepository(NullCache())
+    assert asyncio.iscoroutinefunction(repository.get_announcement_version)
+    for name in ("cache", "tasks", "missing", "__deepcopy__"):
+        with pytest.raises(AttributeError):
+            getattr(repository, name)
+    assert not hasattr(repository, "cache")
@@ -0,0 +1,55 @@
+import pytest
+from pydantic import ValidationError
+
+from config import Settings
+from conftest import USER
+
+
+def test_signup_login_and_profile(client, headers):
+    profile = client.get("/auth/users/me", headers=headers).json()
+    assert profile == {"id": 1, "username": USER["username"], "phone": USER["phone"], "name": USER["name"],
+                       "city": USER["city"]}
+
+    update = {"phone": "87009998877", "name": "Renamed", "city": "Астана"}
+    assert client.patch("/auth/users/me", headers=headers, json=update).json() is True
+    assert client.get("/auth/users/me", headers=headers).json() == dict(profile, **update)
+
+
+def test_login_rejects_wrong_password(client, headers):
+    response = client.post("/auth/users/login", data={"username": USER["username"], "password": "wrong"})
+    assert response.status_code == 401
+
+    response = client.post("/auth/users/login", data={"username": "nobody", "password": "wrong"})
+    assert response.status_code == 401
+
+
+def test_protected_routes_need_a_valid_token(client, headers):
+    assert client.get("/auth/users/me").status_code == 401
+    response = client.get("/auth/users/me", headers={"Authorization": "Bearer not-a-token"})
+    assert response.status_code == 401
+    assert response.headers["WWW-Authenticate"] == "Bearer"
+
+
+def test_each_app_signs_with_its_own_jwt_settings(make_client, signup):
+    first = make_client(jwt_secret="first", jwt_ttl=60)
+    second = make_client(jwt_secret="second")
+    headers = signup(first)
+    signup(second)
+
+    claims = first.app.state.tokens.verify(headers["Authorization"].split()[1])
+    assert claims.exp - claims.iat == 60
+    assert first.get("/auth/users/me", headers=headers).status_code == 200
+    assert second.get("/auth/users/me", headers=headers).status_code == 401
+
+    expired = first.app.state.tokens.create(1, USER["username"], now=0)
+    assert first.get("/auth/users/me", headers={"Authorization": "Bearer " + expired}).status_code == 401
+
+
+def test_settings_need_a_jwt_secret(monkeypatch):
+    monkeypatch.delenv("JWT_SECRET")
+    with pytest.raises(RuntimeError, match="JWT_SECRET"):
+        Settings.from_env()
+    with pytest.raises(ValidationError):
+        Settings()
+    monkeypatch.setenv("JWT_SECRET", "from-env")
+    assert Settings.from_env().jwt_secret == "from-env"
@@ -0,0 +1,84 @@
+import json
+
+from conftest import ANNOUNCEMENT
+
+
+def post_bulk(client, headers, body: str, content_type: str):
+    return client.post("/shanyraks/bulk", headers=dict(headers, **{"Content-Type": content_type}),
+                       content=body.encode())
+
+
+def test_ndjson_import_reports_rejected_rows(client, headers):
+    body = "\n".join([json.dumps(ANNOUNCEMENT), "{not json", json.dumps(dict(ANNOUNCEMENT, price="free")),
+                      "", json.dumps(ANNOUNCEMENT)])
+    report = post_bulk(client, headers, body, "application/x-ndjson").json()
+    assert report["inserted"] == 2
+    assert [error["row"] for error in report["errors"]] == [2, 3]
+    assert report["errors"][1]["errors"][0].startswith("price:")
+
+
+def test_csv_import_keeps_quoted_newlines(client, headers):
+    body = ('type,price,address,area,rooms_count,description\n'
+            'rent,150000,"Алматы, ул. Абая 10",42,2,"две строки\nописания"\n'
+            'sale,1,Астана,30\n')
+    report = post_bulk(client, headers, body, "text/csv").json()
+    assert report["inserted"] == 1
+    assert report["errors"] == [{"row": 2, "errors": ["expected 6 columns, got 4"]}]
+    assert client.get("/shanyraks/1").json()["description"] == "две строки\nописания"
+
+
+def test_import_needs_a_known_content_type(client, headers):
+    assert post_bulk(client, headers, json.dumps(ANNOUNCEMENT), "application/json").status_code == 415
+
+
+def test_export_as_ndjson_and_csv(client, signup, headers, post_announcement):
+    post_announcement()
+    post_announcement(price=1)
+    other = signup(client, "other")
+    client.post("/shanyraks/", headers=other, json=ANNOUNCEMENT)
+
+    rows = [json.loads(line) for line in client.get("/shanyraks/export").text.splitlines()]
+    assert [row["id"] for row in rows] == [1, 2, 3]
+    rows = client.get("/shanyraks/export", params={"format": "csv", "user_id": 1}).text.splitlines()
+    assert rows[0].startswith("id,type,price,address")
+    assert len(rows) == 3
+
+
+def test_import_is_charged_per_row(make_client, signup):
+    client = make_client(rate_limit_backend="memory", rate_limit_bulk_rows="5/3600", bulk_chunk_size=2)
+    headers = signup(client)
+    body = "\n".join(json.dumps(ANNOUNCEMENT) for _ in range(7))
+
+    response = post_bulk(client, headers, body, "application/x-ndjson")
+    assert response.status_code == 429
+    assert int(response.headers["Retry-After"]) > 0
+    report = response.json()
+    assert report["inserted"] == 4
+    assert report["errors"][-1]["row"] == 5
+
+    other = signup(client, "other")
+    assert post_bulk(client, other, json.dumps(ANNOUNCEMENT), "application/x-ndjson").json()["inserted"] == 1
+
+
+def test_csv_export_imports_back(client, signup, headers, post_announcement):
+    post_announcement(address="Нигде", description="")
+    post_announcement(description="две строки\nописания")
+    export = client.get("/shanyraks/export", params={"format": "csv"}).text
+
+    other = signup(client, "other")
+    report = post_bulk(client, other, export, "text/csv").json()
+    assert report == {"inserted": 2, "failed": 0, "errors": []}
+    rows = [json.loads(line) for line in client.get("/shanyraks/export", params={"user_id": 2}).text.splitlines()]
+    assert rows[0]["latitude"] is None and rows[0]["description"] == ""
+    assert rows[1]["description"] == "две строки\nописания"
+
+
+def test_csv_import_reports_oversized_and_unterminated_fields(client, headers):
+    header = "type,price,address,area,rooms_count,description\n"
+    long_field = "\n".join("строка %d" % i for i in range(20000))
+    body = header + 'rent,1,a,1,1,"%s"\n' % long_field + "rent,1,a,1.0,1,ok\n" + 'rent,1,a,1,1,"open\n'
+    report = post_bulk(client, headers, body, "text/csv").json()
+    assert report["inserted"] == 1
+    assert [error["row"] for error in report["errors"]] == [1, 3]
+    assert report["errors"][0]["errors"][0].startswith("invalid CSV: field larger than field limit")
+    assert report["errors"][1]["errors"] == ["unterminated quoted field"]
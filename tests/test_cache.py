@@ -0,0 +1,71 @@
+import asyncio
+
+import pytest
+
+import main
+from cache import build_cache
+from conftest import ANNOUNCEMENT
+from repositories import AnnouncementsRepository
+
+
+class FakeRedis:
+    """The redis-py calls RedisCache makes, noting whether each ran on an event loop's thread."""
+
+    def __init__(self):
+        self.values = {}
+        self.on_loop = []
+
+    def record(self) -> None:
+        try:
+            asyncio.get_running_loop()
+            self.on_loop.append(True)
+        except RuntimeError:
+            self.on_loop.append(False)
+
+    def get(self, key):
+        self.record()
+        return self.values.get(key)
+
+    def set(self, key, value, ex=None):
+        self.record()
+        self.values[key] = value
+
+    def delete(self, *keys):
+        self.record()
+        for key in keys:
+            self.values.pop(key, None)
+
+
+@pytest.mark.parametrize("db_async", [True, False], ids=["async", "sync"])
+def test_redis_cache_stays_off_the_event_loop(make_client, signup, monkeypatch, db_async):
+    redis = FakeRedis()
+    monkeypatch.setattr(main, "build_cache", lambda settings: build_cache(settings, client=redis))
+    client = make_client(db_async=db_async, cache_backend="redis")
+    headers = signup(client)
+    client.post("/shanyraks/", headers=headers, json={"type": "rent", "price": 1, "address": "x", "area": 1.0,
+                                                      "rooms_count": 1, "description": "x"})
+
+    assert client.get("/shanyraks/1").json()["price"] == 1
+    assert client.get("/shanyraks/1").json()["price"] == 1
+    assert client.get("/health/cache").json()["hits"] == 1
+    assert redis.on_loop and not any(redis.on_loop)
+
+
+def test_a_fill_that_loses_the_race_with_a_write_is_not_served(client, headers, post_announcement):
+    id = post_announcement()
+    services = client.app.state.services
+    repository = AnnouncementsRepository(services.cache)
+    load = repository.get_announcement_by_id
+
+    def load_then_write(db, id):
+        # The row is read, then a write commits and invalidates before the fill.
+        announcement = load(db, id)
+        client.patch("/shanyraks/%d" % id, headers=headers, json=dict(ANNOUNCEMENT, price=160000))
+        return announcement
+
+    repository.get_announcement_by_id = load_then_write
+    with services.database.SessionLocal() as db:
+        version = repository.get_announcement_version(db, id)[0]
+        assert repository.get_announcement_response(db, id, version)["price"] == 150000
+
+    assert client.get("/shanyraks/%d" % id).json()["price"] == 160000
@@ -0,0 +1,68 @@
+import json
+
+
+def test_comments_page_on_a_cursor(client, headers, post_announcement):
+    id = post_announcement()
+    for i in range(5):
+        client.post("/shanyraks/%d/comments" % id, headers=headers, json={"content": "comment %d" % i})
+
+    response = client.get("/shanyraks/%d/comments" % id, headers=headers, params={"limit": 3})
+    assert [comment["content"] for comment in response.json()] == ["comment 0", "comment 1", "comment 2"]
+    cursor = response.headers["X-Next-Cursor"]
+    response = client.get("/shanyraks/%d/comments" % id, headers=headers, params={"limit": 3, "cursor": cursor})
+    assert [comment["content"] for comment in response.json()] == ["comment 3", "comment 4"]
+    assert "X-Next-Cursor" not in response.headers
+
+    response = client.get("/shanyraks/%d/comments" % id, headers=headers, params={"format": "ndjson"})
+    lines = [json.loads(line) for line in response.text.splitlines()]
+    assert [comment["content"] for comment in lines] == ["comment %d" % i for i in range(5)]
+
+
+def test_comments_revalidate_until_one_changes(client, headers, post_announcement):
+    id = post_announcement()
+    client.post("/shanyraks/%d/comments" % id, headers=headers, json={"content": "first"})
+    etag = client.get("/shanyraks/%d/comments" % id, headers=headers).headers["ETag"]
+    response = client.get("/shanyraks/%d/comments" % id, headers=dict(headers, **{"If-None-Match": etag}))
+    assert response.status_code == 304
+
+    client.patch("/shanyraks/%d/comments/1" % id, headers=headers, json={"content": "edited"})
+    response = client.get("/shanyraks/%d/comments" % id, headers=dict(headers, **{"If-None-Match": etag}))
+    assert response.status_code == 200
+    assert [comment["content"] for comment in response.json()] == ["edited"]
+
+    client.delete("/shanyraks/%d/comments/1" % id, headers=headers)
+    assert client.get("/shanyraks/%d/comments" % id, headers=headers).json() == []
+
+
+def test_only_the_author_edits_a_comment(client, headers, signup, post_announcement):
+    id = post_announcement()
+    client.post("/shanyraks/%d/comments" % id, headers=headers, json={"content": "mine"})
+    other = signup(client, "other")
+    assert client.patch("/shanyraks/%d/comments/1" % id, headers=other, json={"content": "x"}).status_code == 403
+    assert client.delete("/shanyraks/%d/comments/1" % id, headers=other).status_code == 403
+
+
+def test_stream_replays_comments_after_last_event_id(client, headers, post_announcement):
+    id = post_announcement()
+    for i in range(3):
+        client.post("/shanyraks/%d/comments" % id, headers=headers, json={"content": "comment %d" % i})
+
+    response = client.get("/shanyraks/%d/comments/stream" % id, params={"timeout": 0},
+                          headers=dict(headers, **{"Last-Event-ID": "1"}))
+    assert response.headers["content-type"].startswith("text/event-stream")
+    events = [block for block in response.text.split("\n\n") if block.startswith("id:")]
+    assert [block.splitlines()[0] for block in events] == ["id: 2", "id: 3"]
+    assert all("event: comment_created" in block for block in events)
+    assert client.get("/shanyraks/999/comments/stream", params={"timeout": 0}, headers=headers).status_code == 404
+
+
+def test_comments_are_edited_through_their_own_announcement(client, headers, post_announcement):
+    first, second = post_announcement(), post_announcement()
+    client.post("/shanyraks/%d/comments" % second, headers=headers, json={"content": "on the second"})
+
+    path = "/shanyraks/%d/comments/1" % first
+    assert client.patch(path, headers=headers, json={"content": "moved"}).status_code == 404
+    assert client.delete(path, headers=headers).status_code == 404
+    assert client.delete("/shanyraks/%d/comments/99" % second, headers=headers).status_code == 404
+    assert [c["content"] for c in client.get("/shanyraks/%d/comments" % second, headers=headers).json()] == [
+        "on the second"]
@@ -0,0 +1,35 @@
+from models import Announcement
+from repositories import AnnouncementsRepository
+
+
+def flush(client) -> None:
+    client.portal.call(client.app.state.services.flush_counters)
+
+
+def test_flushed_counters_reach_cached_listings(client, headers, post_announcement):
+    id = post_announcement()
+    response = client.get("/shanyraks/%d" % id)
+    assert response.json()["view_count"] == 0
+    etag = response.headers["ETag"]
+    client.post("/auth/users/favorites/shanyraks/%d" % id, headers=headers)
+    assert client.get("/health/counters").json()["pending"] == 2
+
+    flush(client)
+    response = client.get("/shanyraks/%d" % id, headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert (response.json()["view_count"], response.json()["favorites_count"]) == (1, 1)
+    assert client.get("/health/counters").json()["flushed_rows"] == 2
+
+
+def test_reconcile_corrects_drifted_counters(client, headers, post_announcement):
+    id = post_announcement()
+    client.post("/shanyraks/%d/comments" % id, headers=headers, json={"content": "first"})
+    client.post("/auth/users/favorites/shanyraks/%d" % id, headers=headers)
+    flush(client)
+    with client.app.state.services.database.SessionLocal() as db:
+        db.query(Announcement).filter(Announcement.id == id).update({"comment_count": 5, "favorites_count": 0})
+        db.commit()
+        assert AnnouncementsRepository().reconcile_counters(db) == 1
+        assert AnnouncementsRepository().reconcile_counters(db) == 0
+        row = db.get(Announcement, id)
+        assert (row.comment_count, row.favorites_count) == (1, 1)
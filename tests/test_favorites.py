@@ -0,0 +1,30 @@
+FAVORITES = "/auth/users/favorites/shanyraks"
+
+
+def test_add_list_and_remove_favorites(client, headers, post_announcement):
+    for _ in range(5):
+        post_announcement()
+
+    assert client.post(FAVORITES + "/2", headers=headers).status_code == 200
+    assert client.post(FAVORITES + "/2", headers=headers).status_code == 200
+    assert client.post(FAVORITES + "/99", headers=headers).status_code == 404
+    assert client.post(FAVORITES, headers=headers, json={"ids": [1, 2, 3, 4, 99]}).json() == {"added": 3}
+
+    page = client.get(FAVORITES, headers=headers, params={"limit": 3}).json()
+    assert [item["id"] for item in page["cart_favorite"]] == [1, 2, 3]
+    rest = client.get(FAVORITES, headers=headers, params={"limit": 3, "cursor": page["next_cursor"]}).json()
+    assert [item["id"] for item in rest["cart_favorite"]] == [4]
+    assert rest["next_cursor"] is None
+
+    assert client.request("DELETE", FAVORITES, headers=headers, json={"ids": [1, 3, 5]}).json() == {"removed": 2}
+    assert client.delete(FAVORITES + "/2", headers=headers).status_code == 200
+    assert client.delete(FAVORITES + "/2", headers=headers).status_code == 404
+    assert [item["id"] for item in client.get(FAVORITES, headers=headers).json()["cart_favorite"]] == [4]
+
+
+def test_favorites_are_per_user(client, headers, signup, post_announcement):
+    post_announcement()
+    client.post(FAVORITES + "/1", headers=headers)
+    other = signup(client, "other")
+    assert client.get(FAVORITES, headers=other).json()["cart_favorite"] == []
+    assert client.post(FAVORITES, headers=headers, json={"ids": []}).status_code == 422
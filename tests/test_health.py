@@ -0,0 +1,20 @@
+from metrics import TimedRoute
+
+
+def test_health_endpoints(client):
+    assert client.get("/health/db").json()["async"] is True
+    for name in ("cache", "counters", "tasks", "similar", "events"):
+        assert client.get("/health/%s" % name).status_code == 200
+
+
+def test_metrics_count_requests(client):
+    client.get("/shanyraks")
+    response = client.get("/metrics")
+    assert response.headers["content-type"].startswith("text/plain")
+    assert "/shanyraks" in response.text
+
+
+def test_endpoints_are_timed_once(client):
+    routes = [route for route in client.app.routes if isinstance(route, TimedRoute)]
+    assert routes
+    assert not any(hasattr(route.endpoint.__wrapped__, "__wrapped__") for route in routes)
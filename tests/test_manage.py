@@ -0,0 +1,19 @@
+import sqlite3
+
+from manage import INITIAL_REVISION, migrate
+
+
+def test_migrate_adopts_a_database_made_before_alembic(tmp_path):
+    # The schema create_all used to build, with a row in it and no alembic_version.
+    path = tmp_path / "old.db"
+    url = "sqlite:///%s" % path
+    migrate(url, INITIAL_REVISION)
+    with sqlite3.connect(path) as db:
+        db.execute("DROP TABLE alembic_version")
+        db.execute("INSERT INTO users (username) VALUES ('user')")
+
+    assert migrate(url) is True
+    assert migrate(url) is False
+    with sqlite3.connect(path) as db:
+        assert db.execute("SELECT count(*) FROM users").fetchone() == (1,)
+        assert db.execute("SELECT count(*) FROM favorites").fetchone() == (0,)
@@ -0,0 +1,88 @@
+"""SQL statements per request, checked against an upper bound per endpoint.
+
+Drives every route with the cache disabled and fails when a request sends
+more statements than its bound, which is how N+1 patterns (one query per
+favorite, per comment, per relationship) show up.
+"""
+import json
+
+import pytest
+
+from query_counter import QueryCounter
+
+from conftest import ANNOUNCEMENT, USER
+
+FAVORITES = 20
+COMMENTS = 30
+BULK_ROWS = 200
+
+# (name, method, url, bound). Bounds include the ownership lookup and the
+# version bump around a write, and the facet upsert that runs inline here
+# (TASKS_BACKEND=inline). Requests run in this order on one database.
+ENDPOINTS = [
+    ("post_signup", "POST", "/auth/users/", 1),
+    ("post_login", "POST", "/auth/users/login", 1),
+    ("get_profile", "GET", "/auth/users/me", 1),
+    ("patch_profile", "PATCH", "/auth/users/me", 2),
+    ("post_add_ads", "POST", "/shanyraks/", 2),
+    ("post_bulk_ads", "POST", "/shanyraks/bulk", 2),
+    ("export_announcements", "GET", "/shanyraks/export", 1),
+    ("search_announcements", "GET", "/shanyraks", 2),
+    ("get_announcement_facets", "GET", "/shanyraks/facets", 2),
+    ("get_nearby_announcements", "GET", "/shanyraks/nearby", 3),
+    ("text_search_announcements", "GET", "/shanyraks/search", 1),
+    ("get_announcement", "GET", "/shanyraks/1", 2),
+    ("get_similar_announcements", "GET", "/shanyraks/1/similar", 1),
+    ("patch_announcement", "PATCH", "/shanyraks/1", 4),
+    ("post_add_comment", "POST", "/shanyraks/1/comments", 2),
+    ("get_comments", "GET", "/shanyraks/1/comments", 2),
+    ("stream_comments", "GET", "/shanyraks/1/comments/stream", 2),
+    ("patch_comment", "PATCH", "/shanyraks/1/comments/1", 3),
+    ("delete_comment", "DELETE", "/shanyraks/1/comments/2", 3),
+    ("post_favorites_batch", "POST", "/auth/users/favorites/shanyraks", 1),
+    ("get_to_favorite_ads", "GET", "/auth/users/favorites/shanyraks", 1),
+    ("delete_favorites", "DELETE", "/auth/users/favorites/shanyraks/1", 1),
+    ("delete_announcements", "DELETE", "/shanyraks/%d" % FAVORITES, 5),
+]
+
+
+def requests(headers: dict) -> dict:
+    return {
+        "post_signup": {"json": dict(USER, username="counts2")},
+        "post_login": {"data": {"username": USER["username"], "password": USER["password"]}},
+        "patch_profile": {"json": {"phone": "1", "name": "string", "city": "string"}},
+        "post_add_ads": {"json": ANNOUNCEMENT},
+        "post_bulk_ads": {"content": "\n".join([json.dumps(ANNOUNCEMENT)] * BULK_ROWS),
+                          "headers": dict(headers, **{"Content-Type": "application/x-ndjson"})},
+        "search_announcements": {"params": {"type": "rent", "rooms_count": 2}},
+        "get_announcement_facets": {"params": {"type": "rent", "price_from": 120000}},
+        "get_nearby_announcements": {"params": {"lat": 43.2389, "lon": 76.8897, "type": "rent"}},
+        "text_search_announcements": {"params": {"q": "Алматы метро"}},
+        "patch_announcement": {"json": dict(ANNOUNCEMENT, price=160000)},
+        "post_add_comment": {"json": {"content": "one more"}},
+        "patch_comment": {"json": {"content": "edited"}},
+        "stream_comments": {"params": {"timeout": 0}, "headers": dict(headers, **{"Last-Event-ID": "0"})},
+        "post_favorites_batch": {"json": {"ids": list(range(1, FAVORITES + 1))}},
+    }
+
+
+@pytest.mark.parametrize("db_async", [True, False], ids=["async", "sync"])
+def test_statements_per_request(make_client, signup, db_async):
+    client = make_client(db_async=db_async, cache_backend="none")
+    headers = signup(client)
+    for _ in range(FAVORITES):
+        client.post("/shanyraks/", headers=headers, json=ANNOUNCEMENT)
+    for i in range(COMMENTS):
+        client.post("/shanyraks/1/comments", headers=headers, json={"content": "comment %d" % i})
+
+    database = client.app.state.services.database
+    arguments = requests(headers)
+    failures = []
+    for name, method, url, bound in ENDPOINTS:
+        with QueryCounter(*database.engines) as queries:
+            response = client.request(method, url, **dict({"headers": headers}, **arguments.get(name, {})))
+        if queries.count > bound or response.status_code >= 400:
+            statements = "\n".join("    " + " ".join(statement.split())[:160] for statement in queries.statements)
+            failures.append("%s: %d statements (bound %d), HTTP %d\n%s"
+                            % (name, queries.count, bound, response.status_code, statements))
+    assert not failures, "\n".join(failures)
@@ -0,0 +1,70 @@
+import asyncio
+
+from conftest import ANNOUNCEMENT
+from ratelimit import AdmissionMiddleware, Limit, gcra
+
+
+def test_gcra_allows_a_burst_then_refills_evenly():
+    limit = Limit.parse("3/30")
+    tat = None
+    for _ in range(3):
+        tat, wait = gcra(tat, 100.0, limit)
+        assert wait == 0
+    assert gcra(tat, 100.0, limit) == (None, 10.0)
+    assert gcra(tat, 110.0, limit)[1] == 0
+    assert gcra(None, 100.0, limit, cost=4) == (None, 10.0)
+
+
+def test_comment_limit_is_per_user(make_client, signup):
+    client = make_client(rate_limit_backend="memory", rate_limit_comments="2/60")
+    headers = signup(client)
+    client.post("/shanyraks/", headers=headers, json=ANNOUNCEMENT)
+
+    statuses = [client.post("/shanyraks/1/comments", headers=headers, json={"content": "x"}).status_code
+                for _ in range(3)]
+    assert statuses == [200, 200, 429]
+    response = client.post("/shanyraks/1/comments", headers=headers, json={"content": "x"})
+    assert int(response.headers["Retry-After"]) > 0
+
+    other = signup(client, "other")
+    assert client.post("/shanyraks/1/comments", headers=other, json={"content": "x"}).status_code == 200
+    assert 'http_requests_rejected_total{limit="comments",reason="rate_limit"}' in client.get("/metrics").text
+
+
+def test_signup_limit_is_per_client_address(make_client):
+    client = make_client(rate_limit_backend="memory", rate_limit_signup="2/60")
+    user = {"phone": "1", "password": "secret", "name": "n", "city": "c"}
+    statuses = [client.post("/auth/users/", json=dict(user, username="user%d" % i)).status_code for i in range(3)]
+    assert statuses == [200, 200, 429]
+
+
+def test_admission_sheds_writes_beyond_the_queue():
+    release = asyncio.Event()
+
+    async def slow_app(scope, receive, send):
+        await release.wait()
+        await send({"type": "http.response.start", "status": 200, "headers": []})
+        await send({"type": "http.response.body", "body": b""})
+
+    async def request(middleware, method):
+        sent = []
+
+        async def send(message):
+            sent.append(message)
+
+        async def receive():
+            return {"type": "http.request", "body": b""}
+
+        await middleware({"type": "http", "method": method, "headers": []}, receive, send)
+        return sent[0]["status"]
+
+    async def run():
+        middleware = AdmissionMiddleware(slow_app, limit=1, queue=1, timeout=5)
+        running = asyncio.create_task(request(middleware, "POST"))
+        waiting = asyncio.create_task(request(middleware, "POST"))
+        await asyncio.sleep(0.01)
+        shed = await request(middleware, "POST")
+        release.set()
+        return shed, await running, await waiting, await request(middleware, "GET")
+
+    assert asyncio.run(run()) == (503, 200, 200, 200)
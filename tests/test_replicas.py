@@ -0,0 +1,51 @@
+import json
+import sqlite3
+import time
+
+from conftest import ANNOUNCEMENT
+from manage import migrate
+
+
+def copy_database(source: str, target: str) -> None:
+    src, dst = sqlite3.connect(source), sqlite3.connect(target)
+    try:
+        src.backup(dst)
+    finally:
+        src.close()
+        dst.close()
+
+
+def test_replica_reads_do_not_fill_the_cache(make_client, signup, tmp_path):
+    replica = tmp_path / "replica.db"
+    migrate("sqlite:///%s" % replica)
+    client = make_client(db_replica_urls="sqlite:///%s" % replica)
+    headers = signup(client)
+    client.post("/shanyraks/", headers=headers, json=ANNOUNCEMENT)
+    copy_database(str(tmp_path / "app0.db"), str(replica))
+    client.patch("/shanyraks/1", headers=headers, json=dict(ANNOUNCEMENT, price=160000))
+
+    # Without the cookie the read goes to the replica, which is behind.
+    client.cookies.clear()
+    stale = client.get("/shanyraks/1")
+    assert stale.json()["price"] == 150000
+    assert client.get("/health/db").json()["replicas"]["replicas"][0]["reads"] == 1
+
+    client.cookies.set("read_primary_until", str(time.time() + 60))
+    fresh = client.get("/shanyraks/1")
+    assert fresh.json()["price"] == 160000
+    assert fresh.headers["ETag"] != stale.headers["ETag"]
+
+
+def test_refused_bulk_import_still_sends_reads_to_the_primary(make_client, signup, tmp_path):
+    replica = tmp_path / "replica.db"
+    migrate("sqlite:///%s" % replica)
+    client = make_client(db_replica_urls="sqlite:///%s" % replica, rate_limit_backend="memory",
+                         rate_limit_bulk_rows="2/3600", bulk_chunk_size=2)
+    headers = signup(client)
+    body = "\n".join(json.dumps(ANNOUNCEMENT) for _ in range(3)).encode()
+    client.cookies.clear()
+
+    response = client.post("/shanyraks/bulk", headers=dict(headers, **{"Content-Type": "application/x-ndjson"}),
+                           content=body)
+    assert response.status_code == 429 and response.json()["inserted"] == 2
+    assert "read_primary_until=" in response.headers["set-cookie"]
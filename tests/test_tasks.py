@@ -0,0 +1,108 @@
+import asyncio
+
+import pytest
+from sqlalchemy import func, select
+
+from config import Settings
+from conftest import TEST_SETTINGS
+from database import Database
+from manage import migrate
+from models import TaskOutbox
+from tasks import TaskQueue
+
+
+@pytest.fixture
+def database(tmp_path):
+    url = "sqlite:///%s" % (tmp_path / "tasks.db")
+    migrate(url)
+    database = Database(Settings(**dict(TEST_SETTINGS, database_url=url, db_async=False)))
+    yield database
+    database.engine.dispose()
+
+
+def defer(database: Database, queue: TaskQueue, *payloads, commit: bool = True) -> None:
+    with database.SessionLocal() as db:
+        for payload in payloads:
+            queue.defer(db, "note", payload)
+        if commit:
+            db.commit()
+        else:
+            db.rollback()
+
+
+def outbox_rows(database: Database) -> int:
+    with database.SessionLocal() as db:
+        return db.scalar(select(func.count()).select_from(TaskOutbox))
+
+
+async def processed(queue: TaskQueue) -> None:
+    for _ in range(500):
+        if queue.processed:
+            return
+        await asyncio.sleep(0.01)
+    raise AssertionError("no task was processed")
+
+
+def test_committed_tasks_run_in_one_batch(database):
+    seen = []
+    queue = TaskQueue(database.session, batch_window=0.05)
+    queue.register("note", lambda db, payloads: seen.append(payloads))
+
+    async def run():
+        queue.start()
+        defer(database, queue, 1, 2)
+        defer(database, queue, 3, commit=False)
+        await queue.drain(5)
+
+    asyncio.run(run())
+    assert seen == [[1, 2]]
+    assert (queue.processed, queue.batches, queue.dropped) == (2, 1, 0)
+
+
+def test_failing_task_is_retried(database):
+    seen = []
+
+    def flaky(db, payloads):
+        seen.append(payloads)
+        if len(seen) == 1:
+            raise RuntimeError("first attempt fails")
+
+    queue = TaskQueue(database.session, batch_window=0, retry_delay=0.01, durable=True)
+    queue.register("note", flaky)
+
+    async def run():
+        queue.start()
+        defer(database, queue, "x")
+        await processed(queue)
+        await queue.drain(5)
+
+    asyncio.run(run())
+    assert seen == [["x"], ["x"]]
+    assert (queue.retried, queue.failed) == (1, 0)
+    assert outbox_rows(database) == 0
+
+
+def test_outbox_replays_tasks_a_dead_worker_left(database):
+    seen = []
+
+    async def crash():
+        # The task is committed to the outbox, but the worker dies before running it.
+        queue = TaskQueue(database.session, durable=True, lease=0.01)
+        queue.register("note", lambda db, payloads: seen.append(payloads))
+        queue.start()
+        for worker in queue.workers:
+            worker.cancel()
+        defer(database, queue, {"id": 7})
+
+    async def restart():
+        queue = TaskQueue(database.session, durable=True, poll_interval=0.01)
+        queue.register("note", lambda db, payloads: seen.append(payloads))
+        queue.start()
+        await processed(queue)
+        await queue.drain(5)
+
+    asyncio.run(crash())
+    assert seen == [] and outbox_rows(database) == 1
+    asyncio.run(restart())
+    assert seen == [[{"id": 7}]]
+    assert outbox_rows(database) == 0